@@ -18,10 +18,12 @@ Package for the application models and service routes
 This module creates and configures the Flask app and sets up the logging
 and SQL database
 """
+import os
 import sys
 from flask import Flask
+from werkzeug.middleware.proxy_fix import ProxyFix
 from service import config
-from service.common import log_handlers
+from service.common import log_handlers, db_routing
 
 
 ############################################################
@@ -32,26 +34,57 @@ def create_app():
     # Create Flask application
     app = Flask(__name__)
     app.config.from_object(config)
+    if app.config["PROXY_HOPS"]:
+        # the address of the client rather than of the ingress
+        app.wsgi_app = ProxyFix(app.wsgi_app, x_for=app.config["PROXY_HOPS"])
 
     # Initialize Plugins
     # pylint: disable=import-outside-toplevel
-    from service.models import db
+    from service.models import db, upgrade_db
 
     db.init_app(app)
+    db_routing.init_app(app)
 
     with app.app_context():
         # Dependencies require we import the routes AFTER the Flask app is created
         # pylint: disable=wrong-import-position, wrong-import-order, unused-import
         from service import routes, models  # noqa: F401 E402
         from service.common import error_handlers, cli_commands  # noqa: F401, E402
+        from service.common import outbox, local_catalog, rate_limit, invalidation
+        from service.common import shared_cache, resilience, admission
 
         try:
             # db.drop_all()
             db.create_all()
+            # create_all() does not alter the tables of an earlier release
+            upgrade_db()
         except Exception as error:  # pylint: disable=broad-except
-            app.logger.critical("%s: Cannot continue", error)
-            # gunicorn requires exit code 4 to stop spawning workers when they die
-            sys.exit(4)
+            if not os.path.exists(app.config["SNAPSHOT_PATH"]):
+                app.logger.critical("%s: Cannot continue", error)
+                # gunicorn requires exit code 4 to stop spawning workers when they die
+                sys.exit(4)
+            app.logger.critical("%s: Serving the catalog snapshot read-only", error)
+
+        # Shed the requests the database connection pool cannot serve
+        admission.init_app(app)
+
+        # Retry the reads and fail fast while the database keeps failing
+        resilience.init_app(app)
+
+        # Serve reads from a local catalog snapshot while the database is down
+        local_catalog.init_app(app)
+
+        # Share one Product cache between the workers of the host
+        shared_cache.init_app(app)
+
+        # Tell the workers of every replica which cached Products changed
+        invalidation.init_app(app)
+
+        # Limit how fast each client may call the Product operations
+        rate_limit.init_app(app)
+
+        # Publish the Product change events off the request path
+        outbox.init_app(app)
 
         # Set up logging for production
         log_handlers.init_logging(app, "gunicorn.error")
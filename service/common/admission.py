@@ -0,0 +1,166 @@
+######################################################################
+# Copyright 2016, 2024 John J. Rofrano. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+######################################################################
+
+"""
+Admission Control
+
+This module keeps a worker from taking on more database work than its
+connection pool can serve. Without it the excess requests queue inside the
+pool until they time out and every request gets slow; with it a request
+either gets one of ``capacity`` slots (as many as the pool has connections)
+or is turned away early with OverloadedError, so the admitted ones stay fast.
+
+High priority requests (single Product reads and writes) wait up to
+``max_wait`` seconds for a slot. Low priority requests (collection scans)
+never wait: they are shed as soon as fewer than ``reserve`` slots are free,
+someone is already waiting, or the average wait for a slot has grown past
+``target_wait``, which leaves the slots to the cheap requests under load.
+"""
+
+import time
+import threading
+from contextlib import contextmanager
+from service.common import metrics
+
+HIGH = "high"
+LOW = "low"
+
+# weight of the latest wait in the moving average
+SMOOTHING = 0.2
+# seconds it takes the average wait to halve while nobody waits
+HALF_LIFE = 1.0
+
+
+class OverloadedError(Exception):
+    """Used when a request is shed because the worker is overloaded"""
+
+    def __init__(self, message: str, retry_after: float):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class AdmissionController:
+    """
+    Limits the requests doing database work at once
+
+    ``wait_time`` is a moving average of the seconds requests waited for a
+    slot, the queueing delay the pool would otherwise have added. Admitted
+    collection scans count as waits of 0 and the average decays with time,
+    so an idle worker stops shedding even when no item request comes.
+    """
+
+    def __init__(
+        self,
+        capacity: int,
+        reserve: int = 0,
+        max_wait: float = 1.0,
+        target_wait: float = 0.1,
+        retry_after: float = 1.0,
+    ):
+        self.capacity = capacity
+        self.reserve = reserve
+        self.max_wait = max_wait
+        self.target_wait = target_wait
+        self.retry_after = retry_after
+        self.in_flight = 0
+        self.waiting = 0
+        self.wait_time = 0.0
+        self._observed = time.monotonic()
+        self._condition = threading.Condition()
+
+    def acquire(self, priority: str, timeout: float = None):
+        """
+        Takes a slot, waiting for one if the priority allows it
+
+        ``timeout`` shortens the wait, e.g. to what is left of a deadline.
+        Raises OverloadedError when the request is shed.
+        """
+        start = time.monotonic()
+        with self._condition:
+            if priority == LOW:
+                if (
+                    self.in_flight >= self.capacity - self.reserve
+                    or self.waiting
+                    or self._average(start) > self.target_wait
+                ):
+                    self._shed(priority, 0.0)
+                self._observe(0.0)
+            else:
+                wait = self.max_wait if timeout is None else min(self.max_wait, timeout)
+                self.waiting += 1
+                try:
+                    while self.in_flight >= self.capacity:
+                        left = start + wait - time.monotonic()
+                        if left <= 0:
+                            self._shed(priority, time.monotonic() - start)
+                        self._condition.wait(left)
+                finally:
+                    self.waiting -= 1
+                self._observe(time.monotonic() - start)
+            self.in_flight += 1
+
+    def release(self):
+        """Gives a slot back"""
+        with self._condition:
+            self.in_flight -= 1
+            self._condition.notify()
+
+    @contextmanager
+    def admit(self, priority: str, timeout: float = None):
+        """Holds a slot for the duration of the block"""
+        self.acquire(priority, timeout)
+        try:
+            yield
+        finally:
+            self.release()
+
+    def _average(self, now: float) -> float:
+        """Returns the average wait decayed to now, the caller holds the lock"""
+        return self.wait_time * 0.5 ** ((now - self._observed) / HALF_LIFE)
+
+    def _observe(self, waited: float):
+        """Adds a wait to the moving average, the caller holds the lock"""
+        now = time.monotonic()
+        average = self._average(now)
+        self.wait_time = average + (waited - average) * SMOOTHING
+        self._observed = now
+
+    def _shed(self, priority: str, waited: float):
+        """Rejects a request, the caller holds the lock"""
+        if waited:
+            self._observe(waited)
+        metrics.increment("requests_shed")
+        metrics.increment(f"requests_shed_{priority}")
+        raise OverloadedError(
+            f"The service is overloaded, {priority} priority requests are shed",
+            self.retry_after,
+        )
+
+
+def init_app(app):
+    """Sets up admission control when ADMISSION_CAPACITY is configured"""
+    capacity = app.config["ADMISSION_CAPACITY"]
+    if capacity <= 0:
+        return None
+    controller = AdmissionController(
+        capacity,
+        reserve=app.config["ADMISSION_RESERVE"],
+        max_wait=app.config["ADMISSION_MAX_WAIT"],
+        target_wait=app.config["ADMISSION_TARGET_WAIT"],
+        retry_after=app.config["ADMISSION_RETRY_AFTER"],
+    )
+    app.extensions["admission"] = controller
+    return controller
@@ -0,0 +1,144 @@
+######################################################################
+# Copyright 2016, 2024 John J. Rofrano. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+######################################################################
+
+"""
+Caches
+
+This module contains the in-process caches used by the service routes
+"""
+
+import threading
+import time
+from collections import OrderedDict
+from service.common import metrics
+
+
+class TTLCache:
+    """
+    A small thread-safe cache whose entries expire ``ttl`` seconds after
+    they were stored. A ttl of zero disables caching altogether.
+    """
+
+    def __init__(self, ttl: float, maxsize: int = 256):
+        self.ttl = ttl
+        self.maxsize = maxsize
+        self._entries = {}
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        """Returns the cached value for key, or default if missing or expired"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return default
+            expires, value = entry
+            if expires <= time.monotonic():
+                del self._entries[key]
+                return default
+            return value
+
+    def set(self, key, value):
+        """Stores value under key for ttl seconds"""
+        if self.ttl <= 0:
+            return
+        with self._lock:
+            now = time.monotonic()
+            if key not in self._entries and len(self._entries) >= self.maxsize:
+                self._evict(now)
+            self._entries[key] = (now + self.ttl, value)
+
+    def get_or_load(self, key, loader):
+        """Returns the cached value for key, calling loader() on a miss"""
+        value = self.get(key)
+        if value is None:
+            value = loader()
+            self.set(key, value)
+        return value
+
+    def clear(self):
+        """Removes every entry"""
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def _evict(self, now: float):
+        """Drops expired entries, or the oldest one if none have expired"""
+        expired = [key for key, (expires, _) in self._entries.items() if expires <= now]
+        for key in expired:
+            del self._entries[key]
+        if not expired:
+            del self._entries[next(iter(self._entries))]
+
+
+class GenerationCache:
+    """
+    A thread-safe LRU cache whose entries are stamped with a generation
+
+    bump() starts a new generation, which invalidates every entry at once;
+    entries of older generations are dropped as they are looked up or
+    evicted. A value computed while a bump happened is not stored, so pass
+    set() the generation read before computing it. Entries also expire
+    ``ttl`` seconds after they were stored (0 for never). A maxsize of zero
+    disables caching altogether. Hits and misses are counted in the metrics
+    as ``<name>_hits`` and ``<name>_misses``.
+    """
+
+    def __init__(self, name: str, maxsize: int = 256, ttl: float = 0):
+        self.name = name
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.generation = 0
+        self._entries = OrderedDict()  # key -> (generation, expires, value)
+        self._lock = threading.Lock()
+
+    def bump(self):
+        """Invalidates every entry"""
+        with self._lock:
+            self.generation += 1
+
+    def get(self, key, default=None):
+        """Returns the value for key, or default if missing or invalidated"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                generation, expires, value = entry
+                if generation == self.generation and (
+                    not expires or expires > time.monotonic()
+                ):
+                    self._entries.move_to_end(key)
+                    metrics.increment(f"{self.name}_hits")
+                    return value
+                del self._entries[key]
+        metrics.increment(f"{self.name}_misses")
+        return default
+
+    def set(self, key, value, generation: int):
+        """Stores value under key unless the generation has moved on"""
+        if self.maxsize <= 0:
+            return
+        with self._lock:
+            if generation != self.generation:
+                return
+            expires = time.monotonic() + self.ttl if self.ttl else 0
+            self._entries[key] = (generation, expires, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def __len__(self):
+        return len(self._entries)
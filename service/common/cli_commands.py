@@ -16,8 +16,14 @@
 """
 Flask CLI Command Extensions
 """
+
+import time
+import click
 from flask import current_app as app  # Import Flask application
-from service.models import db
+from service.models import db, upgrade_db, products_changed, Product, ProductDeletion
+from service.common.outbox import OutboxRelay, make_sink
+from service.common.snapshot import archive_snapshot, snapshot_lock
+from service.common.seed_data import SeedGenerator, write_batch
 
 
 ######################################################################
@@ -34,3 +40,173 @@ def db_create():
     db.drop_all()
     db.create_all()
     db.session.commit()
+
+
+######################################################################
+# Command to upgrade the tables of an earlier release in place
+# Usage:
+#   flask db-upgrade
+######################################################################
+@app.cli.command("db-upgrade")
+def db_upgrade():
+    """
+    Adds the columns, constraints and indexes the tables are missing and
+    converts the data, keeping every Product. The app also does this when
+    it starts.
+    """
+    for step in upgrade_db():
+        click.echo(f"Applied: {step}")
+    click.echo("The database is up to date")
+
+
+######################################################################
+# Command to drop old tombstones from the change feed deletion log
+# Usage:
+#   flask products-prune-deletions
+######################################################################
+@app.cli.command("products-prune-deletions")
+def products_prune_deletions():
+    """
+    Removes the deletion log entries older than DELETION_LOG_RETENTION.
+    Change tokens older than that are rejected by /api/products/changes.
+    """
+    count = ProductDeletion.prune(app.config["DELETION_LOG_RETENTION"])
+    click.echo(f"Pruned {count} product deletions")
+
+
+######################################################################
+# Command to publish the outbox events
+# Usage:
+#   flask outbox-relay --sink file:/tmp/events.jsonl
+######################################################################
+@app.cli.command("outbox-relay")
+@click.option("--sink", default=None, help="Where to publish, defaults to OUTBOX_SINK")
+@click.option("--once", is_flag=True, help="Stop once the outbox is empty")
+def outbox_relay(sink, once):
+    """
+    Publishes the Product change events in the outbox, either until it is
+    empty or (by default) until interrupted.
+    """
+    target = sink or app.config["OUTBOX_SINK"]
+    if not target:
+        raise click.UsageError("Set OUTBOX_SINK or pass --sink")
+    relay = OutboxRelay(
+        app,
+        make_sink(target),
+        batch_size=app.config["OUTBOX_BATCH_SIZE"],
+        poll_interval=app.config["OUTBOX_POLL_INTERVAL"],
+    )
+    if once:
+        click.echo(f"Relayed {relay.drain()} outbox events")
+    else:
+        relay.run()
+
+
+######################################################################
+# Command to write a columnar snapshot of the catalog
+# Usage:
+#   flask products-snapshot --path /data/products --archive
+######################################################################
+@app.cli.command("products-snapshot")
+@click.option("--path", default=None, help="Where to write, defaults to SNAPSHOT_PATH")
+@click.option(
+    "--chunk-size",
+    default=None,
+    type=click.IntRange(min=1),
+    help="Rows read per chunk, defaults to SNAPSHOT_CHUNK_SIZE",
+)
+@click.option("--archive", is_flag=True, help="Also write <path>.zip")
+def products_snapshot(path, chunk_size, archive):
+    """
+    Writes every product to a directory of memory-mappable .npy column
+    files, streaming the rows from a server-side cursor.
+    """
+    path = path or app.config["SNAPSHOT_PATH"]
+    started = time.perf_counter()
+    with snapshot_lock(path):
+        manifest = Product.snapshot(
+            path, chunk_size=chunk_size or app.config["SNAPSHOT_CHUNK_SIZE"]
+        )
+        elapsed = time.perf_counter() - started
+        click.echo(f"Wrote {manifest['rows']} products to {path} in {elapsed:.2f}s")
+        if archive:
+            click.echo(
+                f"Archived the snapshot to {archive_snapshot(path, path + '.zip')}"
+            )
+
+
+######################################################################
+# Command to bulk load generated products for load testing
+# Usage:
+#   flask products-seed --count 1000000
+######################################################################
+@app.cli.command("products-seed")
+@click.option(
+    "--count",
+    default=1000,
+    show_default=True,
+    type=click.IntRange(min=1),
+    help="Number of products to generate",
+)
+@click.option(
+    "--batch-size",
+    default=10000,
+    show_default=True,
+    type=click.IntRange(min=1),
+    help="Rows generated and written per round trip",
+)
+@click.option(
+    "--price-median",
+    default=40.0,
+    show_default=True,
+    type=click.FloatRange(min=0.01),
+    help="Median of the log-normal price distribution",
+)
+@click.option(
+    "--price-spread",
+    default=1.0,
+    show_default=True,
+    type=click.FloatRange(min=0),
+    help="Sigma of the log-normal price distribution (higher is more skewed)",
+)
+@click.option(
+    "--name-skew",
+    default=1.1,
+    show_default=True,
+    type=click.FloatRange(min=0),
+    help="Zipf exponent for name popularity (0 is uniform)",
+)
+@click.option(
+    "--mean-likes",
+    default=5.0,
+    show_default=True,
+    type=click.FloatRange(min=0),
+    help="Mean of the exponential likes distribution",
+)
+@click.option("--seed", default=None, type=int, help="Random seed for repeatable data")
+# pylint: disable=too-many-arguments, too-many-positional-arguments
+def products_seed(
+    count, batch_size, price_median, price_spread, name_skew, mean_likes, seed
+):
+    """
+    Bulk loads generated products for load testing. Each batch is written
+    with COPY (or a bulk INSERT) and committed on its own.
+    """
+    generator = SeedGenerator(
+        price_median=price_median,
+        price_spread=price_spread,
+        name_skew=name_skew,
+        mean_likes=mean_likes,
+        seed=seed,
+    )
+    table = Product.__table__
+    written = 0
+    started = time.perf_counter()
+    for rows in generator.batches(count, batch_size):
+        written += write_batch(db.session, table, rows)
+        db.session.commit()
+        products_changed.send(Product, action="seed", count=len(rows))
+        elapsed = time.perf_counter() - started
+        click.echo(
+            f"Seeded {written}/{count} products ({written / elapsed:,.0f} rows/s)"
+        )
@@ -0,0 +1,95 @@
+######################################################################
+# Copyright 2016, 2024 John J. Rofrano. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+######################################################################
+
+"""
+Database Routing
+
+This module sends the reads of GET requests to read replicas and everything
+else to the primary database. Replicas are configured as SQLAlchemy binds
+named ``replica_<n>``.
+
+Every successful write returns a consistency token (the time of the write).
+A client that sends the token back on its next reads is routed to the
+primary until ``REPLICA_LAG_WINDOW`` seconds have passed, so it always reads
+its own writes even while the replicas catch up.
+"""
+
+import random
+import time
+from flask import g, has_app_context, request
+from flask_sqlalchemy.session import Session
+
+REPLICA_PREFIX = "replica_"
+TOKEN_HEADER = "X-Consistency-Token"
+READ_METHODS = ("GET", "HEAD")
+
+
+class RoutingSession(Session):
+    """A Session that reads from a replica while the request allows it"""
+
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        if bind is None and not self._flushing and not getattr(clause, "is_dml", False):
+            engine = self._replica_engine()
+            if engine is not None:
+                return engine
+        return super().get_bind(mapper, clause=clause, bind=bind, **kwargs)
+
+    def _replica_engine(self):
+        """Returns the replica chosen for this request, or None for the primary"""
+        if not has_app_context() or not g.get("use_replica"):
+            return None
+        if "replica_engine" not in g:
+            engines = [
+                engine
+                for key, engine in self._db.engines.items()
+                if key and key.startswith(REPLICA_PREFIX)
+            ]
+            g.replica_engine = random.choice(engines) if engines else None
+        return g.replica_engine
+
+
+def read_your_writes(token: str, window: float) -> bool:
+    """Returns True if a consistency token is recent enough to need the primary"""
+    try:
+        age = time.time() - float(token)
+    except (TypeError, ValueError):
+        return False
+    return 0 <= age < window
+
+
+######################################################################
+# Request hooks
+######################################################################
+def init_app(app):
+    """Installs the request hooks that route reads and issue tokens"""
+
+    @app.before_request
+    def route_reads():
+        g.pop("replica_engine", None)
+        g.use_replica = request.method in READ_METHODS and not read_your_writes(
+            request.headers.get(TOKEN_HEADER), app.config["REPLICA_LAG_WINDOW"]
+        )
+
+    @app.after_request
+    def issue_token(response):
+        if request.method not in READ_METHODS and response.status_code < 400:
+            response.headers[TOKEN_HEADER] = f"{time.time():.6f}"
+        return response
+
+    @app.teardown_request
+    def reset_routing(_exception):
+        g.pop("use_replica", None)
+        g.pop("replica_engine", None)
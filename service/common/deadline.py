@@ -0,0 +1,110 @@
+######################################################################
+# Copyright 2016, 2024 John J. Rofrano. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+######################################################################
+
+"""
+Request Deadlines
+
+This module bounds how long a request may take. start() gives the current
+request a budget of seconds, and check() is called between the phases of a
+request (querying, serializing) to give up once the budget is spent.
+
+On PostgreSQL every connection starts with the DATABASE_STATEMENT_TIMEOUT
+as its statement_timeout, which keeps the statements of most requests within
+their budget without a statement of its own. Only a transaction begun with
+less time left than that runs SET LOCAL statement_timeout first (and one
+begun outside of a request lifts the limit). Either way the request fails
+with DeadlineExceededError instead of holding its worker.
+"""
+
+import time
+import psycopg
+from flask import current_app, g, has_app_context
+from psycopg.errors import QueryCanceled
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from service.common import metrics
+from service.common.db_routing import RoutingSession
+
+
+class DeadlineExceededError(Exception):
+    """Used when a request has run out of time"""
+
+
+def start(budget: float):
+    """Gives the current request ``budget`` seconds, none if not positive"""
+    if budget > 0:
+        g.deadline = time.monotonic() + budget
+
+
+def stop():
+    """Lifts the budget of the current request"""
+    g.pop("deadline", None)
+
+
+def remaining():
+    """Returns the seconds left to the current request, or None if unbounded"""
+    if not has_app_context() or "deadline" not in g:
+        return None
+    return g.deadline - time.monotonic()
+
+
+def check(phase: str):
+    """Raises DeadlineExceededError if the current request is out of time"""
+    left = remaining()
+    if left is not None and left <= 0:
+        metrics.increment("deadline_exceeded")
+        raise DeadlineExceededError(f"The request ran out of time before {phase}")
+
+
+@event.listens_for(Engine, "connect")
+def _default_statement_timeout(dbapi_connection, connection_record):
+    """Gives a new PostgreSQL connection the statement_timeout of requests"""
+    if not isinstance(dbapi_connection, psycopg.Connection) or not has_app_context():
+        return
+    timeout = int(current_app.config["DATABASE_STATEMENT_TIMEOUT"] * 1000)
+    if timeout > 0:
+        with dbapi_connection.cursor() as cursor:
+            cursor.execute(f"SET statement_timeout = {timeout}")
+        dbapi_connection.commit()
+        connection_record.info["statement_timeout"] = timeout
+
+
+@event.listens_for(RoutingSession, "after_begin")
+def _statement_timeout(_session, _transaction, connection):
+    """Limits the statements of a new transaction to the time left"""
+    if connection.dialect.name != "postgresql":
+        return
+    default = connection.info.get("statement_timeout", 0)
+    left = remaining()
+    if left is None:
+        if default:
+            connection.exec_driver_sql("SET LOCAL statement_timeout = 0")
+        return
+    check("querying")
+    timeout = max(int(left * 1000), 1)
+    if not default or timeout < default:
+        connection.exec_driver_sql(f"SET LOCAL statement_timeout = {timeout}")
+
+
+@event.listens_for(Engine, "handle_error")
+def _statement_canceled(context):
+    """Reports a statement canceled by the statement_timeout as a deadline"""
+    if isinstance(context.original_exception, QueryCanceled) and (
+        remaining() is not None
+    ):
+        metrics.increment("deadline_exceeded")
+        return DeadlineExceededError("The request ran out of time while querying")
+    return None
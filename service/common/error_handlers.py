@@ -1,7 +1,17 @@
+import math
 from flask import current_app as app
+from sqlalchemy.exc import InterfaceError, OperationalError
 from service.routes import api
-from service.models import DataValidationError
-from . import status
+from service.models import (
+    ChangeTokenExpiredError,
+    DataValidationError,
+    VersionConflictError,
+)
+from service.common.admission import OverloadedError
+from service.common.deadline import DeadlineExceededError
+from service.common.rate_limit import RateLimitExceededError
+from service.common.resilience import CircuitOpenError
+from . import status, metrics
 
 
 @api.errorhandler(DataValidationError)
@@ -13,3 +23,98 @@ def handle_data_validation_error(error):
         "error": "Bad Request",
         "message": message,
     }, status.HTTP_400_BAD_REQUEST
+
+
+@api.errorhandler(VersionConflictError)
+def handle_version_conflict_error(error):
+    message = str(error)
+    app.logger.warning(message)
+    return {
+        "status_code": status.HTTP_412_PRECONDITION_FAILED,
+        "error": "Precondition Failed",
+        "message": message,
+    }, status.HTTP_412_PRECONDITION_FAILED
+
+
+@api.errorhandler(ChangeTokenExpiredError)
+def handle_change_token_expired_error(error):
+    message = str(error)
+    app.logger.warning(message)
+    return {
+        "status_code": status.HTTP_410_GONE,
+        "error": "Gone",
+        "message": message,
+    }, status.HTTP_410_GONE
+
+
+@api.errorhandler(OperationalError)
+@api.errorhandler(InterfaceError)
+def handle_database_unavailable(error):
+    message = "The database is unavailable, the catalog is read-only"
+    app.logger.error("%s: %s", message, error)
+    return (
+        {
+            "status_code": status.HTTP_503_SERVICE_UNAVAILABLE,
+            "error": "Service Unavailable",
+            "message": message,
+        },
+        status.HTTP_503_SERVICE_UNAVAILABLE,
+        {"Retry-After": str(app.config["DATABASE_RETRY_AFTER"])},
+    )
+
+
+@api.errorhandler(RateLimitExceededError)
+def handle_rate_limit_exceeded_error(error):
+    message = str(error)
+    app.logger.warning(message)
+    metrics.increment("rate_limited")
+    return (
+        {
+            "status_code": status.HTTP_429_TOO_MANY_REQUESTS,
+            "error": "Too Many Requests",
+            "message": message,
+        },
+        status.HTTP_429_TOO_MANY_REQUESTS,
+        {"Retry-After": str(math.ceil(error.retry_after))},
+    )
+
+
+@api.errorhandler(OverloadedError)
+def handle_overloaded_error(error):
+    message = str(error)
+    app.logger.warning(message)
+    return (
+        {
+            "status_code": status.HTTP_503_SERVICE_UNAVAILABLE,
+            "error": "Service Unavailable",
+            "message": message,
+        },
+        status.HTTP_503_SERVICE_UNAVAILABLE,
+        {"Retry-After": str(math.ceil(error.retry_after))},
+    )
+
+
+@api.errorhandler(CircuitOpenError)
+def handle_circuit_open_error(error):
+    message = "The database is unavailable, the catalog is read-only"
+    app.logger.warning("%s: %s", message, error)
+    return (
+        {
+            "status_code": status.HTTP_503_SERVICE_UNAVAILABLE,
+            "error": "Service Unavailable",
+            "message": message,
+        },
+        status.HTTP_503_SERVICE_UNAVAILABLE,
+        {"Retry-After": str(math.ceil(error.retry_after))},
+    )
+
+
+@api.errorhandler(DeadlineExceededError)
+def handle_deadline_exceeded_error(error):
+    message = str(error)
+    app.logger.warning(message)
+    return {
+        "status_code": status.HTTP_504_GATEWAY_TIMEOUT,
+        "error": "Gateway Timeout",
+        "message": message,
+    }, status.HTTP_504_GATEWAY_TIMEOUT
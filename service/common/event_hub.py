@@ -0,0 +1,103 @@
+######################################################################
+# Copyright 2016, 2024 John J. Rofrano. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+######################################################################
+
+
+"""
+Event Hub
+
+This module fans events out to every subscriber of the current worker
+process. Publishing never blocks: each subscriber has a bounded queue and a
+subscriber that falls behind far enough to fill it is dropped.
+"""
+
+import queue
+import threading
+
+# returned by Subscription.get() once the subscriber has been dropped
+DROPPED = object()
+
+
+class HubFullError(Exception):
+    """Used when the hub already serves as many subscribers as it allows"""
+
+
+class Subscription:
+    """A subscriber's bounded queue of events"""
+
+    def __init__(self, size: int):
+        self.events = queue.Queue(maxsize=size)
+        self.dropped = False
+
+    def get(self, timeout: float):
+        """Returns the next event, None after ``timeout`` seconds without one
+        or DROPPED if the subscriber was too slow to keep up"""
+        if self.dropped:
+            return DROPPED
+        try:
+            return self.events.get(timeout=timeout)
+        except queue.Empty:
+            return DROPPED if self.dropped else None
+
+
+class EventHub:
+    """
+    An in-process publish/subscribe hub with per subscriber backpressure
+
+    Every published event is offered to every subscriber without waiting.
+    A subscriber whose queue of ``queue_size`` events is full is dropped, it
+    is told so by its next get() and should resynchronize (e.g. from the
+    change feed) before subscribing again. At most ``max_subscribers`` are
+    served at a time.
+    """
+
+    def __init__(self, queue_size: int = 100, max_subscribers: int = 100):
+        self.queue_size = queue_size
+        self.max_subscribers = max_subscribers
+        self._subscriptions = set()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._subscriptions)
+
+    def subscribe(self) -> Subscription:
+        """Returns a new Subscription to the events published from now on"""
+        with self._lock:
+            if len(self._subscriptions) >= self.max_subscribers:
+                raise HubFullError(
+                    f"Already serving {self.max_subscribers} event subscribers"
+                )
+            subscription = Subscription(self.queue_size)
+            self._subscriptions.add(subscription)
+            return subscription
+
+    def unsubscribe(self, subscription: Subscription):
+        """Stops delivering events to a Subscription"""
+        with self._lock:
+            self._subscriptions.discard(subscription)
+
+    def publish(self, event) -> int:
+        """Offers an event to every subscriber, returns how many were dropped"""
+        with self._lock:
+            subscriptions = list(self._subscriptions)
+        dropped = 0
+        for subscription in subscriptions:
+            try:
+                subscription.events.put_nowait(event)
+            except queue.Full:
+                subscription.dropped = True
+                self.unsubscribe(subscription)
+                dropped += 1
+        return dropped
@@ -0,0 +1,243 @@
+######################################################################
+# Copyright 2016, 2024 John J. Rofrano. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+######################################################################
+
+"""
+Cache Invalidation
+
+This module tells the other workers, on this pod or any other replica,
+which Products were changed so they can drop what they cached about them.
+The write paths of the models record the ids they change with invalidate();
+when the transaction commits the configured bus sends them to every other
+worker, where products_invalidated is sent with the ids.
+
+MemoryBus delivers to the buses of the same process that share its peers
+(a single node, or the simulated workers of a test). PostgresBus sends a
+NOTIFY inside the write transaction, so it is only delivered if the change
+commits, and LISTENs on a dedicated connection in a background thread.
+"""
+
+import uuid
+import logging
+import threading
+import psycopg
+from blinker import Namespace
+from flask import current_app, has_app_context
+from sqlalchemy import event, text
+from sqlalchemy.engine import make_url
+from service.common import metrics
+from service.common.db_routing import RoutingSession
+
+logger = logging.getLogger("flask.app")
+
+CHANNEL = "product_invalidations"
+ALL = "*"  # stands for every Product
+MAX_PAYLOAD = 7999  # NOTIFY payloads must be shorter than 8000 bytes
+PENDING = "invalidated_products"  # key of the ids in Session.info
+
+# Signal sent when another worker committed a change. Receivers are called
+# with the bus as the sender and the ``ids`` of the changed Products as a
+# keyword argument, a set that holds ALL when every Product may have changed.
+signals = Namespace()
+products_invalidated = signals.signal("products-invalidated")
+
+
+def invalidate(session, ids=None):
+    """Records the ids of the Products changed in the transaction of session
+
+    Without ids every Product is invalidated, e.g. after a set based change.
+    """
+    session.info.setdefault(PENDING, set()).update([ALL] if ids is None else ids)
+
+
+def encode(origin: str, ids) -> str:
+    """Returns the NOTIFY payload of the ids changed by origin"""
+    payload = f"{origin} {','.join(sorted(str(product_id) for product_id in ids))}"
+    if ALL in ids or len(payload.encode()) > MAX_PAYLOAD:
+        payload = f"{origin} {ALL}"
+    return payload
+
+
+def decode(payload: str) -> tuple:
+    """Returns the origin and the ids of a NOTIFY payload"""
+    origin, ids = payload.split(" ", 1)
+    if ids == ALL:
+        return origin, {ALL}
+    return origin, {int(product_id) for product_id in ids.split(",")}
+
+
+class MemoryBus:
+    """
+    Delivers invalidations to the buses of this process
+
+    Every bus created with the same ``peers`` list receives the changes
+    committed through the others. A bus ignores its own changes, the
+    product_changed signal has already applied them in the worker.
+    """
+
+    def __init__(self, peers: list = None):
+        self.origin = uuid.uuid4().hex
+        self.peers = [] if peers is None else peers
+        self.peers.append(self)
+
+    def publish(self, session, ids):
+        """Called before the transaction of session commits"""
+
+    def committed(self, ids):
+        """Called once the transaction that changed ids has committed"""
+        metrics.increment("invalidations_sent")
+        for bus in self.peers:
+            bus.receive(self.origin, ids)
+
+    def receive(self, origin: str, ids):
+        """Applies the ids changed by another bus"""
+        if origin == self.origin:
+            return
+        metrics.increment("invalidations_received")
+        products_invalidated.send(self, ids=set(ids))
+
+    def close(self):
+        """Stops receiving invalidations"""
+        if self in self.peers:
+            self.peers.remove(self)
+
+
+class PostgresBus(MemoryBus):
+    """
+    Sends invalidations with NOTIFY and receives them with LISTEN
+
+    The receivers are called in an app context of ``app``. The listener
+    reconnects after ``reconnect_delay`` seconds when its connection is
+    lost, and then invalidates every Product because the notifications sent
+    in the meantime are gone.
+    """
+
+    def __init__(
+        self, app, url: str, poll_interval: float = 1.0, reconnect_delay: float = 5.0
+    ):
+        super().__init__()
+        self.app = app
+        # psycopg takes the URL without the SQLAlchemy dialect
+        self.conninfo = (
+            make_url(url)
+            .set(drivername="postgresql")
+            .render_as_string(hide_password=False)
+        )
+        self.poll_interval = poll_interval
+        self.reconnect_delay = reconnect_delay
+        self.listening = threading.Event()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def publish(self, session, ids):
+        session.execute(
+            text("SELECT pg_notify(:channel, :payload)"),
+            {"channel": CHANNEL, "payload": encode(self.origin, ids)},
+        )
+        metrics.increment("invalidations_sent")
+
+    def committed(self, ids):
+        """Nothing to do, PostgreSQL delivers the NOTIFY on commit"""
+
+    def listen(self):
+        """Receives notifications on a new connection until stop() is called"""
+        with psycopg.connect(self.conninfo, autocommit=True) as connection:
+            connection.execute(f"LISTEN {CHANNEL}")
+            self.listening.set()
+            # anything could have changed while no connection was listening
+            products_invalidated.send(self, ids={ALL})
+            while not self._stop.is_set():
+                for notify in connection.notifies(timeout=self.poll_interval):
+                    self.receive(*decode(notify.payload))
+        self.listening.clear()
+
+    def run(self):
+        """Listens, reconnecting after failures, until stop() is called"""
+        while not self._stop.is_set():
+            try:
+                with self.app.app_context():
+                    self.listen()
+            except (psycopg.Error, ValueError) as error:
+                self.listening.clear()
+                logger.warning("Cache invalidation listener failed: %s", error)
+                self._stop.wait(self.reconnect_delay)
+
+    def start(self):
+        """Listens on a background thread"""
+        self._stop.clear()
+        self._thread = threading.Thread(
+            target=self.run, name="invalidation-listener", daemon=True
+        )
+        self._thread.start()
+
+    def close(self):
+        """Stops the background thread"""
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+
+######################################################################
+# Session hooks
+######################################################################
+def _bus():
+    """Returns the bus of the current app, if any"""
+    if not has_app_context():
+        return None
+    return current_app.extensions.get("invalidation_bus")
+
+
+@event.listens_for(RoutingSession, "before_commit")
+def _publish(session):
+    """Sends the invalidations inside the transaction, for buses that can"""
+    ids = session.info.get(PENDING)
+    bus = _bus()
+    if ids and bus is not None:
+        bus.publish(session, ids)
+
+
+@event.listens_for(RoutingSession, "after_commit")
+def _committed(session):
+    """Delivers the invalidations of a committed transaction"""
+    ids = session.info.pop(PENDING, None)
+    bus = _bus()
+    if ids and bus is not None:
+        bus.committed(ids)
+
+
+@event.listens_for(RoutingSession, "after_soft_rollback")
+def _discard(session, _previous_transaction):
+    """Forgets the invalidations of a transaction that was rolled back"""
+    session.info.pop(PENDING, None)
+
+
+def init_app(app):
+    """Sets up the invalidation bus configured by INVALIDATION_BUS"""
+    kind = app.config.get("INVALIDATION_BUS")
+    if kind == "memory":
+        bus = MemoryBus()
+    elif kind == "postgres":
+        bus = PostgresBus(
+            app,
+            app.config["SQLALCHEMY_DATABASE_URI"],
+            reconnect_delay=app.config["INVALIDATION_RECONNECT_DELAY"],
+        )
+        bus.start()
+    else:
+        raise ValueError(f"Unknown invalidation bus: {kind}")
+    app.extensions["invalidation_bus"] = bus
+    app.logger.info("Sending cache invalidations with the %s bus", kind)
+    return bus
@@ -0,0 +1,112 @@
+######################################################################
+# Copyright 2016, 2024 John J. Rofrano. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+######################################################################
+
+"""
+Leaderboard
+
+This module keeps the most liked Products in memory so the top-N endpoint
+never has to scan or sort the catalog
+"""
+
+import bisect
+import threading
+import time
+
+
+class Leaderboard:
+    """
+    An incrementally maintained top-N of serialized Products ranked by likes
+
+    The board holds at most ``capacity`` Products, ordered by likes with ties
+    broken by id. It is loaded from the database with ``loader(capacity)``
+    and then kept current by record() and discard() as Products change.
+    Whenever an update could let a Product outside the board belong on it
+    (a member was deleted or lost likes) the board is reloaded on the next
+    read instead. It is also reloaded every ``max_age`` seconds to pick up
+    changes made by other workers.
+    """
+
+    def __init__(self, loader, capacity: int = 100, max_age: float = 30.0):
+        self.loader = loader
+        self.capacity = capacity
+        self.max_age = max_age
+        self._ranking = []  # sorted (-likes, id) keys
+        self._products = {}  # id -> ((-likes, id), serialized product)
+        self._complete = False  # True when every Product fits on the board
+        self._loaded = None  # monotonic time of the last load
+        self._lock = threading.Lock()
+
+    def top(self, count: int) -> list:
+        """Returns up to ``count`` serialized Products, most liked first"""
+        with self._lock:
+            if self._loaded is None or time.monotonic() - self._loaded > self.max_age:
+                self._load()
+            return [self._products[key[1]][1] for key in self._ranking[:count]]
+
+    def record(self, product: dict):
+        """Adds or refreshes a serialized Product after it was changed"""
+        key = (-product["likes"], product["id"])
+        with self._lock:
+            if self._loaded is None:
+                return
+            # every Product missing from the board ranks below the cut
+            cut = self._ranking[-1] if self._ranking else key
+            current = self._products.get(product["id"])
+            if not self._complete and key > cut:
+                # a member that dropped below the cut may have been overtaken
+                # by a Product that is not on the board
+                if current:
+                    self._remove(current[0])
+                    self._loaded = None
+                return
+            if current:
+                self._remove(current[0])
+            bisect.insort(self._ranking, key)
+            self._products[product["id"]] = (key, product)
+            if len(self._ranking) > self.capacity:
+                self._remove(self._ranking[-1])
+                self._complete = False
+
+    def discard(self, product_id: int):
+        """Removes a Product from the board after it was deleted"""
+        with self._lock:
+            current = self._products.get(product_id)
+            if current:
+                self._remove(current[0])
+                if not self._complete:
+                    self._loaded = None
+
+    def invalidate(self):
+        """Forces a reload from the database on the next read"""
+        with self._lock:
+            self._loaded = None
+
+    def _load(self):
+        """Loads the board from the database"""
+        products = self.loader(self.capacity)
+        self._products = {
+            product["id"]: ((-product["likes"], product["id"]), product)
+            for product in products
+        }
+        self._ranking = sorted(key for key, _ in self._products.values())
+        self._complete = len(products) < self.capacity
+        self._loaded = time.monotonic()
+
+    def _remove(self, key: tuple):
+        """Removes a ranking key and its Product"""
+        index = bisect.bisect_left(self._ranking, key)
+        del self._ranking[index]
+        del self._products[key[1]]
@@ -0,0 +1,136 @@
+######################################################################
+# Copyright 2016, 2024 John J. Rofrano. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+######################################################################
+
+"""
+Local Catalog
+
+This module keeps a memory-mapped catalog snapshot in every worker so the
+Products can still be read while the database is down. A background thread
+rewrites the snapshot periodically; the workers that share a snapshot path
+take turns through a file lock, so only one of them reads the table each time.
+"""
+
+import os
+import logging
+import threading
+from datetime import datetime, timezone
+from service.models import db, Product
+from service.common.snapshot import Snapshot, snapshot_lock
+
+logger = logging.getLogger("flask.app")
+
+
+class LocalCatalog:
+    """
+    The latest catalog snapshot at ``path``, mapped for reading
+
+    current() reopens the snapshot whenever a newer one has been written.
+    Snapshots that were replaced are not closed explicitly: a request may
+    still be reading one, and its maps are released once it is unreferenced.
+    """
+
+    def __init__(self, app, path: str, refresh_interval: float = 0.0):
+        self.app = app
+        self.path = path
+        self.refresh_interval = refresh_interval
+        self._snapshot = None
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def current(self):
+        """Returns the latest Snapshot, or None if none has been written"""
+        with self._lock:
+            target = os.path.realpath(self.path)
+            if self._snapshot is None or self._snapshot.path != target:
+                try:
+                    self._snapshot = Snapshot(self.path)
+                except FileNotFoundError:
+                    pass
+                except (OSError, ValueError, KeyError) as error:
+                    logger.warning("Cannot open the catalog snapshot: %s", error)
+            return self._snapshot
+
+    def age(self):
+        """Returns the seconds since the latest snapshot was written, or None"""
+        snapshot = self.current()
+        if snapshot is None:
+            return None
+        return (datetime.now(timezone.utc) - snapshot.created_time).total_seconds()
+
+    def refresh(self) -> bool:
+        """
+        Writes a new snapshot when the latest one is due for a refresh
+
+        Returns False without waiting when another worker is writing one.
+        """
+        with snapshot_lock(self.path, blocking=False) as locked:
+            if not locked:
+                return False
+            age = self.age()
+            if age is not None and age < self.refresh_interval:
+                return False
+            with self.app.app_context():
+                try:
+                    Product.snapshot(
+                        self.path, chunk_size=self.app.config["SNAPSHOT_CHUNK_SIZE"]
+                    )
+                finally:
+                    db.session.remove()
+        return True
+
+    def run(self):
+        """Refreshes the snapshot until stop() is called"""
+        while not self._stop.is_set():
+            try:
+                self.refresh()
+            except Exception as error:  # pylint: disable=broad-except
+                logger.warning("Catalog snapshot refresh failed: %s", error)
+            self._stop.wait(self.refresh_interval)
+
+    def start(self):
+        """Refreshes the snapshot on a background thread"""
+        self._stop.clear()
+        self._thread = threading.Thread(
+            target=self.run, name="local-catalog", daemon=True
+        )
+        self._thread.start()
+
+    def stop(self):
+        """Stops the background thread"""
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+
+def init_app(app):
+    """
+    Sets up the local catalog, refreshed in the background when
+    SNAPSHOT_REFRESH_INTERVAL is configured
+    """
+    catalog = LocalCatalog(
+        app,
+        app.config["SNAPSHOT_PATH"],
+        refresh_interval=app.config["SNAPSHOT_REFRESH_INTERVAL"],
+    )
+    app.extensions["local_catalog"] = catalog
+    if catalog.refresh_interval > 0:
+        catalog.start()
+        app.logger.info(
+            "Refreshing the catalog snapshot every %ss", catalog.refresh_interval
+        )
+    return catalog
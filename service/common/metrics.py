@@ -0,0 +1,51 @@
+######################################################################
+# Copyright 2016, 2024 John J. Rofrano. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+######################################################################
+
+"""
+Metrics
+
+This module keeps simple named counters for the current worker process.
+They are exposed by the /api/metrics endpoint.
+"""
+
+import threading
+from collections import Counter
+
+_counters = Counter()
+_lock = threading.Lock()
+
+
+def increment(name: str, amount: int = 1):
+    """Adds amount to the named counter"""
+    with _lock:
+        _counters[name] += amount
+
+
+def value(name: str) -> int:
+    """Returns the current value of the named counter"""
+    return _counters[name]
+
+
+def snapshot() -> dict:
+    """Returns a copy of every counter"""
+    with _lock:
+        return dict(_counters)
+
+
+def reset():
+    """Sets every counter back to zero (use for testing)"""
+    with _lock:
+        _counters.clear()
@@ -0,0 +1,195 @@
+######################################################################
+# Copyright 2016, 2024 John J. Rofrano. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+######################################################################
+
+
+"""
+Outbox Relay
+
+This module publishes the Product change events that are written to the
+outbox table in the same transaction as each change. A relay drains the
+outbox in batches and hands every batch to a sink (a file, an HTTP endpoint
+or an in-process queue). Events are only deleted once the sink accepted
+them, so each one is delivered at least once and a consumer should ignore
+event ids it has already seen.
+"""
+
+import os
+import json
+import queue
+import logging
+import threading
+import urllib.request
+from service.models import db, OutboxEvent
+
+logger = logging.getLogger("flask.app")
+
+
+class FileSink:
+    """Appends events to a file as JSON lines"""
+
+    def __init__(self, path: str):
+        self.path = path
+
+    def send(self, events: list):
+        """Writes a batch of events and waits until they are on disk"""
+        with open(self.path, "a", encoding="utf-8") as file:
+            file.writelines(json.dumps(event) + "\n" for event in events)
+            file.flush()
+            os.fsync(file.fileno())
+
+
+class HttpSink:
+    """POSTs each batch of events to a URL as a JSON array"""
+
+    def __init__(self, url: str, timeout: float = 5.0):
+        self.url = url
+        self.timeout = timeout
+
+    def send(self, events: list):
+        """Posts a batch of events, raising unless the response is 2xx"""
+        request = urllib.request.Request(
+            self.url,
+            data=json.dumps(events).encode(),
+            headers={"Content-Type": "application/json"},
+            method="POST",
+        )
+        with urllib.request.urlopen(request, timeout=self.timeout) as response:
+            response.read()
+
+
+class QueueSink:
+    """Puts events on an in-process queue, a stand-in for a message broker"""
+
+    def __init__(self, events: queue.Queue = None):
+        self.events = queue.Queue() if events is None else events
+
+    def send(self, events: list):
+        """Puts every event of a batch on the queue"""
+        for event in events:
+            self.events.put(event)
+
+
+def make_sink(target: str):
+    """Returns the sink for an OUTBOX_SINK setting
+
+    ``queue`` is an in-process queue, ``http://`` and ``https://`` URLs
+    receive POSTs and ``file:<path>`` appends to a file.
+    """
+    if target == "queue":
+        return QueueSink()
+    if target.startswith(("http://", "https://")):
+        return HttpSink(target)
+    if target.startswith("file:"):
+        return FileSink(target.removeprefix("file:"))
+    raise ValueError(f"Unknown outbox sink '{target}'")
+
+
+class OutboxRelay:
+    """
+    Drains the outbox into a sink in batches of ``batch_size`` events
+
+    While the outbox holds a full batch the relay keeps going, otherwise it
+    waits ``poll_interval`` seconds before looking again. Rows are claimed
+    with SELECT ... FOR UPDATE SKIP LOCKED so every worker can run a relay
+    without publishing the same batch twice.
+    """
+
+    def __init__(self, app, sink, batch_size: int = 100, poll_interval: float = 1.0):
+        self.app = app
+        self.sink = sink
+        self.batch_size = batch_size
+        self.poll_interval = poll_interval
+        self._stop = threading.Event()
+        self._thread = None
+
+    def relay_batch(self) -> int:
+        """Publishes the oldest batch of events, returns how many there were"""
+        with self.app.app_context():
+            try:
+                events = (
+                    db.session.execute(
+                        db.select(OutboxEvent)
+                        .order_by(OutboxEvent.id)
+                        .limit(self.batch_size)
+                        .with_for_update(skip_locked=True)
+                    )
+                    .scalars()
+                    .all()
+                )
+                if events:
+                    self.sink.send([event.serialize() for event in events])
+                    db.session.execute(
+                        db.delete(OutboxEvent).where(
+                            OutboxEvent.id.in_([event.id for event in events])
+                        )
+                    )
+                db.session.commit()
+            except Exception:
+                # the events stay in the outbox and are sent again
+                db.session.rollback()
+                raise
+        return len(events)
+
+    def drain(self) -> int:
+        """Publishes batches until the outbox is empty, returns the total"""
+        total = relayed = self.relay_batch()
+        while relayed == self.batch_size:
+            relayed = self.relay_batch()
+            total += relayed
+        return total
+
+    def run(self):
+        """Relays events until stop() is called"""
+        while not self._stop.is_set():
+            try:
+                relayed = self.relay_batch()
+            except Exception as error:  # pylint: disable=broad-except
+                logger.warning("Outbox relay failed, will retry: %s", error)
+                relayed = 0
+            if relayed < self.batch_size:
+                self._stop.wait(self.poll_interval)
+
+    def start(self):
+        """Relays events on a background thread"""
+        self._stop.clear()
+        self._thread = threading.Thread(
+            target=self.run, name="outbox-relay", daemon=True
+        )
+        self._thread.start()
+
+    def stop(self):
+        """Stops the background thread"""
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+
+def init_app(app):
+    """Starts a background relay when OUTBOX_SINK is configured"""
+    target = app.config.get("OUTBOX_SINK")
+    if not target:
+        return None
+    relay = OutboxRelay(
+        app,
+        make_sink(target),
+        batch_size=app.config["OUTBOX_BATCH_SIZE"],
+        poll_interval=app.config["OUTBOX_POLL_INTERVAL"],
+    )
+    relay.start()
+    app.extensions["outbox_relay"] = relay
+    app.logger.info("Relaying outbox events to %s", target)
+    return relay
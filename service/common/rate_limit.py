@@ -0,0 +1,195 @@
+######################################################################
+# Copyright 2016, 2024 John J. Rofrano. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+######################################################################
+
+"""
+Rate Limiting
+
+This module limits how fast each client may call each kind of operation
+with token buckets. Every (client, operation) pair has a bucket that holds
+up to ``burst`` tokens and refills at ``rate`` tokens per second; a request
+takes the cost of its operation from the bucket or is rejected with the
+seconds until enough tokens are back.
+
+The buckets live in a backend: MemoryBackend keeps them in the worker,
+SharedMemoryBackend keeps them in a memory-mapped file that every gunicorn
+worker on the host maps, so the limits hold across workers.
+"""
+
+import os
+import mmap
+import time
+import fcntl
+import struct
+import hashlib
+import threading
+from collections import OrderedDict
+
+
+class RateLimitExceededError(Exception):
+    """Used when a client has run out of tokens for an operation"""
+
+    def __init__(self, message: str, retry_after: float):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+def take(state, cost: float, rate: float, burst: float, now: float) -> tuple:
+    """
+    Takes ``cost`` tokens from a bucket
+
+    ``state`` is the (tokens, updated) of the bucket or None for a new one.
+    Returns the new state and the seconds to wait, zero if the tokens were
+    taken.
+    """
+    tokens, updated = state or (burst, now)
+    tokens = min(burst, tokens + max(now - updated, 0) * rate)
+    if tokens >= cost:
+        return (tokens - cost, now), 0.0
+    return (tokens, now), (cost - tokens) / rate
+
+
+class MemoryBackend:
+    """Token buckets of the current worker, the least recently used go first"""
+
+    def __init__(self, max_keys: int = 10000):
+        self.max_keys = max_keys
+        self._buckets = OrderedDict()
+        self._lock = threading.Lock()
+
+    def update(self, key: str, function) -> float:
+        """Replaces the state of a bucket with function(state)"""
+        with self._lock:
+            state, wait = function(self._buckets.pop(key, None))
+            self._buckets[key] = state
+            if len(self._buckets) > self.max_keys:
+                self._buckets.popitem(last=False)
+            return wait
+
+
+class SharedMemoryBackend:
+    """
+    Token buckets in a memory-mapped file shared by every worker on the host
+
+    The file holds ``slots`` fixed size slots of (key hash, tokens, updated)
+    in groups of GROUP_SIZE. A key can only live in the group its hash picks
+    and takes the slot of the stalest bucket when the group is full. Each
+    update locks just the byte range of its group with lockf(), plus a
+    thread lock because lockf() does not exclude the threads of a process.
+    """
+
+    SLOT = struct.Struct("<Qdd")
+    GROUP_SIZE = 8
+
+    def __init__(self, path: str, slots: int = 4096):
+        self.groups = max(slots // self.GROUP_SIZE, 1)
+        size = self.groups * self.GROUP_SIZE * self.SLOT.size
+        self._fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o600)
+        if os.fstat(self._fd).st_size < size:
+            os.ftruncate(self._fd, size)
+        self._map = mmap.mmap(self._fd, size)
+        self._lock = threading.Lock()
+
+    def update(self, key: str, function) -> float:
+        """Replaces the state of a bucket with function(state)"""
+        digest = hashlib.blake2b(key.encode(), digest_size=8).digest()
+        key_hash = int.from_bytes(digest, "little") or 1  # zero is an empty slot
+        length = self.GROUP_SIZE * self.SLOT.size
+        start = key_hash % self.groups * length
+        with self._lock:
+            fcntl.lockf(self._fd, fcntl.LOCK_EX, length, start)
+            try:
+                slots = [
+                    (offset, *self.SLOT.unpack_from(self._map, offset))
+                    for offset in range(start, start + length, self.SLOT.size)
+                ]
+                match = [slot for slot in slots if slot[1] == key_hash]
+                # otherwise an empty slot (updated 0) or the stalest bucket
+                offset, _, tokens, updated = (
+                    match[0] if match else min(slots, key=lambda slot: slot[3])
+                )
+                state, wait = function((tokens, updated) if match else None)
+                self.SLOT.pack_into(self._map, offset, key_hash, *state)
+            finally:
+                fcntl.lockf(self._fd, fcntl.LOCK_UN, length, start)
+        return wait
+
+    def close(self):
+        """Unmaps the shared file"""
+        self._map.close()
+        os.close(self._fd)
+
+
+class RateLimiter:
+    """
+    Token bucket limits per client and operation
+
+    ``costs`` holds the tokens each operation takes from its bucket, so with
+    a ``rate`` of 100 and a list cost of 10 a client can list 10 times per
+    second, after a burst of up to ``burst`` tokens worth of requests.
+    """
+
+    def __init__(self, backend, costs: dict, rate: float, burst: float):
+        for operation, cost in costs.items():
+            if cost > burst:
+                raise ValueError(f"The {operation} cost is larger than the burst")
+        self.backend = backend
+        self.costs = costs
+        self.rate = rate
+        self.burst = burst
+
+    def acquire(self, client: str, operation: str):
+        """
+        Takes the tokens of an operation from the bucket of the client
+
+        Raises RateLimitExceededError with the seconds to wait when there
+        are not enough tokens.
+        """
+        cost = self.costs[operation]
+        now = time.time()  # shared by every process, unlike monotonic()
+        wait = self.backend.update(
+            f"{client}:{operation}",
+            lambda state: take(state, cost, self.rate, self.burst, now),
+        )
+        if wait > 0:
+            raise RateLimitExceededError(
+                f"Rate limit exceeded for {operation} operations, "
+                f"retry in {wait:.2f} seconds",
+                wait,
+            )
+
+
+def init_app(app):
+    """Sets up the rate limiter when RATE_LIMIT_BACKEND is configured"""
+    kind = app.config.get("RATE_LIMIT_BACKEND")
+    if not kind:
+        return None
+    if kind == "memory":
+        backend = MemoryBackend()
+    elif kind == "shared":
+        backend = SharedMemoryBackend(
+            app.config["RATE_LIMIT_PATH"], slots=app.config["RATE_LIMIT_SLOTS"]
+        )
+    else:
+        raise ValueError(f"Unknown rate limit backend: {kind}")
+    limiter = RateLimiter(
+        backend,
+        costs=app.config["RATE_LIMIT_COSTS"],
+        rate=app.config["RATE_LIMIT_RATE"],
+        burst=app.config["RATE_LIMIT_BURST"],
+    )
+    app.extensions["rate_limiter"] = limiter
+    app.logger.info("Rate limiting with the %s backend", kind)
+    return limiter
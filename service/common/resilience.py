@@ -0,0 +1,204 @@
+######################################################################
+# Copyright 2016, 2024 John J. Rofrano. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+######################################################################
+
+"""
+Resilience
+
+This module shields the request paths from database failures. Idempotent
+calls are retried after transient errors (a dropped connection, a failover)
+with exponential backoff and full jitter, so the retries of many workers do
+not arrive together; writes are never retried, as a write that failed on
+commit may well have been applied.
+
+A circuit breaker watches the outcome of the calls that used the database.
+Once the share of failures within a sliding window crosses a threshold it
+opens and every call fails fast with CircuitOpenError instead of waiting for
+the connection timeout. After ``reset_timeout`` seconds a single trial call
+is let through; its success closes the breaker, its failure opens it again.
+"""
+
+import time
+import random
+import logging
+import threading
+from collections import deque
+from flask import g, has_app_context
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from sqlalchemy.exc import InterfaceError, OperationalError
+from service.common import metrics
+
+logger = logging.getLogger("flask.app")
+
+# errors that may well not happen again on the next attempt
+TRANSIENT_ERRORS = (OperationalError, InterfaceError)
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half-open"
+
+
+class CircuitOpenError(Exception):
+    """Used when a call is rejected because the circuit breaker is open"""
+
+    def __init__(self, message: str, retry_after: float):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class CircuitBreaker:
+    """
+    Fails fast while the database keeps failing
+
+    The breaker opens when at least ``min_calls`` calls were recorded in the
+    last ``window`` seconds and the share of failures among them reached
+    ``threshold``. Outcomes are counted in buckets of one second.
+    """
+
+    def __init__(
+        self,
+        threshold: float = 0.5,
+        min_calls: int = 20,
+        window: float = 10.0,
+        reset_timeout: float = 30.0,
+    ):
+        self.threshold = threshold
+        self.min_calls = min_calls
+        self.window = window
+        self.reset_timeout = reset_timeout
+        self.state = CLOSED
+        self._buckets = deque()  # [second, calls, failures]
+        self._opened = 0.0
+        self._trial = False
+        self._lock = threading.Lock()
+
+    def allow(self):
+        """Raises CircuitOpenError unless a call may go ahead"""
+        with self._lock:
+            if self.state == OPEN:
+                wait = self._opened + self.reset_timeout - time.monotonic()
+                if wait > 0:
+                    metrics.increment("circuit_rejected")
+                    raise CircuitOpenError("The database circuit is open", wait)
+                self.state = HALF_OPEN
+            if self.state == HALF_OPEN:
+                if self._trial:
+                    metrics.increment("circuit_rejected")
+                    raise CircuitOpenError(
+                        "The database circuit is being tested", self.reset_timeout
+                    )
+                self._trial = True
+
+    def record(self, failed):
+        """
+        Records the outcome of an allowed call
+
+        ``failed`` is None for a call that did not use the database.
+        """
+        with self._lock:
+            if self.state == HALF_OPEN:
+                self._trial = False
+                if failed:
+                    self._open()
+                elif failed is not None:
+                    self._close()
+            elif self.state == CLOSED and failed is not None:
+                self._count(failed)
+
+    def _count(self, failed: bool):
+        """Adds an outcome to the window, opening the breaker if need be"""
+        now = time.monotonic()
+        second = int(now)
+        while self._buckets and self._buckets[0][0] <= now - self.window:
+            self._buckets.popleft()
+        if not self._buckets or self._buckets[-1][0] != second:
+            self._buckets.append([second, 0, 0])
+        self._buckets[-1][1] += 1
+        self._buckets[-1][2] += failed
+        calls = sum(bucket[1] for bucket in self._buckets)
+        failures = sum(bucket[2] for bucket in self._buckets)
+        if calls >= self.min_calls and failures >= self.threshold * calls:
+            self._open()
+
+    def _open(self):
+        logger.warning("Database circuit opened for %ss", self.reset_timeout)
+        metrics.increment("circuit_opened")
+        self.state = OPEN
+        self._opened = time.monotonic()
+
+    def _close(self):
+        logger.info("Database circuit closed")
+        self.state = CLOSED
+        self._buckets.clear()
+
+
+@event.listens_for(Engine, "before_cursor_execute")
+def _database_used(*_args):
+    """Flags the current call as one that reached the database"""
+    if has_app_context():
+        g.database_used = True
+
+
+def call(
+    function,
+    breaker: CircuitBreaker,
+    tries: int = 1,
+    delay: float = 0.05,
+    max_delay: float = 1.0,
+    cleanup=None,
+):
+    """
+    Returns function(), retried up to ``tries`` times after transient errors
+
+    Attempt n waits a random time of up to ``delay * 2 ** n`` seconds (at
+    most ``max_delay``) and calls ``cleanup`` first, e.g. to roll back the
+    failed transaction. Pass a single try for calls that are not idempotent.
+    Must be called in an app context.
+    """
+    attempt = 1
+    while True:
+        breaker.allow()
+        g.pop("database_used", None)
+        try:
+            result = function()
+        except TRANSIENT_ERRORS as error:
+            breaker.record(True)
+            if attempt >= tries:
+                raise
+            logger.warning("Retrying after a transient database error: %s", error)
+            metrics.increment("database_retries")
+            if cleanup:
+                cleanup()
+            time.sleep(random.uniform(0, min(max_delay, delay * 2**attempt)))
+            attempt += 1
+            continue
+        except BaseException:
+            breaker.record(False if g.pop("database_used", False) else None)
+            raise
+        breaker.record(False if g.pop("database_used", False) else None)
+        return result
+
+
+def init_app(app):
+    """Sets up the circuit breaker of the database"""
+    breaker = CircuitBreaker(
+        threshold=app.config["CIRCUIT_BREAKER_THRESHOLD"],
+        min_calls=app.config["CIRCUIT_BREAKER_MIN_CALLS"],
+        window=app.config["CIRCUIT_BREAKER_WINDOW"],
+        reset_timeout=app.config["CIRCUIT_BREAKER_RESET_TIMEOUT"],
+    )
+    app.extensions["circuit_breaker"] = breaker
+    return breaker
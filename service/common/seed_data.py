@@ -0,0 +1,219 @@
+######################################################################
+# Copyright 2016, 2024 John J. Rofrano. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+######################################################################
+
+"""
+Seed Data Generator
+
+This module generates large volumes of realistic Product rows for load
+testing. Rows are produced a whole batch at a time as plain tuples and are
+written with a single COPY (PostgreSQL) or executemany INSERT per batch, so
+no ORM objects are created along the way. The rows are created in the past,
+but updated by the transaction that writes them, so the change feed and the
+caches of every worker see them like any other write.
+"""
+
+import math
+import random
+import secrets
+from datetime import datetime, timedelta, timezone
+from itertools import accumulate, product as cartesian
+from sqlalchemy import func, insert
+from service.common.invalidation import invalidate
+
+ADJECTIVES = [
+    "Wireless",
+    "Portable",
+    "Organic",
+    "Classic",
+    "Smart",
+    "Compact",
+    "Deluxe",
+    "Vintage",
+    "Ergonomic",
+    "Rechargeable",
+    "Stainless",
+    "Premium",
+    "Eco",
+    "Ultra",
+    "Mini",
+    "Heavy Duty",
+    "Foldable",
+    "Waterproof",
+    "Digital",
+    "Cordless",
+]
+NOUNS = [
+    "E-Reader",
+    "Vacuum Cleaner",
+    "Jeans",
+    "Potato Chips",
+    "Calculator",
+    "Mouse",
+    "Keyboard",
+    "Headphones",
+    "Water Bottle",
+    "Backpack",
+    "Desk Lamp",
+    "Blender",
+    "Coffee Maker",
+    "Sneakers",
+    "Jacket",
+    "Notebook",
+    "Speaker",
+    "Monitor",
+    "Toaster",
+    "Umbrella",
+    "Sunglasses",
+    "Wallet",
+    "Watch",
+    "Camera",
+    "Tent",
+]
+DESCRIPTIONS = [
+    "Product 1 description",
+    "Product 2 description",
+    "Product 3 description",
+    "Product 4 description",
+    "Product 5 description",
+    None,
+]
+IMAGE_URLS = [
+    "https://t4.ftcdn.net/jpg/01/36/70/67/360_F_136706734_KWhNBhLvY5XTlZVocpxFQK1FfKNOYbMj.jpg",
+    "https://www.ikea.com/us/en/images/products/blahaj-soft-toy-shark__0710175_pe727378_s5.jpg",
+    "https://i.ebayimg.com/images/g/NIkAAOSwXSVhZDSc/s-l1200.jpg",
+    None,
+]
+
+# Columns written for every generated row, in tuple order
+COLUMNS = (
+    "sku",
+    "name",
+    "description",
+    "price_cents",
+    "image_url",
+    "likes",
+    "created_time",
+)
+
+MAX_PRICE = 99999999.99  # largest price the product table accepts
+
+
+def product_names() -> list:
+    """Returns the vocabulary of generated product names"""
+    return [f"{adjective} {noun}" for adjective, noun in cartesian(ADJECTIVES, NOUNS)]
+
+
+def zipf_cum_weights(size: int, exponent: float) -> list:
+    """Returns cumulative Zipf weights (rank ** -exponent) for random.choices"""
+    return list(accumulate(rank**-exponent for rank in range(1, size + 1)))
+
+
+class SeedGenerator:
+    """
+    Generates batches of Product rows with configurable distributions
+
+    Prices are log-normally distributed around ``price_median`` (skewed to
+    the right like a real catalog), names follow a Zipf distribution so a
+    few names are very popular, and likes are exponentially distributed
+    around ``mean_likes``.
+    """
+
+    # pylint: disable=too-many-arguments, too-many-positional-arguments
+    def __init__(
+        self,
+        price_median: float = 40.0,
+        price_spread: float = 1.0,
+        name_skew: float = 1.1,
+        mean_likes: float = 5.0,
+        max_age_days: int = 365,
+        seed: int = None,
+    ):
+        if price_median <= 0:
+            raise ValueError("price_median must be positive")
+        self.rng = random.Random(seed)
+        self.price_mu = math.log(price_median)
+        self.price_sigma = price_spread
+        self.names = product_names()
+        self.name_weights = zipf_cum_weights(len(self.names), name_skew)
+        self.likes_rate = 1.0 / mean_likes if mean_likes > 0 else None
+        self.max_age = max_age_days * 86400.0
+        # every run gets its own SKU prefix so repeated seeding never collides
+        self.sku_prefix = f"SEED-{secrets.token_hex(4).upper()}"
+        self.generated = 0
+
+    def batch(self, size: int) -> list:
+        """Returns the next ``size`` rows as tuples ordered like COLUMNS"""
+        rng = self.rng
+        start = self.generated
+        self.generated += size
+
+        skus = [f"{self.sku_prefix}-{n:010d}" for n in range(start, start + size)]
+        names = rng.choices(self.names, cum_weights=self.name_weights, k=size)
+        descriptions = rng.choices(DESCRIPTIONS, k=size)
+        image_urls = rng.choices(IMAGE_URLS, k=size)
+
+        lognorm = rng.lognormvariate
+        mu, sigma = self.price_mu, self.price_sigma
+        prices = [
+            round(min(max(lognorm(mu, sigma), 0.01), MAX_PRICE) * 100) for _ in skus
+        ]
+
+        if self.likes_rate:
+            expo, rate = rng.expovariate, self.likes_rate
+            likes = [int(expo(rate)) for _ in skus]
+        else:
+            likes = [0] * size
+
+        now = datetime.now(timezone.utc).replace(tzinfo=None)
+        uniform, max_age = rng.uniform, self.max_age
+        created = [now - timedelta(seconds=uniform(0, max_age)) for _ in skus]
+
+        return list(zip(skus, names, descriptions, prices, image_urls, likes, created))
+
+    def batches(self, count: int, batch_size: int):
+        """Yields batches until ``count`` rows have been generated"""
+        remaining = count
+        while remaining > 0:
+            size = min(batch_size, remaining)
+            remaining -= size
+            yield self.batch(size)
+
+
+def write_batch(session, table, rows: list) -> int:
+    """
+    Writes a batch of rows to the table in one round trip
+
+    PostgreSQL connections stream the rows with COPY FROM STDIN, anything
+    else falls back to a bulk executemany INSERT. The updated_time of every
+    row is the start of the transaction, as for any other write, and every
+    Product is invalidated when it commits.
+    """
+    connection = session.connection()
+    if connection.dialect.name == "postgresql":
+        # COPY takes no expressions, so read now() as a column default would
+        updated = connection.exec_driver_sql("SELECT localtimestamp").scalar_one()
+        columns = ", ".join((*COLUMNS, "updated_time"))
+        cursor = connection.connection.driver_connection.cursor()
+        with cursor.copy(f"COPY {table.name} ({columns}) FROM STDIN") as copy:
+            for row in rows:
+                copy.write_row((*row, updated))
+    else:
+        connection.execute(
+            insert(table).values(updated_time=func.now()),
+            [dict(zip(COLUMNS, row)) for row in rows],
+        )
+    invalidate(session)
+    return len(rows)
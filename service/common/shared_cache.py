@@ -0,0 +1,213 @@
+######################################################################
+# Copyright 2016, 2024 John J. Rofrano. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+######################################################################
+
+"""
+Shared Cache
+
+This module keeps a cache in a memory-mapped file that every gunicorn worker
+on the host maps, so the workers share one warm cache instead of each
+filling its own copy.
+
+The file starts with a header of (generation, slots, slot size), followed
+by ``slots`` fixed size slots. A slot holds (sequence, generation, key,
+stored time, length) and the compact JSON of one value, and a key can only
+live in slot ``key % slots``. Writers lock the byte range of their slot with
+lockf(); readers take no lock at all. Each write makes the sequence of the
+slot odd while it is in progress and even again once it is done, so a reader
+that sees the same even sequence before and after copying a value knows it
+was not torn (a seqlock).
+"""
+
+import os
+import json
+import mmap
+import time
+import fcntl
+import struct
+import threading
+from contextlib import contextmanager
+from service.common import metrics
+
+HEADER = struct.Struct("<QII")  # generation, slots, slot size
+HEADER_SIZE = 64
+SLOT = struct.Struct("<QQqdI")  # sequence, generation, key, stored, length
+SEQUENCE = struct.Struct("<Q")
+
+
+class SharedCache:
+    """
+    A cache of JSON values keyed by integer ids, shared through a file
+
+    Like the GenerationCache, clear() starts a new generation and a value
+    is stored with the stamp() taken before computing it, so a value that
+    was invalidated while it was computed is not stored. Entries expire
+    ``ttl`` seconds after they were stored (0 for never). Values that do not
+    fit in a slot are not cached. Hits and misses are counted in the metrics
+    as ``<name>_hits`` and ``<name>_misses``.
+    """
+
+    # a reader that keeps meeting writes gives up and reports a miss
+    READ_ATTEMPTS = 4
+
+    def __init__(
+        self, name: str, path: str, slots: int = 4096, slot_size: int = 1024, ttl=0
+    ):
+        self.name = name
+        self.slots = slots
+        self.slot_size = slot_size
+        self.ttl = ttl
+        size = HEADER_SIZE + slots * slot_size
+        self._fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o600)
+        self._lock = threading.Lock()
+        with self._locked(0, HEADER_SIZE):
+            if os.fstat(self._fd).st_size < size or self._layout() != (
+                slots,
+                slot_size,
+            ):
+                # a new file, or one laid out for other settings
+                os.ftruncate(self._fd, 0)
+                os.ftruncate(self._fd, size)
+                os.pwrite(self._fd, HEADER.pack(1, slots, slot_size), 0)
+        self._map = mmap.mmap(self._fd, size)
+
+    def _layout(self) -> tuple:
+        """Returns the slots and slot size the file was created with"""
+        _, slots, slot_size = HEADER.unpack(os.pread(self._fd, HEADER.size, 0))
+        return slots, slot_size
+
+    @contextmanager
+    def _locked(self, offset: int, length: int):
+        """Locks a byte range of the file against the other threads and workers"""
+        with self._lock:
+            fcntl.lockf(self._fd, fcntl.LOCK_EX, length, offset)
+            try:
+                yield
+            finally:
+                fcntl.lockf(self._fd, fcntl.LOCK_UN, length, offset)
+
+    def _offset(self, key: int) -> int:
+        return HEADER_SIZE + key % self.slots * self.slot_size
+
+    def _sequence(self, offset: int) -> int:
+        return SEQUENCE.unpack_from(self._map, offset)[0]
+
+    @property
+    def generation(self) -> int:
+        """The current generation, entries of older ones are invalid"""
+        return HEADER.unpack_from(self._map)[0]
+
+    def stamp(self, key: int) -> tuple:
+        """Returns the stamp to store a value for key with, see set()"""
+        return self.generation, self._sequence(self._offset(key))
+
+    def get(self, key: int, default=None):
+        """Returns the value for key, or default if missing or invalidated"""
+        offset = self._offset(key)
+        capacity = self.slot_size - SLOT.size
+        for _ in range(self.READ_ATTEMPTS):
+            sequence, generation, stored_key, stored, length = SLOT.unpack_from(
+                self._map, offset
+            )
+            if sequence % 2:
+                continue  # a write is in progress
+            if (
+                stored_key != key
+                or not length
+                or generation != self.generation
+                or (self.ttl and stored + self.ttl <= time.time())
+            ):
+                break
+            start = offset + SLOT.size
+            end = start + min(length, capacity)
+            data = self._map[start:end]
+            if self._sequence(offset) == sequence:
+                metrics.increment(f"{self.name}_hits")
+                return json.loads(data)
+        metrics.increment(f"{self.name}_misses")
+        return default
+
+    def set(self, key: int, value, stamp: tuple) -> bool:
+        """
+        Stores value under key unless it changed since the stamp was taken
+
+        Returns True if the value was stored.
+        """
+        data = json.dumps(value, separators=(",", ":")).encode()
+        if len(data) > self.slot_size - SLOT.size:
+            return False
+        offset = self._offset(key)
+        with self._locked(offset, self.slot_size):
+            generation, sequence = stamp
+            if generation != self.generation or self._sequence(offset) != sequence:
+                return False
+            self._write(offset, key, data)
+        return True
+
+    def delete(self, key: int):
+        """Invalidates the value for key"""
+        offset = self._offset(key)
+        with self._locked(offset, self.slot_size):
+            # always a write: a value read before this must not be stored
+            self._write(offset, key, b"")
+
+    def _write(self, offset: int, key: int, data: bytes):
+        """Replaces the slot at offset, the caller holds its lock"""
+        sequence = self._sequence(offset)
+        SEQUENCE.pack_into(self._map, offset, sequence + 1)
+        SLOT.pack_into(
+            self._map,
+            offset,
+            sequence + 1,
+            self.generation,
+            key,
+            time.time(),
+            len(data),
+        )
+        start = offset + SLOT.size
+        end = start + len(data)
+        self._map[start:end] = data
+        SEQUENCE.pack_into(self._map, offset, sequence + 2)
+
+    def clear(self):
+        """Invalidates every value"""
+        with self._locked(0, HEADER_SIZE):
+            HEADER.pack_into(
+                self._map, 0, self.generation + 1, self.slots, self.slot_size
+            )
+
+    def close(self):
+        """Unmaps the shared file"""
+        self._map.close()
+        os.close(self._fd)
+
+
+def init_app(app):
+    """Sets up the shared product cache when PRODUCT_CACHE_SLOTS is configured"""
+    slots = app.config["PRODUCT_CACHE_SLOTS"]
+    if slots <= 0:
+        return None
+    cache = SharedCache(
+        "product_cache",
+        app.config["PRODUCT_CACHE_PATH"],
+        slots=slots,
+        slot_size=app.config["PRODUCT_CACHE_SLOT_SIZE"],
+        ttl=app.config["PRODUCT_CACHE_TTL"],
+    )
+    # entries written before this worker started may have missed invalidations
+    cache.clear()
+    app.extensions["product_cache"] = cache
+    app.logger.info("Caching Products in %s", app.config["PRODUCT_CACHE_PATH"])
+    return cache
@@ -0,0 +1,431 @@
+######################################################################
+# Copyright 2016, 2024 John J. Rofrano. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+######################################################################
+
+"""
+Catalog Snapshots
+
+This module writes the product table to a directory of NumPy ``.npy``
+files, one or more per column, that consumers can memory-map with
+``numpy.load(path, mmap_mode="r")`` instead of paging through the REST API.
+
+Every file is a one dimensional little-endian array with a fixed 128 byte
+header, so it can be written in a single pass while the rows are streamed
+from a server-side cursor and the row count is only filled in at the end:
+
+- ``id``, ``likes`` and ``version`` are ``int32``
+- ``price_cents`` is ``int64`` (the price times 100, so it stays exact)
+- ``created_time`` and ``updated_time`` are ``datetime64[us]``
+- ``name`` is dictionary encoded: ``name.codes`` holds an ``int32`` index
+  into the strings in ``name.dictionary``
+- every other string column is stored as ``<column>.offsets`` (``int64``,
+  one more than the rows) into the UTF-8 ``<column>.data`` (``uint8``) with
+  a ``<column>.valid`` (``bool``) mask for NULLs
+
+A ``manifest.json`` records the row count, the creation time and the dtype
+of every file. Rows are ordered by id.
+"""
+
+import bisect
+import fcntl
+import json
+import math
+import mmap
+import os
+import shutil
+import sys
+import zipfile
+from array import array
+from contextlib import contextmanager
+from datetime import datetime, timedelta, timezone
+from decimal import Decimal
+
+MAGIC = b"\x93NUMPY\x01\x00"
+HEADER_SIZE = 128  # bytes before the data of every .npy file
+MANIFEST = "manifest.json"
+EPOCH = datetime(1970, 1, 1)
+MICROSECOND = timedelta(microseconds=1)
+
+# array typecode and numpy descr of every array type in a snapshot
+INT32 = ("i", "<i4")
+INT64 = ("q", "<i8")
+TIMESTAMP = ("q", "<M8[us]")
+BYTES = ("B", "|u1")
+BOOL = ("B", "|b1")
+
+# descr -> memoryview format used by the reader
+FORMATS = {"<i4": "i", "<i8": "q", "<M8[us]": "q", "|u1": "B", "|b1": "?"}
+
+NUMBER_COLUMNS = {
+    "id": INT32,
+    "likes": INT32,
+    "version": INT32,
+    "created_time": TIMESTAMP,
+    "updated_time": TIMESTAMP,
+}
+STRING_COLUMNS = ("sku", "description", "image_url")
+# sort key column -> snapshot array
+SORT_ARRAYS = {"price": "price_cents", "likes": "likes", "created_time": "created_time"}
+# columns read from the product table, in select order
+COLUMNS = (
+    "id",
+    "sku",
+    "name",
+    "description",
+    "price_cents",
+    "image_url",
+    "likes",
+    "version",
+    "created_time",
+    "updated_time",
+)
+
+
+def _microseconds(moment: datetime) -> int:
+    """Returns a naive UTC datetime as microseconds since the epoch"""
+    return (moment - EPOCH) // MICROSECOND
+
+
+def _timestamp(microseconds: int) -> str:
+    """Returns microseconds since the epoch as an ISO 8601 string"""
+    return (EPOCH + timedelta(microseconds=microseconds)).isoformat()
+
+
+class NpyWriter:
+    """Appends to a one dimensional .npy file whose length is not known yet"""
+
+    def __init__(self, path: str, kind: tuple):
+        self.typecode, self.descr = kind
+        self.filename = os.path.basename(path)
+        self.count = 0
+        self.file = open(path, "wb")  # pylint: disable=consider-using-with
+        self.file.write(bytes(HEADER_SIZE))
+
+    def write(self, values):
+        """Appends a sequence of values"""
+        values = array(self.typecode, values)
+        if sys.byteorder == "big":
+            values.byteswap()
+        values.tofile(self.file)
+        self.count += len(values)
+
+    def close(self):
+        """Writes the header now that the length is known"""
+        header = repr(
+            {"descr": self.descr, "fortran_order": False, "shape": (self.count,)}
+        )
+        header = header.ljust(HEADER_SIZE - len(MAGIC) - 3) + "\n"
+        self.file.seek(0)
+        self.file.write(MAGIC + len(header).to_bytes(2, "little") + header.encode())
+        self.file.close()
+
+
+class StringWriter:
+    """Writes a nullable string column as offsets, UTF-8 data and a mask"""
+
+    def __init__(self, path: str):
+        self.offsets = NpyWriter(f"{path}.offsets.npy", INT64)
+        self.data = NpyWriter(f"{path}.data.npy", BYTES)
+        self.valid = NpyWriter(f"{path}.valid.npy", BOOL)
+        self.offsets.write([0])
+
+    def write(self, values):
+        """Appends a sequence of strings or None"""
+        encoded = [value.encode() if value is not None else b"" for value in values]
+        end = self.data.count
+        ends = []
+        for value in encoded:
+            end += len(value)
+            ends.append(end)
+        self.offsets.write(ends)
+        self.data.write(b"".join(encoded))
+        self.valid.write([value is not None for value in values])
+
+    @property
+    def writers(self) -> tuple:
+        """The writers of the files of the column"""
+        return (self.offsets, self.data, self.valid)
+
+
+class SnapshotWriter:
+    """Writes the rows of the product table into a snapshot directory"""
+
+    def __init__(self, path: str):
+        os.makedirs(path)
+        self.path = path
+        self.rows = 0
+        self.numbers = {
+            column: NpyWriter(os.path.join(path, f"{column}.npy"), kind)
+            for column, kind in NUMBER_COLUMNS.items()
+        }
+        self.prices = NpyWriter(os.path.join(path, "price_cents.npy"), INT64)
+        self.strings = {
+            column: StringWriter(os.path.join(path, column))
+            for column in STRING_COLUMNS
+        }
+        self.names = NpyWriter(os.path.join(path, "name.codes.npy"), INT32)
+        self.dictionary = {}  # name -> code
+
+    def write(self, rows: list):
+        """Appends a chunk of rows selected in COLUMNS order"""
+        columns = dict(zip(COLUMNS, zip(*rows))) if rows else {}
+        if not columns:
+            return
+        for column in ("id", "likes", "version"):
+            self.numbers[column].write(columns[column])
+        for column in ("created_time", "updated_time"):
+            self.numbers[column].write(map(_microseconds, columns[column]))
+        self.prices.write(columns["price_cents"])
+        for column, writer in self.strings.items():
+            writer.write(columns[column])
+        codes = self.dictionary.setdefault
+        self.names.write(codes(name, len(self.dictionary)) for name in columns["name"])
+        self.rows += len(rows)
+
+    def close(self) -> dict:
+        """Writes the name dictionary and the manifest, returns the manifest"""
+        dictionary = StringWriter(os.path.join(self.path, "name.dictionary"))
+        dictionary.write(list(self.dictionary))
+        writers = [*self.numbers.values(), self.prices, self.names]
+        for column in (*self.strings.values(), dictionary):
+            writers.extend(column.writers)
+        for writer in writers:
+            writer.close()
+        manifest = {
+            "rows": self.rows,
+            "created_time": datetime.now(timezone.utc).isoformat(),
+            "files": {writer.filename: writer.descr for writer in writers},
+        }
+        with open(os.path.join(self.path, MANIFEST), "w", encoding="utf-8") as file:
+            json.dump(manifest, file, indent=2)
+        return manifest
+
+
+@contextmanager
+def snapshot_lock(path: str, blocking: bool = True):
+    """
+    Holds the lock every writer of the snapshot at ``path`` must take
+
+    write_snapshot() removes the directory ``path`` pointed at before, so
+    without it a writer could remove a snapshot that another one is archiving,
+    or two writers could both keep the same previous directory. The lock is a
+    ``flock`` on ``<path>.lock`` and so excludes other workers and threads
+    alike. Yields False instead of waiting when not ``blocking`` and another
+    writer holds it.
+    """
+    with open(f"{os.path.abspath(path)}.lock", "a", encoding="utf-8") as lock:
+        try:
+            fcntl.flock(lock, fcntl.LOCK_EX | (0 if blocking else fcntl.LOCK_NB))
+        except BlockingIOError:
+            yield False
+            return
+        yield True
+
+
+def write_snapshot(session, table, path: str, chunk_size: int = 10000) -> dict:
+    """
+    Writes a snapshot of the product table to ``path`` and returns its manifest
+
+    The rows are streamed from a server-side cursor ``chunk_size`` at a time
+    and written into a new directory next to ``path``. ``path`` itself is a
+    symbolic link that is then switched to the new directory in one atomic
+    rename, so readers never see a partial snapshot, and the directory it
+    pointed at before is removed (open memory maps of it stay valid). The
+    caller holds snapshot_lock().
+    """
+    path = os.path.abspath(path)
+    target = f"{path}.{datetime.now(timezone.utc):%Y%m%d%H%M%S%f}.{os.getpid()}"
+    writer = SnapshotWriter(target)
+    try:
+        columns = [table.c[column] for column in COLUMNS]
+        query = (
+            table.select()
+            .with_only_columns(*columns)
+            .order_by(table.c.id)
+            .execution_options(yield_per=chunk_size)
+        )
+        for rows in session.execute(query).partitions():
+            writer.write(rows)
+        manifest = writer.close()
+    except Exception:
+        shutil.rmtree(target, ignore_errors=True)
+        raise
+
+    previous = os.path.realpath(path) if os.path.islink(path) else None
+    link = f"{target}.link"
+    os.symlink(os.path.basename(target), link)
+    os.replace(link, path)
+    if previous and previous != target:
+        shutil.rmtree(previous, ignore_errors=True)
+    return manifest
+
+
+def archive_snapshot(path: str, archive: str) -> str:
+    """
+    Writes the snapshot at ``path`` to an uncompressed zip file
+
+    The files are stored rather than deflated so that a consumer can extract
+    them at disk speed. The archive is replaced atomically. ``path`` is
+    resolved first so the directory archived is the one it points at now;
+    the caller holds snapshot_lock() so that it is not removed meanwhile.
+    """
+    path = os.path.realpath(path)
+    temporary = f"{archive}.{os.getpid()}.tmp"
+    with zipfile.ZipFile(temporary, "w", zipfile.ZIP_STORED) as bundle:
+        for name in sorted(os.listdir(path)):
+            bundle.write(os.path.join(path, name), name)
+    os.replace(temporary, archive)
+    return archive
+
+
+class Snapshot:
+    """
+    A read-only, memory-mapped catalog snapshot
+
+    Every file is mapped when the snapshot is opened, so it stays readable
+    after write_snapshot() has replaced and removed it, and the arrays are
+    exposed as memoryviews over the maps. Mapping reads nothing but the
+    headers. Call close() (or use it as a context manager) to release them.
+    """
+
+    def __init__(self, path: str):
+        if sys.byteorder == "big":
+            raise ValueError("Snapshots can only be mapped on little-endian hosts")
+        self.path = os.path.realpath(path)
+        with open(os.path.join(self.path, MANIFEST), encoding="utf-8") as file:
+            self.manifest = json.load(file)
+        self._maps = {}
+        self._views = {}
+        try:
+            for filename, descr in self.manifest["files"].items():
+                self._map(filename, descr)
+        except Exception:
+            self.close()
+            raise
+
+    def __len__(self):
+        return self.manifest["rows"]
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    @property
+    def created_time(self) -> datetime:
+        """When the snapshot was written"""
+        return datetime.fromisoformat(self.manifest["created_time"])
+
+    def array(self, name: str) -> memoryview:
+        """Returns the array stored in ``<name>.npy``"""
+        return self._views[name]
+
+    def _map(self, filename: str, descr: str):
+        """Maps a .npy file and exposes its data as an array"""
+        with open(os.path.join(self.path, filename), "rb") as file:
+            mapped = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        if mapped[: len(MAGIC)] != MAGIC:
+            mapped.close()
+            raise ValueError(f"{filename} is not a snapshot array")
+        name = filename.removesuffix(".npy")
+        self._maps[name] = mapped
+        self._views[name] = memoryview(mapped)[HEADER_SIZE:].cast(FORMATS[descr])
+
+    def string(self, column: str, index: int):
+        """Returns the string at ``index`` of a string column, None if NULL"""
+        if column != "name.dictionary" and not self.array(f"{column}.valid")[index]:
+            return None
+        offsets = self.array(f"{column}.offsets")
+        start, end = offsets[index], offsets[index + 1]
+        return bytes(self.array(f"{column}.data")[start:end]).decode()
+
+    def product(self, index: int) -> dict:
+        """Returns the row at ``index`` serialized like Product.serialize()"""
+        cents = self.array("price_cents")[index]
+        sign = "-" if cents < 0 else ""
+        return {
+            "id": self.array("id")[index],
+            "sku": self.string("sku", index),
+            "name": self.string("name.dictionary", self.array("name.codes")[index]),
+            "description": self.string("description", index),
+            "price": f"{sign}{abs(cents) // 100}.{abs(cents) % 100:02d}",
+            "image_url": self.string("image_url", index),
+            "likes": self.array("likes")[index],
+            "version": self.array("version")[index],
+            "created_time": _timestamp(self.array("created_time")[index]),
+            "updated_time": _timestamp(self.array("updated_time")[index]),
+        }
+
+    def find(self, product_id: int):
+        """Returns the serialized Product with the id, or None if there is none"""
+        ids = self.array("id")
+        index = bisect.bisect_left(ids, product_id)
+        if index < len(ids) and ids[index] == product_id:
+            return self.product(index)
+        return None
+
+    # pylint: disable=too-many-arguments, too-many-positional-arguments
+    def search(
+        self,
+        name: str = None,
+        sku: str = None,
+        min_price: float = None,
+        max_price: float = None,
+        sort: str = None,
+    ) -> list:
+        """
+        Returns the serialized Products matching the collection filters
+
+        The filters have the same precedence as Product.find_by_filters() and
+        ``sort`` is one of the SORT_KEYS of Product.sort(). Every row is
+        scanned, which is fine for the occasional read while the database
+        is down.
+        """
+        indexes = range(len(self))
+        if sku:
+            indexes = [index for index in indexes if self.string("sku", index) == sku]
+        elif name:
+            size = len(self.array("name.dictionary.valid"))
+            codes = {
+                code
+                for code in range(size)
+                if self.string("name.dictionary", code) == name
+            }
+            names = self.array("name.codes")
+            indexes = [index for index in indexes if names[index] in codes]
+        else:
+            prices = self.array("price_cents")
+            if min_price is not None:
+                low = math.ceil(Decimal(str(min_price)) * 100)
+                indexes = [index for index in indexes if prices[index] >= low]
+            if max_price is not None:
+                high = math.floor(Decimal(str(max_price)) * 100)
+                indexes = [index for index in indexes if prices[index] <= high]
+        if sort:
+            values = self.array(SORT_ARRAYS[sort.lstrip("-")])
+            sign = -1 if sort.startswith("-") else 1
+            # ids ascend with the index, so the sort is stable on the id
+            indexes = sorted(indexes, key=lambda index: sign * values[index])
+        return [self.product(index) for index in indexes]
+
+    def close(self):
+        """Releases the memory maps"""
+        for view in self._views.values():
+            view.release()
+        for mapped in self._maps.values():
+            mapped.close()
+        self._views.clear()
+        self._maps.clear()
@@ -4,6 +4,7 @@ Global Configuration for Application
 
 import os
 import logging
+import tempfile
 
 # Get configuration from environment
 DATABASE_URI = os.getenv(
@@ -20,3 +21,160 @@ SECRET_KEY = os.getenv("SECRET_KEY", "sup3r-s3cr3t")
 LOGGING_LEVEL = logging.INFO
 
 API_KEY = "nyu-test-key-123456"
+
+# Proxies in front of the service that append to X-Forwarded-For (1 behind
+# the Kubernetes ingress), so that the address of a request is the client's
+PROXY_HOPS = int(os.getenv("PROXY_HOPS", "0"))
+
+# Seconds that /api/products/stats results are cached for (0 disables caching)
+STATS_CACHE_TTL = float(os.getenv("STATS_CACHE_TTL", "5"))
+
+# Most /api/products responses cached per worker (0 disables caching) and the
+# seconds after which they expire, which bounds how long the writes handled
+# by other workers go unnoticed
+LIST_CACHE_SIZE = int(os.getenv("LIST_CACHE_SIZE", "256"))
+LIST_CACHE_TTL = float(os.getenv("LIST_CACHE_TTL", "5"))
+
+# Product cache shared by the workers of a host: PRODUCT_CACHE_SLOTS slots (0
+# to not cache) of PRODUCT_CACHE_SLOT_SIZE bytes in the memory-mapped
+# PRODUCT_CACHE_PATH file, each entry expiring after PRODUCT_CACHE_TTL seconds
+PRODUCT_CACHE_SLOTS = int(os.getenv("PRODUCT_CACHE_SLOTS", "0"))
+PRODUCT_CACHE_SLOT_SIZE = int(os.getenv("PRODUCT_CACHE_SLOT_SIZE", "1024"))
+PRODUCT_CACHE_TTL = float(os.getenv("PRODUCT_CACHE_TTL", "60"))
+PRODUCT_CACHE_PATH = os.getenv(
+    "PRODUCT_CACHE_PATH", os.path.join(tempfile.gettempdir(), "products-cache")
+)
+
+# Cache invalidation across workers: "memory" for a single node or "postgres"
+# to NOTIFY every replica of the changes, listening again after
+# INVALIDATION_RECONNECT_DELAY seconds when the listener loses its connection
+INVALIDATION_BUS = os.getenv("INVALIDATION_BUS", "memory")
+INVALIDATION_RECONNECT_DELAY = float(os.getenv("INVALIDATION_RECONNECT_DELAY", "5"))
+
+# Number of most liked products kept in memory for /api/products/top, and the
+# seconds after which the leaderboard is reloaded to pick up other workers' likes
+LEADERBOARD_SIZE = int(os.getenv("LEADERBOARD_SIZE", "100"))
+LEADERBOARD_MAX_AGE = float(os.getenv("LEADERBOARD_MAX_AGE", "30"))
+
+# Read replicas: comma separated database URIs that GET requests read from
+DATABASE_REPLICA_URIS = [
+    uri.strip()
+    for uri in os.getenv("DATABASE_REPLICA_URIS", "").split(",")
+    if uri.strip()
+]
+SQLALCHEMY_BINDS = {
+    f"replica_{number}": uri for number, uri in enumerate(DATABASE_REPLICA_URIS)
+}
+# Seconds after a write during which a client presenting its consistency
+# token reads from the primary instead of a replica
+REPLICA_LAG_WINDOW = float(os.getenv("REPLICA_LAG_WINDOW", "2"))
+
+# Change feed (/api/products/changes): the most products and deletions in a
+# page, the least seconds a change settles before it is returned, and the
+# seconds deletions are kept for (older change tokens must read everything again)
+CHANGES_PAGE_SIZE = int(os.getenv("CHANGES_PAGE_SIZE", "1000"))
+CHANGES_SETTLE_TIME = float(os.getenv("CHANGES_SETTLE_TIME", "1"))
+DELETION_LOG_RETENTION = float(os.getenv("DELETION_LOG_RETENTION", "604800"))
+
+# Event stream (/api/products/stream): events buffered for each client before
+# a slow client is dropped, the most clients per worker, the seconds between
+# keep-alive comments and the seconds after which a client must reconnect
+EVENT_STREAM_QUEUE_SIZE = int(os.getenv("EVENT_STREAM_QUEUE_SIZE", "100"))
+EVENT_STREAM_MAX_CLIENTS = int(os.getenv("EVENT_STREAM_MAX_CLIENTS", "16"))
+EVENT_STREAM_HEARTBEAT = float(os.getenv("EVENT_STREAM_HEARTBEAT", "15"))
+EVENT_STREAM_MAX_AGE = float(os.getenv("EVENT_STREAM_MAX_AGE", "300"))
+
+# Outbox relay: where Product change events are published ("" to not start
+# a relay in the service, "queue", "file:<path>" or an http(s) URL), the
+# events published per batch and the seconds to wait when the outbox is empty
+OUTBOX_SINK = os.getenv("OUTBOX_SINK", "")
+OUTBOX_BATCH_SIZE = int(os.getenv("OUTBOX_BATCH_SIZE", "100"))
+OUTBOX_POLL_INTERVAL = float(os.getenv("OUTBOX_POLL_INTERVAL", "1"))
+# Whether changes write outbox events at all. Only on by default when the
+# service runs a relay, as nothing else would remove them; set it to "true"
+# when a separate flask outbox-relay drains the outbox
+OUTBOX_ENABLED = (
+    os.getenv("OUTBOX_ENABLED", "true" if OUTBOX_SINK else "false") == "true"
+)
+
+# Catalog snapshot (/api/products/snapshot and flask products-snapshot): where
+# the memory-mappable snapshot is written (its zip is written next to it), the
+# seconds before the endpoint writes a new one and the rows read per chunk
+SNAPSHOT_PATH = os.getenv(
+    "SNAPSHOT_PATH", os.path.join(tempfile.gettempdir(), "products-snapshot")
+)
+SNAPSHOT_MAX_AGE = float(os.getenv("SNAPSHOT_MAX_AGE", "300"))
+SNAPSHOT_CHUNK_SIZE = int(os.getenv("SNAPSHOT_CHUNK_SIZE", "10000"))
+
+# Degraded mode: while the database is down product GETs are served from the
+# catalog snapshot and writes answer 503. The seconds between the snapshot
+# refreshes of each worker (0 to not refresh it in the service) and the
+# Retry-After seconds of the rejected writes
+SNAPSHOT_REFRESH_INTERVAL = float(os.getenv("SNAPSHOT_REFRESH_INTERVAL", "0"))
+DATABASE_RETRY_AFTER = int(os.getenv("DATABASE_RETRY_AFTER", "30"))
+
+# Seconds each operation may take (0 for no limit), enforced on PostgreSQL
+# with statement_timeout and between the phases of a request
+REQUEST_DEADLINES = {
+    "read": float(os.getenv("REQUEST_DEADLINE_READ", "2")),
+    "list": float(os.getenv("REQUEST_DEADLINE_LIST", "10")),
+    "write": float(os.getenv("REQUEST_DEADLINE_WRITE", "5")),
+    "like": float(os.getenv("REQUEST_DEADLINE_LIKE", "2")),
+}
+# The statement_timeout seconds every PostgreSQL connection starts with (0
+# for none). Requests with more time left than that need no SET of their own
+DATABASE_STATEMENT_TIMEOUT = float(os.getenv("DATABASE_STATEMENT_TIMEOUT", "1"))
+
+# Admission control (ADMISSION_CAPACITY 0 to admit everything): at most
+# ADMISSION_CAPACITY requests of a worker use the database at once, as many
+# as its SQLAlchemy pool holds (5 connections plus 10 overflow). Item reads
+# and writes wait up to ADMISSION_MAX_WAIT seconds for a slot; collection
+# scans are shed unless ADMISSION_RESERVE slots are free and the average
+# wait stays under ADMISSION_TARGET_WAIT seconds. Shed requests answer 503
+# with a Retry-After of ADMISSION_RETRY_AFTER seconds
+ADMISSION_CAPACITY = int(os.getenv("ADMISSION_CAPACITY", "15"))
+ADMISSION_RESERVE = int(os.getenv("ADMISSION_RESERVE", "5"))
+ADMISSION_MAX_WAIT = float(os.getenv("ADMISSION_MAX_WAIT", "1"))
+ADMISSION_TARGET_WAIT = float(os.getenv("ADMISSION_TARGET_WAIT", "0.1"))
+ADMISSION_RETRY_AFTER = float(os.getenv("ADMISSION_RETRY_AFTER", "1"))
+
+# Resilience: reads are tried up to DATABASE_TRIES times after transient
+# database errors, waiting a random time of up to DATABASE_RETRY_DELAY
+# seconds doubled on each retry (at most DATABASE_RETRY_MAX_DELAY). The
+# circuit breaker opens for CIRCUIT_BREAKER_RESET_TIMEOUT seconds once
+# CIRCUIT_BREAKER_THRESHOLD of at least CIRCUIT_BREAKER_MIN_CALLS requests
+# within CIRCUIT_BREAKER_WINDOW seconds failed
+DATABASE_TRIES = int(os.getenv("DATABASE_TRIES", "3"))
+DATABASE_RETRY_DELAY = float(os.getenv("DATABASE_RETRY_DELAY", "0.05"))
+DATABASE_RETRY_MAX_DELAY = float(os.getenv("DATABASE_RETRY_MAX_DELAY", "1"))
+CIRCUIT_BREAKER_THRESHOLD = float(os.getenv("CIRCUIT_BREAKER_THRESHOLD", "0.5"))
+CIRCUIT_BREAKER_MIN_CALLS = int(os.getenv("CIRCUIT_BREAKER_MIN_CALLS", "20"))
+CIRCUIT_BREAKER_WINDOW = float(os.getenv("CIRCUIT_BREAKER_WINDOW", "10"))
+CIRCUIT_BREAKER_RESET_TIMEOUT = float(os.getenv("CIRCUIT_BREAKER_RESET_TIMEOUT", "30"))
+
+# Rate limiting: "" to not limit, "memory" for limits per worker or "shared"
+# for limits shared by the workers of a host through the RATE_LIMIT_PATH file
+# (of RATE_LIMIT_SLOTS buckets). Each client (registered key, or address
+# without one) gets a bucket per operation that refills at RATE_LIMIT_RATE
+# tokens a second up to RATE_LIMIT_BURST, and every request takes the cost of
+# its operation
+RATE_LIMIT_BACKEND = os.getenv("RATE_LIMIT_BACKEND", "")
+# The clients with a rate limit key of their own, comma separated
+# "<client>:<key>" pairs, e.g. "checkout:k3y,search:s3cr3t"
+RATE_LIMIT_CLIENT_KEYS = dict(
+    pair.split(":", 1)
+    for pair in os.getenv("RATE_LIMIT_CLIENT_KEYS", "").split(",")
+    if pair
+)
+RATE_LIMIT_PATH = os.getenv(
+    "RATE_LIMIT_PATH", os.path.join(tempfile.gettempdir(), "products-rate-limits")
+)
+RATE_LIMIT_SLOTS = int(os.getenv("RATE_LIMIT_SLOTS", "4096"))
+RATE_LIMIT_RATE = float(os.getenv("RATE_LIMIT_RATE", "100"))
+RATE_LIMIT_BURST = float(os.getenv("RATE_LIMIT_BURST", "200"))
+RATE_LIMIT_COSTS = {
+    "read": float(os.getenv("RATE_LIMIT_COST_READ", "1")),
+    "list": float(os.getenv("RATE_LIMIT_COST_LIST", "10")),
+    "write": float(os.getenv("RATE_LIMIT_COST_WRITE", "5")),
+    "like": float(os.getenv("RATE_LIMIT_COST_LIKE", "1")),
+}
@@ -4,11 +4,25 @@ Models for Product
 All of the models are stored in this module
 """
 
+# pylint: disable=too-many-lines
 import os
+import json
+import base64
 import logging
-from decimal import Decimal, InvalidOperation
+from datetime import datetime, timedelta, timezone
+from decimal import Decimal, InvalidOperation, ROUND_CEILING, ROUND_FLOOR, ROUND_HALF_UP
+from blinker import Namespace
+from flask import current_app
 from flask_sqlalchemy import SQLAlchemy
 from retry import retry
+from sqlalchemy import ARRAY, ColumnElement, any_, inspect
+from sqlalchemy.exc import InterfaceError, OperationalError
+from sqlalchemy.orm.exc import StaleDataError
+from sqlalchemy.schema import AddConstraint, CreateIndex
+from service.common import metrics
+from service.common.db_routing import RoutingSession
+from service.common.invalidation import invalidate
+from service.common.snapshot import write_snapshot
 
 # global variables for retry (must be int)
 RETRY_COUNT = int(os.environ.get("RETRY_COUNT", 5))
@@ -17,8 +31,45 @@ RETRY_BACKOFF = int(os.environ.get("RETRY_BACKOFF", 2))
 
 logger = logging.getLogger("flask.app")
 
+CENTS = Decimal("0.01")
+
+# prices are stored as whole cents, bounded like the Numeric(10, 2) they replace
+MAX_PRICE_CENTS = 10**10 - 1
+
+# price percentiles reported by Product.statistics()
+PERCENTILES = {"p50": 0.5, "p90": 0.9, "p99": 0.99}
+
+# price bucketing strategies supported by Product.facets()
+FACET_MODES = ("fixed", "quantile")
+
+# columns a client may change with an update
+EDITABLE_FIELDS = ("sku", "name", "description", "price", "image_url")
+# the columns that store them
+EDITABLE_COLUMNS = ("sku", "name", "description", "price_cents", "image_url")
+
+# price changes supported by Product.reprice()
+REPRICE_OPERATIONS = ("set", "multiply", "add")
+
+# orderings supported by Product.sort(), a leading "-" sorts descending
+SORT_KEYS = ("price", "-price", "likes", "-likes", "created_time", "-created_time")
+
+# advisory lock the workers take turns on to upgrade the tables
+SCHEMA_LOCK = 7_028_050
+
 # Create the SQLAlchemy object to be initialized later in init_db()
-db = SQLAlchemy()
+# Reads of GET requests are routed to the read replicas, if any
+db = SQLAlchemy(session_options={"class_": RoutingSession})
+
+# Signal sent after a Product change has been committed. Receivers are called
+# with the Product as the sender and the ``action`` ("create", "update",
+# "like" or "delete") as a keyword argument.
+signals = Namespace()
+product_changed = signals.signal("product-changed")
+
+# Signal sent after a set based change of many Products has been committed.
+# Receivers are called with the Product class as the sender and the
+# ``action`` ("reprice" or "remove_all") and ``count`` as keyword arguments.
+products_changed = signals.signal("products-changed")
 
 
 @retry(
@@ -31,13 +82,303 @@ db = SQLAlchemy()
 def init_db() -> None:
     """Initialize Tables"""
     db.create_all()
+    upgrade_db()
+
+
+def upgrade_db() -> list:
+    """Brings tables created by an earlier release up to date
+
+    db.create_all() creates the missing tables but never alters one that
+    exists, so the columns, constraints and indexes added since are added
+    here: the Product version, the price in cents (filled from the old
+    numeric price, which is then dropped) and the indexes of the listings,
+    the leaderboard and the change feed. Every step checks the schema first,
+    so it can run on every start, and the workers take turns on an advisory
+    lock. Returns the steps that were applied.
+    """
+    steps = []
+    with db.engine.begin() as connection:
+
+        def apply(step: str, *statements):
+            for statement in statements:
+                connection.execute(
+                    db.text(statement) if isinstance(statement, str) else statement
+                )
+            steps.append(step)
+
+        # neither the wait for the lock nor a backfill has a deadline
+        connection.execute(db.text("SET LOCAL statement_timeout = 0"))
+        connection.execute(db.text(f"SELECT pg_advisory_xact_lock({SCHEMA_LOCK})"))
+        inspector = inspect(connection)
+        columns = {column["name"] for column in inspector.get_columns("product")}
+        if "version" not in columns:
+            apply(
+                "add product.version",
+                "ALTER TABLE product ADD COLUMN version INTEGER NOT NULL DEFAULT 1",
+            )
+        if "price_cents" not in columns:
+            apply(
+                "add product.price_cents",
+                "ALTER TABLE product ADD COLUMN price_cents BIGINT",
+                "UPDATE product SET price_cents = round(price * 100)",
+                "ALTER TABLE product ALTER COLUMN price_cents SET NOT NULL",
+            )
+        if "price" in columns:
+            apply("drop product.price", "ALTER TABLE product DROP COLUMN price")
+        checks = {check["name"] for check in inspector.get_check_constraints("product")}
+        for constraint in Product.__table__.constraints:
+            if (
+                isinstance(constraint, db.CheckConstraint)
+                and constraint.name not in checks
+            ):
+                apply(f"add {constraint.name}", AddConstraint(constraint))
+        for table in (Product.__table__, ProductDeletion.__table__):
+            indexes = {index["name"] for index in inspector.get_indexes(table.name)}
+            for index in sorted(table.indexes, key=lambda index: index.name):
+                if index.name not in indexes:
+                    apply(f"create {index.name}", CreateIndex(index))
+    for step in steps:
+        logger.info("Upgraded the database: %s", step)
+    return steps
+
+
+def _price_str(cents) -> str:
+    """Formats a computed price in cents rounded to cents, or None when there is none"""
+    if cents is None:
+        return None
+    return str((Decimal(str(cents)) / 100).quantize(CENTS, rounding=ROUND_HALF_UP))
+
+
+def _cents_str(cents: int) -> str:
+    """Formats a stored price in cents as a decimal string without a Decimal"""
+    sign = "-" if cents < 0 else ""
+    return f"{sign}{abs(cents) // 100}.{abs(cents) % 100:02d}"
+
+
+def _to_decimal(value, field: str = "price") -> Decimal:
+    """Converts a number from a request into a finite Decimal"""
+    try:
+        # floats go through their shortest repr so 49.99 stays 49.99
+        number = Decimal(str(value) if isinstance(value, float) else value)
+        if not number.is_finite():
+            raise ValueError(value)
+        return number
+    except (ValueError, TypeError, InvalidOperation) as error:
+        raise DataValidationError(
+            f"Invalid type for decimal [{field}]: " + str(type(value))
+        ) from error
+
+
+def _to_cents(value, rounding: str = ROUND_HALF_UP) -> int:
+    """Converts a price from a request into whole cents
+
+    The value goes through a Decimal, so "0.29" and 0.29 are exactly 29
+    cents. Prices are rounded half up, pass ROUND_CEILING or ROUND_FLOOR to
+    turn the bounds of a range into the cents they include.
+    """
+    return int((_to_decimal(value) * 100).to_integral_value(rounding))
+
+
+def _price_cents(value, field: str = "value") -> int:
+    """Converts a price from a request into cents that can be stored"""
+    cents = _to_cents(value)
+    if abs(cents) > MAX_PRICE_CENTS:
+        raise DataValidationError(f"Invalid price [{field}]: {value} is out of range")
+    return cents
+
+
+def _bound_cents(value, rounding: str) -> int:
+    """Converts the bound of a price range into whole cents
+
+    A bound beyond every price that can be stored is clamped to just past
+    the largest one, so it selects the same Products and fits the column.
+    """
+    limit = MAX_PRICE_CENTS + 1
+    return max(-limit, min(limit, _to_cents(value, rounding)))
+
+
+def _change_token(
+    issued, updated_time, product_id: int, deleted_time, deletion_id: int
+) -> str:
+    """Encodes a change feed cursor as an opaque token"""
+    cursor = [
+        issued.isoformat(),
+        updated_time.isoformat() if updated_time else None,
+        product_id,
+        deleted_time.isoformat() if deleted_time else None,
+        deletion_id,
+    ]
+    return base64.urlsafe_b64encode(json.dumps(cursor).encode()).decode()
+
+
+def _parse_change_token(token: str) -> tuple:
+    """Decodes a change feed token into its cursor"""
+    try:
+        issued, updated_time, product_id, deleted_time, deletion_id = json.loads(
+            base64.urlsafe_b64decode(token.encode())
+        )
+        return (
+            datetime.fromisoformat(issued),
+            datetime.fromisoformat(updated_time) if updated_time else None,
+            int(product_id),
+            datetime.fromisoformat(deleted_time) if deleted_time else None,
+            int(deletion_id),
+        )
+    except (ValueError, TypeError) as error:
+        raise DataValidationError("Invalid change token: " + token) from error
+
+
+# the backends of the database, to find the transactions still in progress
+pg_stat_activity = db.table(
+    "pg_stat_activity",
+    db.column("pid"),
+    db.column("datname"),
+    db.column("state"),
+    db.column("backend_type"),
+    db.column("xact_start"),
+)
+
+
+def _change_horizon(settle: float):
+    """Returns the time before which every change has been committed
+
+    updated_time and deleted_time are the start of the writing transaction
+    (now()), which may commit long after later ones. So the horizon is the
+    start of the oldest transaction still in progress, or ``settle`` seconds
+    ago if that is earlier. It is read in a statement of its own, before the
+    changes are, so a transaction that commits in between is already visible
+    to them.
+    """
+    oldest = (
+        db.select(db.func.min(pg_stat_activity.c.xact_start))
+        .where(
+            pg_stat_activity.c.datname == db.func.current_database(),
+            pg_stat_activity.c.pid != db.func.pg_backend_pid(),
+            pg_stat_activity.c.backend_type == "client backend",
+            pg_stat_activity.c.state != "idle",
+        )
+        .scalar_subquery()
+    )
+    return db.session.execute(
+        db.select(db.func.least(db.func.now() - timedelta(seconds=settle), oldest))
+    ).scalar_one()
+
+
+def _price_buckets(histogram: dict, buckets: int, mode: str) -> list:
+    """Builds the price bucket list from the {bucket: (count, min, max)} rows
+
+    The prices of the rows are in cents.
+
+    Quantile buckets are bounded by the prices they actually contain, fixed
+    buckets split the overall price range evenly and include empty buckets.
+    """
+    if mode == "quantile" or not histogram:
+        return [
+            {"lower": _price_str(low), "upper": _price_str(high), "count": count}
+            for _, (count, low, high) in sorted(histogram.items())
+        ]
+    low = min(low for _, low, _ in histogram.values())
+    high = max(high for _, _, high in histogram.values())
+    width = Decimal(high - low) / buckets
+    return [
+        {
+            "lower": _price_str(low + width * (number - 1)),
+            "upper": _price_str(high if number == buckets else low + width * number),
+            "count": histogram.get(number, (0,))[0],
+        }
+        for number in range(1, buckets + 1)
+    ]
 
 
 class DataValidationError(Exception):
     """Used for an data validation errors when deserializing"""
 
 
-class Product(db.Model):
+class VersionConflictError(Exception):
+    """Used when a Product was changed since the version the client has seen"""
+
+
+class ChangeTokenExpiredError(Exception):
+    """Used when a change feed token is older than the deletion log"""
+
+
+class ProductDeletion(db.Model):
+    """
+    A tombstone left by a deleted Product for the change feed
+    """
+
+    id = db.Column(db.Integer, primary_key=True)
+    product_id = db.Column(db.Integer, nullable=False)
+    deleted_time = db.Column(db.DateTime, nullable=False, default=db.func.now())
+
+    # the change feed pages the deletions by (deleted_time, id)
+    __table_args__ = (
+        db.Index("ix_product_deletion_deleted_time_id", deleted_time, id),
+    )
+
+    def __repr__(self):
+        return f"<ProductDeletion product_id=[{self.product_id}]>"
+
+    @classmethod
+    def prune(cls, retention: float) -> int:
+        """Removes the tombstones older than ``retention`` seconds
+
+        :return: the number of tombstones removed
+        :rtype: int
+
+        """
+        logger.info("Pruning product deletions older than %s seconds", retention)
+        horizon = db.func.now() - timedelta(seconds=retention)
+        count = cls.query.filter(cls.deleted_time < horizon).delete()
+        db.session.commit()
+        return count
+
+
+class OutboxEvent(db.Model):
+    """
+    A Product change waiting to be published by the outbox relay
+
+    Events are written in the same transaction as the change they describe,
+    so a change is never committed without its event or the other way round.
+    """
+
+    id = db.Column(db.Integer, primary_key=True)
+    action = db.Column(db.String(16), nullable=False)
+    product_id = db.Column(db.Integer, nullable=False)
+    payload = db.Column(db.JSON, nullable=False)
+    created_time = db.Column(db.DateTime, nullable=False, default=db.func.now())
+
+    def __repr__(self):
+        return f"<OutboxEvent {self.action} product_id=[{self.product_id}]>"
+
+    @classmethod
+    def of(cls, product, action: str):
+        """Returns the event of a change to a Product"""
+        return cls(action=action, product_id=product.id, payload=product.serialize())
+
+    @staticmethod
+    def enabled() -> bool:
+        """Returns True if changes write events, see OUTBOX_ENABLED"""
+        return current_app.config.get("OUTBOX_ENABLED", False)
+
+    @classmethod
+    def record(cls, product, action: str):
+        """Adds the event of a change to the session unless events are disabled"""
+        if cls.enabled():
+            db.session.add(cls.of(product, action))
+
+    def serialize(self) -> dict:
+        """Serializes an OutboxEvent into a dictionary"""
+        return {
+            "id": self.id,
+            "action": self.action,
+            "product_id": self.product_id,
+            "payload": self.payload,
+            "created_time": self.created_time.isoformat(),
+        }
+
+
+class Product(db.Model):  # pylint: disable=too-many-public-methods
     """
     Class that represents a Product
     """
@@ -50,20 +391,47 @@ class Product(db.Model):
     sku = db.Column(db.String(63), unique=True, nullable=False)
     name = db.Column(db.String(63), nullable=False)
     description = db.Column(db.String(256))
-    price = db.Column(db.Numeric(10, 2), nullable=False)
+    # whole cents, so price filters and sorts compare integers
+    price_cents = db.Column(db.BigInteger, nullable=False, index=True)
     # stock = db.Column(db.Integer, nullable=False, default=0)
     # available = db.Column(db.Boolean(), nullable=False, default=True)
     image_url = db.Column(db.String(256))
-    created_time = db.Column(db.DateTime, nullable=False, default=db.func.now())
+    created_time = db.Column(
+        db.DateTime, nullable=False, default=db.func.now(), index=True
+    )
     # need test or delete for the updated_at
     updated_time = db.Column(
         db.DateTime, nullable=False, default=db.func.now(), onupdate=db.func.now()
     )
-    likes = db.Column(db.Integer, nullable=False, default=0)
+    likes = db.Column(db.Integer, nullable=False, default=0, index=True)
+    # bumped by every update and checked by conditional updates (If-Match)
+    version = db.Column(db.Integer, nullable=False, server_default=db.text("1"))
+
+    # eager_defaults reads the generated times back with RETURNING, so a
+    # Product can be serialized into its outbox event without a SELECT
+    __mapper_args__ = {"version_id_col": version, "eager_defaults": True}
+    # the change feed cursor
+    __table_args__ = (
+        db.Index("ix_product_updated_time_id", updated_time, id),
+        db.CheckConstraint(
+            f"abs(price_cents) <= {MAX_PRICE_CENTS}", name="ck_product_price_cents"
+        ),
+    )
 
     def __repr__(self):
         return f"<Product {self.name} id=[{self.id}]>"
 
+    @property
+    def price(self) -> Decimal:
+        """The price as a Decimal with two places, None if not set"""
+        if self.price_cents is None:
+            return None
+        return Decimal(self.price_cents).scaleb(-2)
+
+    @price.setter
+    def price(self, value):
+        self.price_cents = _to_cents(value)
+
     def create(self):
         """
         Creates a Product to the database
@@ -72,35 +440,73 @@ class Product(db.Model):
         self.id = None  # pylint: disable=invalid-name
         try:
             db.session.add(self)
+            db.session.flush()
+            OutboxEvent.record(self, "create")
+            invalidate(db.session, [self.id])
             db.session.commit()
+        except (OperationalError, InterfaceError):
+            # the database is unavailable, the data may well be valid
+            db.session.rollback()
+            raise
         except Exception as e:
             db.session.rollback()
             logger.error("Error creating record: %s", self)
             raise DataValidationError(e) from e
+        product_changed.send(self, action="create")
 
-    def update(self):
+    def update(self) -> bool:
         """
         Updates a Product to the database
+
+        Nothing is written when no attribute differs from the stored row.
+        Returns True if the Product was written, False if it was unchanged.
         """
         if not self.id:
             raise DataValidationError("Update called with empty ID field")
 
+        if self in db.session and not db.session.is_modified(self):
+            logger.info("Product with id [%s] is unchanged", self.id)
+            metrics.increment("product_updates_skipped")
+            return False
         try:
+            db.session.flush()
+            OutboxEvent.record(self, "update")
+            invalidate(db.session, [self.id])
             db.session.commit()
+        except (OperationalError, InterfaceError):
+            # the database is unavailable, the data may well be valid
+            db.session.rollback()
+            raise
+        except StaleDataError as error:
+            db.session.rollback()
+            raise VersionConflictError(
+                f"Product with id '{self.id}' was changed by another request"
+            ) from error
         except Exception as error:
             db.session.rollback()
             raise DataValidationError("Error updating record: " + str(error)) from error
+        metrics.increment("product_updates")
+        product_changed.send(self, action="update")
+        return True
 
     def delete(self):
         """Removes a Product from the data store"""
         logger.info("Deleting %s", self.name)
         try:
             db.session.delete(self)
+            db.session.add(ProductDeletion(product_id=self.id))
+            OutboxEvent.record(self, "delete")
+            invalidate(db.session, [self.id])
             db.session.commit()
+        except (OperationalError, InterfaceError):
+            # the database is unavailable, the data may well be valid
+            db.session.rollback()
+            raise
         except Exception as e:
             db.session.rollback()
             logger.error("Error deleting record: %s", self)
             raise DataValidationError(e) from e
+        product_changed.send(self, action="delete")
 
     def serialize(self) -> dict:
         """Serializes a Product into a dictionary"""
@@ -109,9 +515,10 @@ class Product(db.Model):
             "sku": self.sku,
             "name": self.name,
             "description": self.description,
-            "price": str(self.price),
+            "price": _cents_str(self.price_cents),
             "image_url": self.image_url,
             "likes": self.likes,
+            "version": self.version,
             "created_time": (
                 self.created_time.isoformat() if self.created_time else None
             ),
@@ -134,12 +541,7 @@ class Product(db.Model):
             self.image_url = data.get("image_url")
 
             if "price" in data:
-                try:
-                    self.price = Decimal(data["price"])
-                except (ValueError, TypeError, InvalidOperation) as error:
-                    raise DataValidationError(
-                        "Invalid type for decimal [price]: " + str(type(data["price"]))
-                    ) from error
+                self.price = data["price"]
             else:
                 raise KeyError("price")
 
@@ -160,6 +562,122 @@ class Product(db.Model):
     # CLASS METHODS
     ##################################################
 
+    @classmethod
+    def deserialize_changes(cls, data: dict) -> dict:
+        """
+        Deserializes the fields of a partial update from a dictionary
+
+        Only the editable fields present in the dictionary are validated
+        and returned as column values (the price as ``price_cents``), so
+        they can be applied without reading the Product.
+
+        Args:
+            data (dict): A dictionary containing some of the Product data
+        """
+        if not isinstance(data, dict):
+            raise DataValidationError(
+                "Invalid product: body of request contained bad or no data"
+            )
+        values = {field: data[field] for field in EDITABLE_FIELDS if field in data}
+        if not values:
+            raise DataValidationError("Invalid product: no fields to update")
+        for field in ("sku", "name", "price"):
+            if field in values and values[field] is None:
+                raise DataValidationError(f"Invalid product: {field} cannot be null")
+        if "price" in values:
+            values["price_cents"] = _to_cents(values.pop("price"))
+        return values
+
+    @classmethod
+    def update_by_id(
+        cls, product_id: int, values: dict, versions: set = None, action="update"
+    ):
+        """Updates a Product in a single UPDATE ... RETURNING statement
+
+        This is one round trip: the Product is not read first and is not
+        reloaded after the commit. The version is bumped with the update.
+        When ``versions`` is given the UPDATE only matches while the stored
+        version is one of them, which makes it a lock free compare-and-set.
+        When every value equals the stored one nothing is written.
+
+        :param product_id: the id of the Product to update
+        :type product_id: int
+
+        :param values: the new column values (or SQL expressions)
+        :type values: dict
+
+        :param versions: the versions the Product is expected to be at
+        :type versions: set
+
+        :param action: the action sent with product_changed
+        :type action: str
+
+        :return: the Product (None if not found) and whether it was written
+        :rtype: tuple
+
+        """
+        logger.info("Processing update for id %s ...", product_id)
+        criteria = [cls.id == product_id]
+        if versions is not None:
+            criteria.append(cls.version.in_(versions))
+        if not any(isinstance(value, ColumnElement) for value in values.values()):
+            # only match the row if at least one value actually changes
+            criteria.append(
+                db.or_(
+                    *[
+                        getattr(cls, field).is_distinct_from(value)
+                        for field, value in values.items()
+                    ]
+                )
+            )
+        statement = (
+            db.update(cls)
+            .where(*criteria)
+            .values(**values, version=cls.version + 1)
+            .returning(cls)
+            .execution_options(synchronize_session=False, populate_existing=True)
+        )
+        try:
+            product = db.session.execute(statement).scalar_one_or_none()
+            if product is not None:
+                OutboxEvent.record(product, action)
+                invalidate(db.session, [product.id])
+                # keep the RETURNING values instead of reloading after commit
+                db.session.expunge(product)
+            db.session.commit()
+        except (OperationalError, InterfaceError):
+            # the database is unavailable, the data may well be valid
+            db.session.rollback()
+            raise
+        except Exception as error:
+            db.session.rollback()
+            raise DataValidationError("Error updating record: " + str(error)) from error
+        if product is None:
+            return cls._unchanged(product_id, versions), False
+        metrics.increment("product_updates")
+        product_changed.send(product, action=action)
+        return product, True
+
+    @classmethod
+    def _unchanged(cls, product_id: int, versions: set):
+        """Explains why a conditional update did not match any row
+
+        :return: the stored Product if it already had the new values, or
+            None if it does not exist
+        :rtype: Product
+
+        """
+        product = db.session.get(cls, product_id, populate_existing=True)
+        if product is None:
+            return None
+        if versions is not None and product.version not in versions:
+            raise VersionConflictError(
+                f"Product with id '{product_id}' does not match the expected version"
+            )
+        logger.info("Product with id [%s] is unchanged", product_id)
+        metrics.increment("product_updates_skipped")
+        return product
+
     @classmethod
     def all(cls) -> list:
         """Returns all of the Products in the database"""
@@ -180,18 +698,472 @@ class Product(db.Model):
         logger.info("Processing lookup for id %s ...", product_id)
         return cls.query.session.get(cls, product_id)
 
+    @classmethod
+    def find_by_ids(cls, ids: list) -> list:
+        """Finds many Products by their IDs in a single query
+
+        The ids are sent as one array parameter (``id = ANY(:ids)``), so the
+        statement is the same whatever the number of ids.
+
+        :param ids: the ids of the Products to find
+        :type ids: list
+
+        :return: the Products found, in the order of the ids
+        :rtype: list
+
+        """
+        logger.info("Processing lookup for ids %s ...", ids)
+        products = cls.query.filter(
+            cls.id == any_(db.literal(list(ids), ARRAY(db.Integer)))
+        )
+        found = {product.id: product for product in products}
+        return [found[product_id] for product_id in ids if product_id in found]
+
+    @classmethod
+    def find_by_skus(cls, skus: list) -> list:
+        """Finds many Products by their SKUs in a single query
+
+        :param skus: the SKUs of the Products to find
+        :type skus: list
+
+        :return: the Products found, in the order of the SKUs
+        :rtype: list
+
+        """
+        logger.info("Processing lookup for SKUs %s ...", skus)
+        products = cls.query.filter(
+            cls.sku == any_(db.literal(list(skus), ARRAY(db.String)))
+        )
+        found = {product.sku: product for product in products}
+        return [found[sku] for sku in skus if sku in found]
+
+    @classmethod
+    def delete_by_ids(cls, ids: list) -> list:
+        """Deletes Products in a single DELETE ... RETURNING statement
+
+        The Products are not read first, the deleted rows come back from
+        the DELETE itself. Their tombstones are written by the same
+        statement.
+
+        :param ids: the ids of the Products to delete
+        :type ids: list
+
+        :return: the Products that were deleted
+        :rtype: list
+
+        """
+        logger.info("Deleting products with ids %s", ids)
+        gone = (
+            db.delete(cls)
+            .where(cls.id.in_(ids))
+            .returning(*cls.__table__.c)
+            .cte("gone")
+        )
+        tombstones = db.insert(ProductDeletion).from_select(
+            ["product_id"], db.select(gone.c.id)
+        )
+        statement = db.select(cls).from_statement(
+            db.select(gone).add_cte(tombstones.cte("tombstones"))
+        )
+        try:
+            products = db.session.execute(statement).scalars().all()
+            invalidate(db.session, [product.id for product in products])
+            for product in products:
+                OutboxEvent.record(product, "delete")
+                # the rows are gone, keep the RETURNING values instead
+                db.session.expunge(product)
+            db.session.commit()
+        except (OperationalError, InterfaceError):
+            # the database is unavailable, the data may well be valid
+            db.session.rollback()
+            raise
+        except Exception as error:
+            db.session.rollback()
+            logger.error("Error deleting records: %s", ids)
+            raise DataValidationError(error) from error
+        for product in products:
+            product_changed.send(product, action="delete")
+        return products
+
+    @classmethod
+    def changes(
+        cls, since: str = None, limit: int = 1000, settle: float = 1.0, retention=None
+    ) -> dict:
+        """Returns the Products changed and deleted after a change token
+
+        Changed Products are paged by the (updated_time, id) cursor and
+        deleted ones by the (deleted_time, id) cursor. Changes are held back
+        until every transaction that started before them has finished and
+        they are ``settle`` seconds old, so a transaction that commits late
+        is not skipped by the cursor.
+
+        :param since: the ``next`` token of the previous page, None for all
+        :type since: str
+
+        :param limit: the most Products and tombstones in a page
+        :type limit: int
+
+        :param settle: the least seconds before a change is returned
+        :type settle: float
+
+        :param retention: seconds that deletions are kept for, if pruned
+        :type retention: float
+
+        :return: the changed Products, the deleted ids, the next token and
+            whether more changes are waiting
+        :rtype: dict
+
+        """
+        issued = datetime.now(timezone.utc)
+        updated_time, product_id, deleted_time, deletion_id = None, 0, None, 0
+        if since:
+            (
+                token_issued,
+                updated_time,
+                product_id,
+                deleted_time,
+                deletion_id,
+            ) = _parse_change_token(since)
+            if retention is not None and issued - token_issued > timedelta(
+                seconds=retention
+            ):
+                raise ChangeTokenExpiredError(
+                    "The change token has expired, read all Products again"
+                )
+        horizon = _change_horizon(settle)
+
+        query = cls.query.filter(cls.updated_time < horizon)
+        if updated_time is not None:
+            query = query.filter(
+                db.tuple_(cls.updated_time, cls.id)
+                > db.tuple_(updated_time, product_id)
+            )
+        products = query.order_by(cls.updated_time, cls.id).limit(limit).all()
+        query = db.select(
+            ProductDeletion.id, ProductDeletion.product_id, ProductDeletion.deleted_time
+        ).where(ProductDeletion.deleted_time < horizon)
+        if deleted_time is not None:
+            query = query.where(
+                db.tuple_(ProductDeletion.deleted_time, ProductDeletion.id)
+                > db.tuple_(deleted_time, deletion_id)
+            )
+        deletions = db.session.execute(
+            query.order_by(ProductDeletion.deleted_time, ProductDeletion.id).limit(
+                limit
+            )
+        ).all()
+
+        if products:
+            updated_time, product_id = products[-1].updated_time, products[-1].id
+        if deletions:
+            deleted_time, deletion_id = deletions[-1].deleted_time, deletions[-1].id
+        return {
+            "changed": [product.serialize() for product in products],
+            "deleted": [deletion.product_id for deletion in deletions],
+            "next": _change_token(
+                issued, updated_time, product_id, deleted_time, deletion_id
+            ),
+            "more": len(products) == limit or len(deletions) == limit,
+        }
+
+    @classmethod
+    def snapshot(cls, path: str, chunk_size: int = 10000) -> dict:
+        """
+        Writes a columnar snapshot of every Product to ``path``
+
+        The rows are streamed from a server-side cursor ``chunk_size`` at a
+        time, see service.common.snapshot for the layout. Returns the manifest.
+        """
+        logger.info("Writing a snapshot of the Products to %s", path)
+        return write_snapshot(db.session, cls.__table__, path, chunk_size)
+
     @classmethod
     def remove_all(cls):
         """Removes all products from the database (use for testing)"""
         logger.info("Deleting all products from the database")
         try:
             num_deleted = cls.query.delete()
+            ProductDeletion.query.delete()
+            invalidate(db.session)
             db.session.commit()
             logger.info("Deleted %s products", num_deleted)
         except Exception as e:
             db.session.rollback()
             logger.error("Failed to delete all products: %s", e)
             raise
+        products_changed.send(cls, action="remove_all", count=num_deleted)
+
+    @classmethod
+    def reprice(cls, query, data: dict, dry_run: bool = False) -> int:
+        """Changes the price of every Product matched by a query
+
+        ``data`` holds the ``operation`` ("set", "multiply" or "add") and its
+        ``value``. New prices are rounded to cents and written with a single
+        set based UPDATE that also bumps the version of every changed
+        Product. Products whose price would not change are left alone.
+
+        :param query: the Products to reprice, e.g. from find_by_filters()
+        :type query: Query
+
+        :param data: the operation and value from the request
+        :type data: dict
+
+        :param dry_run: only count the Products that would change
+        :type dry_run: bool
+
+        :return: the number of Products that were (or would be) changed
+        :rtype: int
+
+        """
+        if not isinstance(data, dict) or "value" not in data:
+            raise DataValidationError(
+                "Invalid reprice: body of request contained bad or no data"
+            )
+        operation = data.get("operation")
+        if operation == "set":
+            price = _price_cents(data["value"])
+        elif operation == "add":
+            price = cls.price_cents + _price_cents(data["value"])
+        elif operation == "multiply":
+            # clamped past the largest price, so the check constraint rejects
+            # an overflow instead of the cast to bigint
+            limit = MAX_PRICE_CENTS + 1
+            product = db.func.round(
+                cls.price_cents * _to_decimal(data["value"], "value")
+            )
+            price = db.cast(
+                db.func.least(db.func.greatest(product, -limit), limit),
+                db.BigInteger,
+            )
+        else:
+            raise DataValidationError(
+                f"Invalid reprice operation '{operation}', "
+                f"expected one of {', '.join(REPRICE_OPERATIONS)}"
+            )
+        changed = query.filter(cls.price_cents.is_distinct_from(price))
+        if dry_run:
+            return changed.count()
+        logger.info("Repricing products with %s %s", operation, data["value"])
+        repriced = (
+            db.update(cls)
+            .where(changed.whereclause)
+            .values(price_cents=price, version=cls.version + 1)
+            .returning(cls.id, cls.price_cents, cls.version, cls.updated_time)
+            .cte("repriced")
+        )
+        # the outbox events are written by the same set based statement
+        events = db.insert(OutboxEvent).from_select(
+            ["action", "product_id", "payload"],
+            db.select(
+                db.literal("reprice"),
+                repriced.c.id,
+                db.func.json_build_object(
+                    db.literal_column("'id'"),
+                    repriced.c.id,
+                    db.literal_column("'price'"),
+                    # cents times a numeric(2) literal give exactly two places
+                    db.cast(repriced.c.price_cents * CENTS, db.String),
+                    db.literal_column("'version'"),
+                    repriced.c.version,
+                    db.literal_column("'updated_time'"),
+                    repriced.c.updated_time,
+                ),
+            ),
+        )
+        statement = db.select(db.func.count()).select_from(repriced)
+        if OutboxEvent.enabled():
+            statement = statement.add_cte(events.cte("events"))
+        try:
+            count = db.session.execute(statement).scalar_one()
+            if count:
+                invalidate(db.session)
+            db.session.commit()
+        except (OperationalError, InterfaceError):
+            # the database is unavailable, the data may well be valid
+            db.session.rollback()
+            raise
+        except Exception as error:
+            db.session.rollback()
+            raise DataValidationError(
+                "Error repricing records: " + str(error)
+            ) from error
+        logger.info("Repriced %s products", count)
+        products_changed.send(cls, action="reprice", count=count)
+        return count
+
+    @classmethod
+    def find_by_filters(
+        cls,
+        name: str = None,
+        sku: str = None,
+        min_price=None,
+        max_price=None,
+    ):
+        """Returns a query for the Products matching the collection filters
+
+        The filters are applied with the same precedence as the list
+        endpoint: sku, then name, then the price range. Without any filter
+        the query matches every Product.
+
+        :return: a query of the matching Products
+        :rtype: Query
+
+        """
+        if sku:
+            return cls.find_by_sku(sku)
+        if name:
+            return cls.find_by_name(name)
+        if min_price is not None and max_price is not None:
+            return cls.find_by_price_range(min_price, max_price)
+        if min_price is not None:
+            return cls.find_by_min_price(min_price)
+        if max_price is not None:
+            return cls.find_by_max_price(max_price)
+        return cls.query
+
+    @classmethod
+    def sort(cls, query, sort: str):
+        """Orders a query of Products by one of the SORT_KEYS
+
+        Ties are broken by id so paging through a sorted listing is stable.
+
+        :param query: a query of Products, e.g. from find_by_filters()
+        :type query: Query
+
+        :param sort: the column to sort by, prefixed with "-" for descending
+        :type sort: str
+
+        :return: the ordered query
+        :rtype: Query
+
+        """
+        if sort not in SORT_KEYS:
+            raise DataValidationError(f"Invalid sort key: {sort}")
+        key = sort.lstrip("-")
+        column = cls.price_cents if key == "price" else getattr(cls, key)
+        return query.order_by(
+            column.desc() if sort.startswith("-") else column.asc(), cls.id
+        )
+
+    @classmethod
+    def find_most_liked(cls, limit: int) -> list:
+        """Returns the most liked Products
+
+        :param limit: the maximum number of Products to return
+        :type limit: int
+
+        :return: the Products ordered by likes, most liked first
+        :rtype: list
+
+        """
+        logger.info("Processing most liked query for %s products ...", limit)
+        return cls.sort(cls.query, "-likes").limit(limit).all()
+
+    @classmethod
+    def statistics(cls, query) -> dict:
+        """Returns aggregate statistics for the Products matched by a query
+
+        Everything is computed by the database in a single aggregate query,
+        so no rows are moved to the service.
+
+        :param query: a query of Products, e.g. from find_by_filters()
+        :type query: Query
+
+        :return: the count, price statistics and total likes
+        :rtype: dict
+
+        """
+        logger.info("Processing statistics query ...")
+        row = query.with_entities(
+            db.func.count(cls.id),
+            db.func.min(cls.price_cents),
+            db.func.max(cls.price_cents),
+            db.func.avg(cls.price_cents),
+            *[
+                db.func.percentile_cont(fraction).within_group(cls.price_cents)
+                for fraction in PERCENTILES.values()
+            ],
+            db.func.coalesce(db.func.sum(cls.likes), 0),
+        ).one()
+        count, min_price, max_price, avg_price, *percentiles, total_likes = row
+        return {
+            "count": count,
+            "min_price": _price_str(min_price),
+            "max_price": _price_str(max_price),
+            "avg_price": _price_str(avg_price),
+            "percentiles": {
+                label: _price_str(value)
+                for label, value in zip(PERCENTILES, percentiles)
+            },
+            "total_likes": int(total_likes),
+        }
+
+    @classmethod
+    def facets(cls, query, buckets: int = 10, mode: str = "fixed") -> dict:
+        """Returns price histogram buckets and name counts for a query
+
+        Both facets come back from one ``GROUP BY GROUPING SETS`` query. In
+        ``fixed`` mode the price range is split into equal width buckets with
+        ``width_bucket``; in ``quantile`` mode every bucket holds about the
+        same number of Products (``ntile``).
+
+        :param query: a query of Products, e.g. from find_by_filters()
+        :type query: Query
+
+        :param buckets: the number of price buckets
+        :type buckets: int
+
+        :param mode: either "fixed" or "quantile"
+        :type mode: str
+
+        :return: the price buckets and the name counts
+        :rtype: dict
+
+        """
+        logger.info("Processing %s facets query with %s buckets ...", mode, buckets)
+        if mode not in FACET_MODES:
+            raise DataValidationError(f"Invalid facet mode: {mode}")
+        if mode == "quantile":
+            bucket = db.func.ntile(buckets).over(order_by=cls.price_cents)
+        else:
+            low = db.func.min(cls.price_cents).over()
+            high = db.func.max(cls.price_cents).over()
+            bucket = db.case(
+                (low == high, 1),
+                else_=db.func.least(
+                    db.func.width_bucket(cls.price_cents, low, high, buckets), buckets
+                ),
+            )
+        rows = query.with_entities(
+            cls.name.label("name"),
+            cls.price_cents.label("price"),
+            bucket.label("bucket"),
+        ).subquery()
+        groups = db.session.execute(
+            db.select(
+                db.func.grouping(rows.c.bucket),
+                rows.c.bucket,
+                rows.c.name,
+                db.func.count(),
+                db.func.min(rows.c.price),
+                db.func.max(rows.c.price),
+            ).group_by(db.func.grouping_sets(rows.c.bucket, rows.c.name))
+        ).all()
+
+        histogram = {}
+        names = []
+        for is_name, number, name, count, low, high in groups:
+            if is_name:
+                names.append({"name": name, "count": count})
+            else:
+                histogram[number] = (count, low, high)
+        names.sort(key=lambda facet: (-facet["count"], facet["name"]))
+        return {
+            "mode": mode,
+            "count": sum(count for count, _, _ in histogram.values()),
+            "buckets": _price_buckets(histogram, buckets, mode),
+            "names": names,
+        }
 
     @classmethod
     def find_by_name(cls, name: str) -> list:
@@ -222,14 +1194,17 @@ class Product(db.Model):
         return cls.query.filter(cls.sku == sku)
 
     @classmethod
-    def find_by_price_range(cls, min_price: float, max_price: float) -> list:
+    def find_by_price_range(cls, min_price, max_price) -> list:
         """Returns all Products within the given price range
 
+        The bounds are converted exactly to the cents they include, so the
+        range is an integer comparison on the indexed price_cents.
+
         :param min_price: the minimum price
-        :type min_price: float
+        :type min_price: Decimal, float or str
 
         :param max_price: the maximum price
-        :type max_price: float
+        :type max_price: Decimal, float or str
 
         :return: a collection of Products within the price range
         :rtype: list
@@ -238,32 +1213,37 @@ class Product(db.Model):
         logger.info(
             "Processing price range query from %s to %s ...", min_price, max_price
         )
-        return cls.query.filter(cls.price >= min_price).filter(cls.price <= max_price)
+        return cls.query.filter(
+            cls.price_cents >= _bound_cents(min_price, ROUND_CEILING),
+            cls.price_cents <= _bound_cents(max_price, ROUND_FLOOR),
+        )
 
     @classmethod
-    def find_by_min_price(cls, min_price: float) -> list:
+    def find_by_min_price(cls, min_price) -> list:
         """Returns all Products with price greater than or equal to min_price
 
         :param min_price: the minimum price
-        :type min_price: float
+        :type min_price: Decimal, float or str
 
         :return: a collection of Products with price >= min_price
         :rtype: list
 
         """
         logger.info("Processing minimum price query for %s ...", min_price)
-        return cls.query.filter(cls.price >= min_price)
+        return cls.query.filter(
+            cls.price_cents >= _bound_cents(min_price, ROUND_CEILING)
+        )
 
     @classmethod
-    def find_by_max_price(cls, max_price: float) -> list:
+    def find_by_max_price(cls, max_price) -> list:
         """Returns all Products with price less than or equal to max_price
 
         :param max_price: the maximum price
-        :type max_price: float
+        :type max_price: Decimal, float or str
 
         :return: a collection of Products with price <= max_price
         :rtype: list
 
         """
         logger.info("Processing maximum price query for %s ...", max_price)
-        return cls.query.filter(cls.price <= max_price)
+        return cls.query.filter(cls.price_cents <= _bound_cents(max_price, ROUND_FLOOR))
@@ -21,20 +21,53 @@ Paths:
 ------
 GET / - Displays a UI for Selenium testing
 GET /products - Returns a list all of the Products
+GET /products/stats - Returns aggregate statistics for the Products
+GET /products/facets - Returns price buckets and name counts for the Products
+GET /products/top - Returns the most liked Products
+GET /products/changes - Returns the Products changed and deleted since a token
+GET /products/stream - Streams Product changes as Server-Sent Events
+GET /products/snapshot - Returns a zip of memory-mappable Product columns
+POST /products/reprice - changes the price of many Products at once
 GET /products/{id} - Returns the Product with a given id number
 POST /products - creates a new Product record in the database
 PUT /products/{id} - updates a Product record in the database
+PATCH /products/{id} - updates some fields of a Product record in the database
 DELETE /products/{id} - deletes a Product record in the database
+DELETE /products?ids= - deletes many Product records in the database
+GET /metrics - Returns the counters of the worker process
 """
 
+# pylint: disable=too-many-lines
+import json
+import os
 import secrets
-
-# from functools import wraps
-# from flask import request
+import time
+from decimal import Decimal
+from functools import wraps
+from flask import Response, g, request, send_file
 from flask import current_app as app  # Import Flask application
-from flask_restx import Api, Resource, fields, reqparse
-from service.models import Product
-from service.common import status  # HTTP Status Codes
+from flask_restx import Api, Resource, fields, inputs, reqparse
+from sqlalchemy.exc import InterfaceError, OperationalError
+from service.models import (
+    db,
+    Product,
+    EDITABLE_COLUMNS,
+    FACET_MODES,
+    MAX_PRICE_CENTS,
+    REPRICE_OPERATIONS,
+    SORT_KEYS,
+    product_changed,
+    products_changed,
+)
+from service.common import deadline, metrics, resilience, status  # HTTP Status Codes
+from service.common.admission import HIGH, LOW
+from service.common.cache import GenerationCache, TTLCache
+from service.common.event_hub import DROPPED, EventHub, HubFullError
+from service.common.invalidation import ALL, products_invalidated
+from service.common.leaderboard import Leaderboard
+from service.common.resilience import CircuitOpenError
+from service.common.singleflight import SingleFlight
+from service.common.snapshot import archive_snapshot, snapshot_lock
 
 # Document the type of authorization required
 authorizations = {"apikey": {"type": "apiKey", "in": "header", "name": "X-Api-Key"}}
@@ -93,6 +126,26 @@ create_model = api.model(
 )
 
 
+# every field is optional for a partial update
+patch_model = api.model(
+    "ProductPatch",
+    {
+        "name": fields.String(
+            description="The name of the Product", example="Wireless Mouse"
+        ),
+        "sku": fields.String(description="The SKU of the Product", example="SKU12345"),
+        "description": fields.String(
+            description="The description of the Product",
+            example="A sleek wireless mouse with ergonomic design",
+        ),
+        "price": fields.Float(description="The price of the Product", example=39.99),
+        "image_url": fields.String(
+            description="URL to the product image",
+            example="https://example.com/images/mouse.png",
+        ),
+    },
+)
+
 product_model = api.inherit(
     "ProductModel",
     create_model,
@@ -115,9 +168,109 @@ product_model = api.inherit(
             description="The time when this product was last updated",
             example="2024-04-21T16:10:45.456Z",
         ),
+        "version": fields.Integer(
+            readOnly=True,
+            description="The version of this product, also returned as its ETag",
+            example=3,
+        ),
+    },
+)
+
+stats_model = api.model(
+    "ProductStats",
+    {
+        "count": fields.Integer(description="The number of matching Products"),
+        "min_price": fields.String(description="The lowest price", example="1.99"),
+        "max_price": fields.String(description="The highest price", example="499.00"),
+        "avg_price": fields.String(description="The average price", example="42.50"),
+        "percentiles": fields.Raw(
+            description="Price percentiles",
+            example={"p50": "35.00", "p90": "120.00", "p99": "450.00"},
+        ),
+        "total_likes": fields.Integer(description="The sum of all likes"),
+    },
+)
+
+reprice_model = api.model(
+    "Reprice",
+    {
+        "operation": fields.String(
+            required=True,
+            enum=REPRICE_OPERATIONS,
+            description="Set the price, multiply it or add to it",
+        ),
+        "value": fields.String(
+            required=True,
+            description="The new price, the factor or the amount to add",
+            example="0.9",
+        ),
+    },
+)
+
+reprice_result_model = api.model(
+    "RepriceResult",
+    {
+        "count": fields.Integer(description="The number of Products changed"),
+        "dry_run": fields.Boolean(description="True if nothing was written"),
+    },
+)
+
+changes_model = api.model(
+    "ProductChanges",
+    {
+        "changed": fields.List(
+            fields.Nested(product_model),
+            description="Products created or updated, oldest change first",
+        ),
+        "deleted": fields.List(
+            fields.Integer, description="Ids of the Products that were deleted"
+        ),
+        "next": fields.String(description="The since token of the next page"),
+        "more": fields.Boolean(description="True if more changes are waiting"),
     },
 )
 
+delete_result_model = api.model(
+    "DeleteResult",
+    {
+        "id": fields.Integer(description="The requested Product id"),
+        "deleted": fields.Boolean(description="False if the Product did not exist"),
+    },
+)
+
+MAX_IDS = 1000  # most Product ids (or SKUs) accepted by one request
+MAX_ID = 2**31 - 1  # the largest Product id an integer column holds
+
+
+def id_list(value: str) -> list:
+    """Parses a comma separated list of Product ids, dropping repeats"""
+    ids = [int(item) for item in value.split(",") if item.strip()]
+    if len(ids) > MAX_IDS:
+        raise ValueError(f"At most {MAX_IDS} ids are allowed")
+    for product_id in ids:
+        if not 1 <= product_id <= MAX_ID:
+            raise ValueError(f"{product_id} is not a Product id")
+    return list(dict.fromkeys(ids))
+
+
+def sku_list(value: str) -> list:
+    """Parses a comma separated list of Product SKUs, dropping repeats"""
+    skus = [item.strip() for item in value.split(",") if item.strip()]
+    if len(skus) > MAX_IDS:
+        raise ValueError(f"At most {MAX_IDS} SKUs are allowed")
+    return list(dict.fromkeys(skus))
+
+
+def price_arg(value: str) -> Decimal:
+    """Parses a price filter exactly, as a float would not hold 0.29"""
+    price = Decimal(value)
+    if not price.is_finite():
+        raise ValueError(f"{value} is not a price")
+    if abs(price) * 100 > MAX_PRICE_CENTS:
+        raise ValueError(f"{value} is out of the price range")
+    return price
+
+
 # query string arguments
 product_args = reqparse.RequestParser()
 product_args.add_argument(
@@ -128,19 +281,258 @@ product_args.add_argument(
 )
 product_args.add_argument(
     "min_price",
-    type=float,
+    type=price_arg,
     location="args",
     required=False,
     help="List Products with price greater than or equal to this value",
 )
 product_args.add_argument(
     "max_price",
-    type=float,
+    type=price_arg,
     location="args",
     required=False,
     help="List Products with price less than or equal to this value",
 )
 
+# query string arguments for the list, on top of the collection filters
+list_args = product_args.copy()
+list_args.add_argument(
+    "sort",
+    type=str,
+    location="args",
+    required=False,
+    choices=SORT_KEYS,
+    help="Sort Products by this column, prefix with - for descending order",
+)
+list_args.add_argument(
+    "ids",
+    type=id_list,
+    location="args",
+    required=False,
+    help="Comma separated ids of the Products to get, instead of filtering",
+)
+list_args.add_argument(
+    "skus",
+    type=sku_list,
+    location="args",
+    required=False,
+    help="Comma separated SKUs of the Products to get, instead of filtering",
+)
+
+# query string arguments for the facets, on top of the collection filters
+facet_args = product_args.copy()
+facet_args.add_argument(
+    "buckets",
+    type=inputs.int_range(1, 100),
+    location="args",
+    required=False,
+    default=10,
+    help="Number of price buckets (1 to 100)",
+)
+facet_args.add_argument(
+    "mode",
+    type=str,
+    location="args",
+    required=False,
+    default="fixed",
+    choices=FACET_MODES,
+    help="Equal width (fixed) or equal count (quantile) price buckets",
+)
+
+# query string arguments for repricing, on top of the collection filters
+reprice_args = product_args.copy()
+reprice_args.add_argument(
+    "dry_run",
+    type=inputs.boolean,
+    location="args",
+    required=False,
+    default=False,
+    help="Only count the Products that would change",
+)
+
+# query string arguments for the change feed
+change_args = reqparse.RequestParser()
+change_args.add_argument(
+    "since",
+    type=str,
+    location="args",
+    required=False,
+    help="The next token of the previous page, omit to read every Product",
+)
+change_args.add_argument(
+    "limit",
+    type=inputs.int_range(1, app.config["CHANGES_PAGE_SIZE"]),
+    location="args",
+    required=False,
+    default=app.config["CHANGES_PAGE_SIZE"],
+    help="The most changed and deleted Products in a page",
+)
+
+# query string arguments for the leaderboard
+top_args = reqparse.RequestParser()
+top_args.add_argument(
+    "by",
+    type=str,
+    location="args",
+    required=False,
+    default="likes",
+    choices=("likes",),
+    help="Rank Products by this column",
+)
+top_args.add_argument(
+    "n",
+    type=inputs.int_range(1, app.config["LEADERBOARD_SIZE"]),
+    location="args",
+    required=False,
+    default=10,
+    help="Number of Products to return",
+)
+
+# query string arguments for deleting many Products
+delete_args = reqparse.RequestParser()
+delete_args.add_argument(
+    "ids",
+    type=id_list,
+    location="args",
+    required=False,
+    help="Comma separated ids of the Products to delete",
+)
+
+# set on update responses that did not write anything
+WRITE_SKIPPED_HEADER = "X-Write-Skipped"
+
+# short lived cache of /products/stats results keyed by the filters
+stats_cache = TTLCache(app.config["STATS_CACHE_TTL"])
+
+# identical concurrent reads share one query and its serialized result
+flights = SingleFlight()
+
+# serialized /products responses keyed by the normalized filters, invalidated
+# whenever a Product changes
+list_cache = GenerationCache(
+    "list_cache",
+    maxsize=app.config["LIST_CACHE_SIZE"],
+    ttl=app.config["LIST_CACHE_TTL"],
+)
+
+
+@product_changed.connect
+def invalidate_list_cache(_product, **_kwargs):
+    """Starts a new catalog generation after a committed Product change"""
+    list_cache.bump()
+
+
+@products_changed.connect
+def invalidate_list_cache_all(_sender, **_kwargs):
+    """Starts a new catalog generation after a set based change"""
+    list_cache.bump()
+
+
+# most liked Products, kept current as Products change
+leaderboard = Leaderboard(
+    lambda limit: [product.serialize() for product in Product.find_most_liked(limit)],
+    capacity=app.config["LEADERBOARD_SIZE"],
+    max_age=app.config["LEADERBOARD_MAX_AGE"],
+)
+
+
+@product_changed.connect
+def refresh_leaderboard(product, action):
+    """Applies a committed Product change to the leaderboard"""
+    if action == "delete":
+        leaderboard.discard(product.id)
+    else:
+        leaderboard.record(product.serialize())
+
+
+@products_changed.connect
+def reload_leaderboard(_sender, **_kwargs):
+    """Reloads the leaderboard after a set based change of many Products"""
+    leaderboard.invalidate()
+
+
+@product_changed.connect
+def invalidate_product_cache(product, **_kwargs):
+    """Drops a changed Product from the shared cache"""
+    cache = app.extensions.get("product_cache")
+    if cache is not None:
+        cache.delete(product.id)
+
+
+@products_changed.connect
+def clear_product_cache(_sender, **_kwargs):
+    """Empties the shared cache after a set based change"""
+    cache = app.extensions.get("product_cache")
+    if cache is not None:
+        cache.clear()
+
+
+@products_invalidated.connect
+def invalidate_caches(_bus, ids):
+    """Drops what this worker cached after other workers changed Products"""
+    list_cache.bump()
+    stats_cache.clear()
+    leaderboard.invalidate()
+    cache = app.extensions.get("product_cache")
+    if cache is not None and ALL in ids:
+        cache.clear()
+    elif cache is not None:
+        for product_id in ids:
+            cache.delete(product_id)
+
+
+# fans committed Product changes out to the /products/stream clients
+event_hub = EventHub(
+    queue_size=app.config["EVENT_STREAM_QUEUE_SIZE"],
+    max_subscribers=app.config["EVENT_STREAM_MAX_CLIENTS"],
+)
+
+
+@product_changed.connect
+def publish_product_change(product, action):
+    """Publishes a committed Product change to the event stream"""
+    publish_event(action, product.serialize())
+
+
+@products_changed.connect
+def publish_products_change(_sender, action, count):
+    """Publishes a set based change of many Products to the event stream"""
+    publish_event(action, {"count": count})
+
+
+@products_invalidated.connect
+def publish_remote_changes(_bus, ids):
+    """Publishes the changes other workers committed to the event stream
+
+    An invalidation only carries ids, so the Products are read back: one at
+    version 1 was created, a later version was updated and a missing one was
+    deleted. When every Product may have changed, or they cannot be read,
+    the clients are told to resync from the change feed instead.
+    """
+    if not event_hub:
+        return
+    if ALL in ids:
+        publish_event("resync", {"reason": "the catalog changed"})
+        return
+    try:
+        found = {product.id: product for product in Product.find_by_ids(list(ids))}
+        events = []
+        for product_id in sorted(ids):
+            product = found.get(product_id)
+            if product is None:
+                events.append(("delete", {"id": product_id}))
+            else:
+                action = "create" if product.version == 1 else "update"
+                events.append((action, product.serialize()))
+    except Exception as error:  # pylint: disable=broad-except
+        app.logger.warning("Could not read the Products changed elsewhere: %s", error)
+        events = [("resync", {"reason": "the changes could not be read"})]
+    finally:
+        # the invalidation listener must not hold a transaction open
+        db.session.remove()
+    for event, data in events:
+        publish_event(event, data)
+
 
 ######################################################################
 # Authorization Decorator
@@ -162,6 +554,191 @@ product_args.add_argument(
 #     return decorated
 
 
+######################################################################
+# Rate Limiting Decorator
+######################################################################
+def rate_limited(operation: str):
+    """
+    Takes the cost of ``operation`` from the token bucket of the caller
+
+    Callers are told apart by their X-Api-Key, or by their address without
+    a valid one. Nothing is limited unless RATE_LIMIT_BACKEND is configured.
+    """
+
+    def decorator(func):
+        @wraps(func)
+        def decorated(*args, **kwargs):
+            limiter = app.extensions.get("rate_limiter")
+            if limiter:
+                limiter.acquire(rate_limit_client(), operation)
+            return func(*args, **kwargs)
+
+        return decorated
+
+    return decorator
+
+
+def rate_limit_client() -> str:
+    """
+    Returns the rate limit bucket owner of the request
+
+    A client presenting one of the RATE_LIMIT_CLIENT_KEYS is limited by the
+    name it is registered under. Any other key is ignored, or a client could
+    start a fresh bucket with every request, and the request is limited by
+    its address.
+    """
+    api_key = request.headers.get("X-Api-Key", "").encode()
+    for client, key in app.config["RATE_LIMIT_CLIENT_KEYS"].items():
+        if secrets.compare_digest(api_key, key.encode()):
+            return f"key:{client}"
+    return f"ip:{request.remote_addr}"
+
+
+######################################################################
+# Deadline Decorator
+######################################################################
+def time_limited(operation: str):
+    """
+    Bounds the time of a request by the deadline of ``operation``
+
+    See service.common.deadline, REQUEST_DEADLINES holds the seconds each
+    operation may take (0 for no limit).
+    """
+
+    def decorator(func):
+        @wraps(func)
+        def decorated(*args, **kwargs):
+            deadline.start(app.config["REQUEST_DEADLINES"][operation])
+            try:
+                return func(*args, **kwargs)
+            finally:
+                deadline.stop()
+
+        return decorated
+
+    return decorator
+
+
+######################################################################
+# Admission Control Decorator
+######################################################################
+def admitted(operation: str):
+    """
+    Holds a database slot of the worker while the endpoint runs
+
+    Collection scans ("list") have a low priority and are shed first, see
+    service.common.admission. Item reads wait no longer than their deadline.
+    Nothing is limited unless ADMISSION_CAPACITY is configured.
+    """
+    priority = LOW if operation == "list" else HIGH
+
+    def decorator(func):
+        @wraps(func)
+        def decorated(*args, **kwargs):
+            controller = app.extensions.get("admission")
+            if not controller:
+                return func(*args, **kwargs)
+            with controller.admit(priority, deadline.remaining()):
+                return func(*args, **kwargs)
+
+        return decorated
+
+    return decorator
+
+
+######################################################################
+# Resilience Decorator
+######################################################################
+def resilient(idempotent: bool = False):
+    """
+    Guards an endpoint with the circuit breaker of the database
+
+    Idempotent endpoints are retried after transient database errors, see
+    service.common.resilience.
+    """
+
+    def decorator(func):
+        @wraps(func)
+        def decorated(*args, **kwargs):
+            return resilience.call(
+                lambda: func(*args, **kwargs),
+                app.extensions["circuit_breaker"],
+                tries=app.config["DATABASE_TRIES"] if idempotent else 1,
+                delay=app.config["DATABASE_RETRY_DELAY"],
+                max_delay=app.config["DATABASE_RETRY_MAX_DELAY"],
+                cleanup=db.session.rollback,
+            )
+
+        return decorated
+
+    return decorator
+
+
+######################################################################
+# Degraded Mode Decorator
+######################################################################
+def snapshot_fallback(read):
+    """
+    Serves a GET from the local catalog snapshot when the database is down
+
+    ``read`` is called with the Snapshot and the arguments of the endpoint
+    and returns the response. Snapshot responses carry its creation time in
+    X-Snapshot-Time and its staleness in seconds in Age.
+    """
+
+    def decorator(func):
+        @wraps(func)
+        def decorated(*args, **kwargs):
+            try:
+                return func(*args, **kwargs)
+            except (OperationalError, InterfaceError, CircuitOpenError) as error:
+                catalog = app.extensions.get("local_catalog")
+                snapshot = catalog.current() if catalog else None
+                if snapshot is None:
+                    raise
+                app.logger.warning("Database unavailable, reading snapshot: %s", error)
+                metrics.increment("snapshot_reads")
+                body, code, headers = read(snapshot, *args[1:], **kwargs)
+                age = max(int(catalog.age()), 0)
+                headers.update(
+                    {
+                        "X-Snapshot-Time": snapshot.created_time.isoformat(),
+                        "Age": str(age),
+                    }
+                )
+                return body, code, headers
+
+        return decorated
+
+    return decorator
+
+
+def snapshot_product(snapshot, product_id: int) -> tuple:
+    """Returns the response for a single Product read from the snapshot"""
+    product = snapshot.find(product_id)
+    if not product:
+        abort(
+            status.HTTP_404_NOT_FOUND,
+            f"Product with id '{product_id}' was not found.",
+        )
+    return product, status.HTTP_200_OK, {"ETag": f'"{product["version"]}"'}
+
+
+def snapshot_products(snapshot) -> tuple:
+    """Returns the response for a Product list read from the snapshot"""
+    args = list_args.parse_args()
+    if args["ids"]:
+        products = {product_id: snapshot.find(product_id) for product_id in args["ids"]}
+        return batch_result(products, args["ids"]), status.HTTP_200_OK, {}
+    if args["skus"]:
+        products = {
+            sku: next(iter(snapshot.search(sku=sku)), None) for sku in args["skus"]
+        }
+        return batch_result(products, args["skus"]), status.HTTP_200_OK, {}
+    products = snapshot.search(**filter_args(args), sort=args["sort"])
+    return products, status.HTTP_200_OK, {}
+
+
 ######################################################################
 # Function to generate a random API key (good for testing)
 ######################################################################
@@ -179,14 +756,34 @@ class HealthResource(Resource):
 
     @api.doc("get_health")
     def get(self):
-        """Health Status"""
-        return {"status": "OK"}, status.HTTP_200_OK
+        """
+        Health Status
+
+        The snapshot_age is the staleness in seconds of the catalog snapshot
+        that reads fall back to while the database is down (null if none)
+        """
+        catalog = app.extensions.get("local_catalog")
+        age = catalog.age() if catalog else None
+        return {"status": "OK", "snapshot_age": age}, status.HTTP_200_OK
+
+
+######################################################################
+#  PATH: /metrics
+######################################################################
+@api.route("/metrics")
+class MetricsResource(Resource):
+    """Counters of this worker process"""
+
+    @api.doc("get_metrics")
+    def get(self):
+        """Returns the counters of this worker process"""
+        return metrics.snapshot(), status.HTTP_200_OK
 
 
 ######################################################################
 #  PATH: /products/{id}
 ######################################################################
-@api.route("/products/<int:product_id>")
+@api.route(f"/products/<int(max={MAX_ID}):product_id>")
 @api.param("product_id", "The Product identifier")
 class ProductResource(Resource):
     """
@@ -195,6 +792,7 @@ class ProductResource(Resource):
     Allows the manipulation of a single Product
     GET /products/{id} - Returns a Product with the id
     PUT /products/{id} - Update a Product with the id
+    PATCH /products/{id} - Update some fields of a Product with the id
     DELETE /products/{id} -  Deletes a Product with the id
     """
 
@@ -204,6 +802,11 @@ class ProductResource(Resource):
     @api.doc("get_products")
     @api.response(404, "Product not found")
     @api.marshal_with(product_model)
+    @snapshot_fallback(snapshot_product)
+    @time_limited("read")
+    @rate_limited("read")
+    @admitted("read")
+    @resilient(idempotent=True)
     def get(self, product_id):
         """
         Retrieve a single Product
@@ -211,13 +814,13 @@ class ProductResource(Resource):
         This endpoint will return a Product based on it's id
         """
         app.logger.info("Request to Retrieve a product with id [%s]", product_id)
-        product = Product.find(product_id)
+        product = cached_product(product_id)
         if not product:
             abort(
                 status.HTTP_404_NOT_FOUND,
                 f"Product with id '{product_id}' was not found.",
             )
-        return product.serialize(), status.HTTP_200_OK
+        return product, status.HTTP_200_OK, {"ETag": f'"{product["version"]}"'}
 
     # ------------------------------------------------------------------
     # UPDATE AN EXISTING PRODUCT
@@ -225,27 +828,67 @@ class ProductResource(Resource):
     @api.doc("update_products", security="apikey")
     @api.response(404, "Product not found")
     @api.response(400, "The posted Product data was not valid")
+    @api.response(412, "The Product does not match the If-Match version")
     @api.expect(product_model)
     @api.marshal_with(product_model)
     # @token_required
+    @time_limited("write")
+    @rate_limited("write")
+    @admitted("write")
+    @resilient()
     def put(self, product_id):
         """
         Update a Product
 
-        This endpoint will update a Product based the body that is posted
+        This endpoint will update a Product based the body that is posted.
+        With an If-Match header holding the ETag (version) of the Product the
+        update only happens if nobody changed the Product in the meantime.
+        Without one the last writer wins, whatever the version.
         """
         app.logger.info("Request to Update a product with id [%s]", product_id)
-        product = Product.find(product_id)
+        app.logger.debug("Payload = %s", api.payload)
+        data = Product().deserialize(api.payload)
+        values = {column: getattr(data, column) for column in EDITABLE_COLUMNS}
+        product, written = Product.update_by_id(product_id, values, if_match_versions())
         if not product:
             abort(
                 status.HTTP_404_NOT_FOUND,
                 f"Product with id '{product_id}' was not found.",
             )
+        return product.serialize(), status.HTTP_200_OK, write_headers(product, written)
+
+    # ------------------------------------------------------------------
+    # PARTIALLY UPDATE AN EXISTING PRODUCT
+    # ------------------------------------------------------------------
+    @api.doc("patch_products", security="apikey")
+    @api.response(404, "Product not found")
+    @api.response(400, "The posted Product data was not valid")
+    @api.response(412, "The Product does not match the If-Match version")
+    @api.expect(patch_model)
+    @api.marshal_with(product_model)
+    # @token_required
+    @time_limited("write")
+    @rate_limited("write")
+    @admitted("write")
+    @resilient()
+    def patch(self, product_id):
+        """
+        Partially Update a Product
+
+        This endpoint will update only the fields present in the body. The
+        change is made with a single UPDATE ... RETURNING statement, honoring
+        an optional If-Match header like PUT.
+        """
+        app.logger.info("Request to Patch a product with id [%s]", product_id)
         app.logger.debug("Payload = %s", api.payload)
-        product.deserialize(api.payload)
-        product.id = product_id
-        product.update()
-        return product.serialize(), status.HTTP_200_OK
+        values = Product.deserialize_changes(api.payload)
+        product, written = Product.update_by_id(product_id, values, if_match_versions())
+        if not product:
+            abort(
+                status.HTTP_404_NOT_FOUND,
+                f"Product with id '{product_id}' was not found.",
+            )
+        return product.serialize(), status.HTTP_200_OK, write_headers(product, written)
 
     # ------------------------------------------------------------------
     # DELETE A PRODUCT
@@ -253,16 +896,18 @@ class ProductResource(Resource):
     @api.doc("delete_products", security="apikey")
     @api.response(204, "Product deleted")
     # @token_required
+    @time_limited("write")
+    @rate_limited("write")
+    @admitted("write")
+    @resilient()
     def delete(self, product_id):
         """
         Delete a Product
 
         This endpoint will delete a Product based the id specified in the path
         """
-        app.logger.warning(">>> [DELETE HIT] Reached delete() for id: %s", product_id)
-        product = Product.find(product_id)
-        if product:
-            product.delete()
+        app.logger.info("Request to Delete a product with id [%s]", product_id)
+        if Product.delete_by_ids([product_id]):
             app.logger.info("Product with id [%s] was deleted", product_id)
 
         return "", status.HTTP_204_NO_CONTENT
@@ -279,34 +924,34 @@ class ProductCollection(Resource):
     # LIST ALL PRODUCTS
     # ------------------------------------------------------------------
     @api.doc("list_products")
-    @api.expect(product_args, validate=True)
+    @api.expect(list_args, validate=True)
+    @snapshot_fallback(snapshot_products)
+    @time_limited("list")
+    @rate_limited("list")
+    @admitted("list")
+    @resilient(idempotent=True)
     def get(self):
         """
         List all Products
 
         This endpoint allows you to retrieve products from the database.
-        You can optionally filter the results by name, SKU, min_price, and/or max_price.
+        You can optionally filter the results by name, SKU, min_price, and/or max_price,
+        and sort them by price, likes or created_time.
+        With ids (or skus) it instead returns the products with those ids in
+        the requested order, and the ids that were not found, as
+        {"products": [...], "missing": [...]}.
         """
         app.logger.info("Request for product list")
-        products = []
-        args = product_args.parse_args()
-
-        if args["sku"]:
-            products = Product.find_by_sku(args["sku"])
-        elif args["name"]:
-            products = Product.find_by_name(args["name"])
-        elif args["min_price"] and args["max_price"]:
-            products = Product.find_by_price_range(
-                float(args["min_price"]), float(args["max_price"])
-            )
-        elif args["min_price"]:
-            products = Product.find_by_min_price(float(args["min_price"]))
-        elif args["max_price"]:
-            products = Product.find_by_max_price(float(args["max_price"]))
-        else:
-            products = Product.all()
-
-        results = [product.serialize() for product in products]
+        args = list_args.parse_args()
+        if args["ids"] or args["skus"]:
+            return batch_serialized(args), status.HTTP_200_OK
+        if not g.get("use_replica"):
+            # the cache may predate a write the client must read
+            return list_serialized(args), status.HTTP_200_OK
+        key = list_key(args)
+        results = list_cache.get(key)
+        if results is None:
+            results = coalesce(key, lambda: cache_list(key, args))
         return results, status.HTTP_200_OK
 
     # ------------------------------------------------------------------
@@ -317,6 +962,10 @@ class ProductCollection(Resource):
     @api.expect(create_model)
     @api.marshal_with(product_model, code=201)
     # @token_required
+    @time_limited("write")
+    @rate_limited("write")
+    @admitted("write")
+    @resilient()
     def post(self):
         """
         Creates a Product
@@ -334,16 +983,34 @@ class ProductCollection(Resource):
         return product.serialize(), status.HTTP_201_CREATED, {"Location": location_url}
 
     # ------------------------------------------------------------------
-    # DELETE ALL PRODUCTS (for testing only)
+    # DELETE MANY PRODUCTS (or all of them for testing only)
     # ------------------------------------------------------------------
     @api.doc("delete_all_products", security="apikey")
+    @api.expect(delete_args, validate=True)
+    @api.response(200, "The result for each requested id", [delete_result_model])
     @api.response(204, "All Products deleted")
     # @token_required
+    @time_limited("write")
+    @rate_limited("write")
+    @admitted("write")
+    @resilient()
     def delete(self):
         """
-        Delete all Product
-        This endpoint will delete all Product only if the system is under test
+        Delete many Products
+        With ids this endpoint deletes those Products in a single statement and
+        returns whether each one was deleted. Without ids it will delete all
+        Products only if the system is under test
         """
+        ids = delete_args.parse_args()["ids"]
+        if ids:
+            app.logger.info("Request to Delete products with ids %s", ids)
+            deleted = {product.id for product in Product.delete_by_ids(ids)}
+            results = [
+                {"id": product_id, "deleted": product_id in deleted}
+                for product_id in ids
+            ]
+            return results, status.HTTP_200_OK
+
         app.logger.info("Request to Delete all products...")
         if "TESTING" in app.config and app.config["TESTING"]:
             Product.remove_all()
@@ -353,10 +1020,238 @@ class ProductCollection(Resource):
         return "", status.HTTP_204_NO_CONTENT
 
 
+######################################################################
+#  PATH: /products/stats
+######################################################################
+@api.route("/products/stats")
+class ProductStats(Resource):
+    """Aggregate statistics for collections of Products"""
+
+    @api.doc("get_product_stats")
+    @api.expect(product_args, validate=True)
+    @api.marshal_with(stats_model)
+    @time_limited("list")
+    @rate_limited("list")
+    @admitted("list")
+    @resilient(idempotent=True)
+    def get(self):
+        """
+        Product Statistics
+
+        This endpoint returns the count, price statistics and total likes of
+        the Products matching the same filters as the list endpoint. Results
+        are computed in the database and cached for a few seconds.
+        """
+        app.logger.info("Request for product statistics")
+        filters = filter_args(product_args.parse_args())
+        key = tuple(sorted(filters.items()))
+        stats = stats_cache.get_or_load(
+            key, lambda: Product.statistics(Product.find_by_filters(**filters))
+        )
+        headers = {"Cache-Control": f"max-age={int(stats_cache.ttl)}"}
+        return stats, status.HTTP_200_OK, headers
+
+
+######################################################################
+#  PATH: /products/facets
+######################################################################
+@api.route("/products/facets")
+class ProductFacets(Resource):
+    """Facet counts for collections of Products"""
+
+    @api.doc("get_product_facets")
+    @api.expect(facet_args, validate=True)
+    @time_limited("list")
+    @rate_limited("list")
+    @admitted("list")
+    @resilient(idempotent=True)
+    def get(self):
+        """
+        Product Facets
+
+        This endpoint returns a price histogram and the count of each name
+        for the Products matching the same filters as the list endpoint.
+        """
+        app.logger.info("Request for product facets")
+        args = facet_args.parse_args()
+        products = Product.find_by_filters(**filter_args(args))
+        facets = Product.facets(products, args["buckets"], args["mode"])
+        return facets, status.HTTP_200_OK
+
+
+######################################################################
+#  PATH: /products/changes
+######################################################################
+@api.route("/products/changes")
+class ProductChanges(Resource):
+    """The Products changed since a point in time"""
+
+    @api.doc("list_product_changes")
+    @api.expect(change_args, validate=True)
+    @api.response(200, "The changes of the page", changes_model)
+    @api.response(400, "The since token was not valid")
+    @api.response(410, "The since token has expired, read every Product again")
+    @time_limited("list")
+    @rate_limited("list")
+    @admitted("list")
+    @resilient(idempotent=True)
+    def get(self):
+        """
+        List Product Changes
+
+        This endpoint returns the Products created or updated and the ids of
+        the Products deleted after the since token, with the token to pass
+        next time. Keep reading while more is true.
+        """
+        app.logger.info("Request for product changes")
+        args = change_args.parse_args()
+        # the horizon is the transactions in progress on the primary, so a
+        # lagging replica could still miss changes from before it
+        g.use_replica = False
+        changes = Product.changes(
+            args["since"],
+            limit=args["limit"],
+            settle=app.config["CHANGES_SETTLE_TIME"],
+            retention=app.config["DELETION_LOG_RETENTION"],
+        )
+        return changes, status.HTTP_200_OK
+
+
+######################################################################
+#  PATH: /products/stream
+######################################################################
+@api.route("/products/stream")
+class ProductStream(Resource):
+    """A live stream of Product changes"""
+
+    @api.doc("stream_products", produces=["text/event-stream"])
+    @api.response(200, "A text/event-stream of create, update, like and delete events")
+    @api.response(
+        503, "The worker already serves the most stream clients or is not threaded"
+    )
+    def get(self):
+        """
+        Stream Product Changes
+
+        This endpoint pushes every committed Product change as a Server-Sent
+        Event named after the action, with the Product as JSON data. A
+        client that falls behind receives a dropped event and is
+        disconnected, it should catch up from /products/changes.
+        """
+        app.logger.info("Request for the product event stream")
+        if not request.environ.get("wsgi.multithread"):
+            # a stream would hold the only thread of the worker for its age
+            abort(
+                status.HTTP_503_SERVICE_UNAVAILABLE,
+                "Event streams need a threaded worker, e.g. gunicorn gthread",
+            )
+        try:
+            subscription = event_hub.subscribe()
+        except HubFullError as error:
+            abort(status.HTTP_503_SERVICE_UNAVAILABLE, str(error))
+        return Response(
+            stream_events(
+                subscription,
+                heartbeat=app.config["EVENT_STREAM_HEARTBEAT"],
+                max_age=app.config["EVENT_STREAM_MAX_AGE"],
+            ),
+            mimetype="text/event-stream",
+            headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+        )
+
+
+######################################################################
+#  PATH: /products/snapshot
+######################################################################
+@api.route("/products/snapshot")
+class ProductSnapshot(Resource):
+    """A columnar snapshot of every Product"""
+
+    @api.doc("snapshot_products", produces=["application/zip"])
+    @api.response(200, "A zip of .npy column files and a manifest.json")
+    @rate_limited("list")
+    @admitted("list")
+    @resilient(idempotent=True)
+    def get(self):
+        """
+        Snapshot the Products
+
+        This endpoint returns every Product as an uncompressed zip of NumPy
+        .npy files, one array per column, that can be extracted and loaded
+        with numpy.load(mmap_mode="r"). The snapshot is rewritten when it is
+        older than SNAPSHOT_MAX_AGE seconds.
+        """
+        app.logger.info("Request for the product snapshot")
+        return send_file(
+            snapshot_archive(),
+            mimetype="application/zip",
+            download_name="products-snapshot.zip",
+            conditional=True,
+        )
+
+
+######################################################################
+#  PATH: /products/reprice
+######################################################################
+@api.route("/products/reprice")
+class ProductReprice(Resource):
+    """Changes the price of many Products at once"""
+
+    @api.doc("reprice_products", security="apikey")
+    @api.expect(reprice_args, reprice_model, validate=False)
+    @api.response(400, "The posted reprice data was not valid")
+    @api.marshal_with(reprice_result_model)
+    # @token_required
+    @time_limited("write")
+    @rate_limited("write")
+    @admitted("write")
+    @resilient()
+    def post(self):
+        """
+        Reprice Products
+
+        This endpoint will set, multiply or add to the price of every Product
+        matching the filters with a single UPDATE. With dry_run it only
+        counts the Products that would change.
+        """
+        app.logger.info("Request to Reprice products")
+        app.logger.debug("Payload = %s", api.payload)
+        args = reprice_args.parse_args()
+        products = Product.find_by_filters(**filter_args(args))
+        count = Product.reprice(products, api.payload, dry_run=args["dry_run"])
+        return {"count": count, "dry_run": args["dry_run"]}, status.HTTP_200_OK
+
+
+######################################################################
+#  PATH: /products/top
+######################################################################
+@api.route("/products/top")
+class ProductTop(Resource):
+    """Leaderboard of the most liked Products"""
+
+    @api.doc("get_top_products")
+    @api.expect(top_args, validate=True)
+    @api.marshal_list_with(product_model)
+    @time_limited("read")
+    @rate_limited("read")
+    @admitted("read")
+    @resilient(idempotent=True)
+    def get(self):
+        """
+        Most Liked Products
+
+        This endpoint returns the n most liked Products from an in-memory
+        leaderboard that is kept current as Products are liked.
+        """
+        args = top_args.parse_args()
+        app.logger.info("Request for the top %s products by %s", args["n"], args["by"])
+        return leaderboard.top(args["n"]), status.HTTP_200_OK
+
+
 ######################################################################
 #  PATH: /products/{id}/like
 ######################################################################
-@api.route("/products/<int:product_id>/like")
+@api.route(f"/products/<int(max={MAX_ID}):product_id>/like")
 @api.param("product_id", "The Product identifier")
 class LikeResource(Resource):
     """Like actions on a Product"""
@@ -365,6 +1260,10 @@ class LikeResource(Resource):
     @api.response(404, "Product not found")
     @api.response(409, "The Product cannot be liked")
     @api.marshal_with(product_model)
+    @time_limited("like")
+    @rate_limited("like")
+    @admitted("like")
+    @resilient()
     def put(self, product_id):
         """
         Like a Product
@@ -372,17 +1271,17 @@ class LikeResource(Resource):
         This endpoint will increment the like count for a Product
         """
         app.logger.info("Request to Like a product with id [%s]", product_id)
-        product = Product.find(product_id)
+        # increment in the database so concurrent likes never conflict
+        product, _ = Product.update_by_id(
+            product_id, {"likes": Product.likes + 1}, action="like"
+        )
         if not product:
             abort(
                 status.HTTP_404_NOT_FOUND,
                 f"Product with id '{product_id}' was not found.",
             )
-
-        product.likes += 1
-        product.update()
         app.logger.info("Product with id [%s] has been liked!", product.id)
-        return product.serialize(), status.HTTP_200_OK
+        return product.serialize(), status.HTTP_200_OK, etag_header(product)
 
 
 ######################################################################
@@ -396,6 +1295,222 @@ def abort(error_code: int, message: str):
     api.abort(error_code, message)
 
 
+def etag_header(product: Product) -> dict:
+    """Returns the ETag header holding the version of a Product"""
+    return {"ETag": f'"{product.version}"'}
+
+
+def coalesce(key: tuple, function):
+    """
+    Returns function(), sharing it with the identical reads in flight
+
+    Requests that must read their own writes (see db_routing) are not
+    coalesced, a read in flight may have started before their write.
+    """
+    if not g.get("use_replica"):
+        return function()
+    return flights.do(key, function)
+
+
+def list_key(args: dict) -> tuple:
+    """
+    Returns the normalized key of a list request
+
+    Only the filters that find_by_filters() applies are part of the key, so
+    a request with a sku and a name shares the key of the sku alone.
+    """
+    filters = filter_args(args)
+    if filters["sku"]:
+        key = ("sku", filters["sku"])
+    elif filters["name"]:
+        key = ("name", filters["name"])
+    else:
+        key = ("price", filters["min_price"], filters["max_price"])
+    return ("list", *key, args.get("sort"))
+
+
+def cached_product(product_id: int):
+    """
+    Returns the serialized Product with the id from the shared cache,
+    reading it (and caching it) on a miss
+
+    Requests that must read their own writes skip the cache.
+    """
+    cache = app.extensions.get("product_cache")
+    if cache is None or not g.get("use_replica"):
+        return coalesce(("product", product_id), lambda: find_serialized(product_id))
+    product = cache.get(product_id)
+    if product is None:
+        product = coalesce(
+            ("product", product_id), lambda: cache_product(cache, product_id)
+        )
+    return product
+
+
+def cache_product(cache, product_id: int):
+    """
+    Returns the serialized Product with the id and caches it
+
+    The stamp is taken before the query by the caller that runs it, a caller
+    sharing a flight started before a write must not store its result.
+    """
+    stamp = cache.stamp(product_id)
+    product = find_serialized(product_id)
+    if product:
+        cache.set(product_id, product, stamp)
+    return product
+
+
+def find_serialized(product_id: int):
+    """Returns the serialized Product with the id, or None if not found"""
+    product = Product.find(product_id)
+    deadline.check("serializing")
+    return product.serialize() if product else None
+
+
+def cached_products(ids: list) -> dict:
+    """
+    Returns the serialized Products with the ids by id, reading the ones
+    missing from the shared cache (and caching them) in a single query
+
+    Requests that must read their own writes skip the cache.
+    """
+    cache = app.extensions.get("product_cache")
+    if not g.get("use_replica"):
+        cache = None
+    products = {}
+    if cache:
+        for product_id in ids:
+            product = cache.get(product_id)
+            if product is not None:
+                products[product_id] = product
+    misses = [product_id for product_id in ids if product_id not in products]
+    if not misses:
+        return products
+    stamps = (
+        {product_id: cache.stamp(product_id) for product_id in misses} if cache else {}
+    )
+    found = Product.find_by_ids(misses)
+    deadline.check("serializing")
+    for product in found:
+        products[product.id] = product.serialize()
+        if cache:
+            cache.set(product.id, products[product.id], stamps[product.id])
+    return products
+
+
+def batch_serialized(args: dict) -> dict:
+    """Returns the result of a batch request for ids or SKUs"""
+    if args["ids"]:
+        return batch_result(cached_products(args["ids"]), args["ids"])
+    found = Product.find_by_skus(args["skus"])
+    deadline.check("serializing")
+    products = {product.sku: product.serialize() for product in found}
+    return batch_result(products, args["skus"])
+
+
+def batch_result(products: dict, keys: list) -> dict:
+    """Returns the Products found for the keys in order and the missing keys"""
+    return {
+        "products": [products[key] for key in keys if products.get(key)],
+        "missing": [key for key in keys if not products.get(key)],
+    }
+
+
+def cache_list(key: tuple, args: dict) -> list:
+    """
+    Returns the serialized Products of a list request and caches them
+
+    The generation is read before the query by the caller that runs it, a
+    caller sharing a flight started before a write must not store its result.
+    """
+    generation = list_cache.generation
+    results = list_serialized(args)
+    list_cache.set(key, results, generation)
+    return results
+
+
+def list_serialized(args: dict) -> list:
+    """Returns the serialized Products of a list request"""
+    query = Product.find_by_filters(**filter_args(args))
+    if args["sort"]:
+        query = Product.sort(query, args["sort"])
+    products = list(query)
+    deadline.check("serializing")
+    results = [product.serialize() for product in products]
+    deadline.check("responding")
+    return results
+
+
+def write_headers(product: Product, written: bool) -> dict:
+    """Returns the headers of an update, flagging one that changed nothing"""
+    headers = etag_header(product)
+    if not written:
+        headers[WRITE_SKIPPED_HEADER] = "true"
+    return headers
+
+
+def if_match_versions() -> set:
+    """Returns the versions listed in the If-Match header
+
+    None means the request is unconditional: there is no If-Match header or
+    it is the wildcard "*". If-Match uses the strong comparison, so weak ETags
+    and ETags that are not versions can never match.
+    """
+    if not request.if_match or request.if_match.star_tag:
+        return None
+    tags = request.if_match.as_set()
+    return {int(tag) for tag in tags if tag.isdigit()}
+
+
+def filter_args(args: dict) -> dict:
+    """Returns the collection filters from the parsed query string arguments"""
+    return {key: args.get(key) for key in ("name", "sku", "min_price", "max_price")}
+
+
+def sse_message(event: str, data: dict) -> str:
+    """Formats a Server-Sent Event"""
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+
+def publish_event(event: str, data: dict):
+    """Formats an event once and offers it to every stream client"""
+    dropped = event_hub.publish(sse_message(event, data))
+    if dropped:
+        app.logger.warning("Dropped %s slow event stream clients", dropped)
+        metrics.increment("stream_clients_dropped", dropped)
+
+
+def stream_events(subscription, heartbeat: float, max_age: float):
+    """Yields the events of a Subscription until it ends or is dropped"""
+    ends_at = time.monotonic() + max_age
+    try:
+        # ask the client to reconnect quickly once the stream ends
+        yield "retry: 1000\n\n"
+        while time.monotonic() < ends_at:
+            event = subscription.get(timeout=heartbeat)
+            if event is DROPPED:
+                yield sse_message("dropped", {"reason": "client too slow"})
+                return
+            yield event or ": keep-alive\n\n"
+    finally:
+        event_hub.unsubscribe(subscription)
+
+
+def snapshot_archive() -> str:
+    """Returns the path of the snapshot zip, writing a new one when stale"""
+    path = app.config["SNAPSHOT_PATH"]
+    archive = f"{path}.zip"
+    with snapshot_lock(path):
+        if (
+            not os.path.exists(archive)
+            or time.time() - os.path.getmtime(archive) > app.config["SNAPSHOT_MAX_AGE"]
+        ):
+            Product.snapshot(path, chunk_size=app.config["SNAPSHOT_CHUNK_SIZE"])
+            archive_snapshot(path, archive)
+    return archive
+
+
 def data_reset():
     """Removes all Products from the database"""
     Product.remove_all()
@@ -0,0 +1,125 @@
+######################################################################
+# Copyright 2016, 2024 John J. Rofrano. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+######################################################################
+
+"""
+Test cases for the Admission Control
+"""
+
+import time
+import threading
+from unittest import TestCase
+from unittest.mock import patch
+from wsgi import app
+from service.common import admission, metrics
+from service.common.admission import HIGH, LOW, AdmissionController, OverloadedError
+
+
+######################################################################
+#  A D M I S S I O N   C O N T R O L   T E S T   C A S E S
+######################################################################
+class TestAdmission(TestCase):
+    """Admission Control Tests"""
+
+    def setUp(self):
+        metrics.reset()
+
+    def test_admit(self):
+        """It should hold a slot for the duration of the block"""
+        controller = AdmissionController(2)
+        with controller.admit(HIGH):
+            self.assertEqual(controller.in_flight, 1)
+            with controller.admit(LOW, timeout=1):
+                self.assertEqual(controller.in_flight, 2)
+        self.assertEqual(controller.in_flight, 0)
+        with self.assertRaises(ValueError):
+            with controller.admit(HIGH):
+                raise ValueError()
+        self.assertEqual(controller.in_flight, 0)
+
+    def test_shed_low_priority(self):
+        """It should shed collection scans before the slots run out"""
+        controller = AdmissionController(3, reserve=1, retry_after=2)
+        controller.acquire(HIGH)
+        controller.acquire(LOW)
+        with self.assertRaises(OverloadedError) as context:
+            controller.acquire(LOW)
+        self.assertEqual(context.exception.retry_after, 2)
+        controller.acquire(HIGH)
+        self.assertEqual(controller.in_flight, 3)
+        self.assertEqual(metrics.value("requests_shed"), 1)
+        self.assertEqual(metrics.value("requests_shed_low"), 1)
+
+    def test_shed_slow_waits(self):
+        """It should shed collection scans while requests wait for slots"""
+        controller = AdmissionController(3, target_wait=0.1)
+        controller.wait_time = 0.2
+        self.assertRaises(OverloadedError, controller.acquire, LOW)
+        controller.wait_time = 0.0
+        controller.waiting = 1
+        self.assertRaises(OverloadedError, controller.acquire, LOW)
+
+    def test_wait_time_decays(self):
+        """It should stop shedding collection scans once the waits are over"""
+        controller = AdmissionController(3, target_wait=0.1)
+        controller.wait_time = 1.0
+        self.assertRaises(OverloadedError, controller.acquire, LOW)
+        later = time.monotonic() + 10
+        with patch("service.common.admission.time.monotonic", return_value=later):
+            controller.acquire(LOW)
+        self.assertLess(controller.wait_time, 0.1)
+        self.assertEqual(controller.in_flight, 1)
+
+    def test_shed_high_priority(self):
+        """It should shed item requests that waited too long for a slot"""
+        controller = AdmissionController(1, max_wait=10)
+        controller.acquire(HIGH)
+        self.assertRaises(OverloadedError, controller.acquire, HIGH, 0.01)
+        self.assertRaises(OverloadedError, controller.acquire, HIGH, -1)
+        self.assertEqual(controller.waiting, 0)
+        self.assertEqual(controller.in_flight, 1)
+        self.assertGreater(controller.wait_time, 0)
+        self.assertEqual(metrics.value("requests_shed_high"), 2)
+
+    def test_wait_for_slot(self):
+        """It should admit a waiting item request once a slot is released"""
+        controller = AdmissionController(1, max_wait=5)
+        controller.acquire(HIGH)
+        admitted = threading.Event()
+
+        def wait():
+            with controller.admit(HIGH):
+                admitted.set()
+
+        thread = threading.Thread(target=wait)
+        thread.start()
+        self.assertFalse(admitted.wait(0.05))
+        controller.release()
+        thread.join(5)
+        self.assertTrue(admitted.is_set())
+        self.assertEqual(controller.in_flight, 0)
+        self.assertGreater(controller.wait_time, 0)
+
+    def test_init_app(self):
+        """It should only set up admission control with a capacity"""
+        with patch.dict(app.extensions), app.app_context():
+            with patch.dict(app.config, {"ADMISSION_CAPACITY": 0}):
+                app.extensions.pop("admission", None)
+                self.assertIsNone(admission.init_app(app))
+                self.assertNotIn("admission", app.extensions)
+            with patch.dict(app.config, {"ADMISSION_CAPACITY": 4}):
+                controller = admission.init_app(app)
+            self.assertIs(app.extensions["admission"], controller)
+            self.assertEqual(controller.capacity, 4)
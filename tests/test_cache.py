@@ -0,0 +1,146 @@
+######################################################################
+# Copyright 2016, 2024 John J. Rofrano. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+######################################################################
+
+"""
+Test cases for the Caches
+"""
+
+from unittest import TestCase
+from unittest.mock import patch
+from service.common import metrics
+from service.common.cache import GenerationCache, TTLCache
+
+
+######################################################################
+#  T T L   C A C H E   T E S T   C A S E S
+######################################################################
+class TestTTLCache(TestCase):
+    """TTL Cache Tests"""
+
+    def test_set_and_get(self):
+        """It should return a stored value until it expires"""
+        cache = TTLCache(ttl=10)
+        with patch("service.common.cache.time.monotonic", return_value=100.0):
+            cache.set("key", "value")
+            self.assertEqual(cache.get("key"), "value")
+        with patch("service.common.cache.time.monotonic", return_value=110.0):
+            self.assertIsNone(cache.get("key"))
+        self.assertEqual(len(cache), 0)
+
+    def test_missing_key(self):
+        """It should return the default for a missing key"""
+        cache = TTLCache(ttl=10)
+        self.assertIsNone(cache.get("missing"))
+        self.assertEqual(cache.get("missing", 0), 0)
+
+    def test_get_or_load(self):
+        """It should only call the loader on a miss"""
+        cache = TTLCache(ttl=10)
+        calls = []
+        for _ in range(3):
+            value = cache.get_or_load("key", lambda: calls.append(1) or "loaded")
+            self.assertEqual(value, "loaded")
+        self.assertEqual(len(calls), 1)
+
+    def test_disabled(self):
+        """It should not store anything when the ttl is zero"""
+        cache = TTLCache(ttl=0)
+        cache.set("key", "value")
+        self.assertIsNone(cache.get("key"))
+
+    def test_evict_oldest(self):
+        """It should evict the oldest entry when full"""
+        cache = TTLCache(ttl=10, maxsize=2)
+        cache.set("a", 1)
+        cache.set("b", 2)
+        cache.set("c", 3)
+        self.assertEqual(len(cache), 2)
+        self.assertIsNone(cache.get("a"))
+        self.assertEqual(cache.get("c"), 3)
+
+    def test_evict_expired(self):
+        """It should evict expired entries first when full"""
+        cache = TTLCache(ttl=10, maxsize=2)
+        with patch("service.common.cache.time.monotonic", return_value=100.0):
+            cache.set("a", 1)
+        with patch("service.common.cache.time.monotonic", return_value=105.0):
+            cache.set("b", 2)
+        with patch("service.common.cache.time.monotonic", return_value=111.0):
+            cache.set("c", 3)
+            self.assertEqual(cache.get("b"), 2)
+            self.assertEqual(cache.get("c"), 3)
+
+    def test_clear(self):
+        """It should remove every entry"""
+        cache = TTLCache(ttl=10)
+        cache.set("a", 1)
+        cache.clear()
+        self.assertEqual(len(cache), 0)
+
+
+######################################################################
+#  G E N E R A T I O N   C A C H E   T E S T   C A S E S
+######################################################################
+class TestGenerationCache(TestCase):
+    """Generation Cache Tests"""
+
+    def setUp(self):
+        metrics.reset()
+
+    def test_bump(self):
+        """It should invalidate every entry when the generation is bumped"""
+        cache = GenerationCache("test_cache")
+        cache.set("a", [1], cache.generation)
+        cache.set("b", [2], cache.generation)
+        self.assertEqual(cache.get("a"), [1])
+        cache.bump()
+        self.assertIsNone(cache.get("a"))
+        self.assertEqual(len(cache), 1)
+        self.assertEqual(metrics.value("test_cache_hits"), 1)
+        self.assertEqual(metrics.value("test_cache_misses"), 1)
+
+    def test_stale_generation(self):
+        """It should not store a value computed during a bump"""
+        cache = GenerationCache("test_cache")
+        generation = cache.generation
+        cache.bump()
+        cache.set("a", [1], generation)
+        self.assertIsNone(cache.get("a"))
+        self.assertEqual(len(cache), 0)
+
+    def test_lru_eviction(self):
+        """It should evict the least recently used entry"""
+        cache = GenerationCache("test_cache", maxsize=2)
+        cache.set("a", 1, 0)
+        cache.set("b", 2, 0)
+        cache.get("a")
+        cache.set("c", 3, 0)
+        self.assertEqual((cache.get("a"), cache.get("b"), cache.get("c")), (1, None, 3))
+
+    def test_ttl(self):
+        """It should expire entries after the ttl"""
+        cache = GenerationCache("test_cache", ttl=10)
+        with patch("service.common.cache.time.monotonic", return_value=100.0):
+            cache.set("a", 1, 0)
+            self.assertEqual(cache.get("a"), 1)
+        with patch("service.common.cache.time.monotonic", return_value=110.0):
+            self.assertIsNone(cache.get("a"))
+
+    def test_disabled(self):
+        """It should not store anything with a maxsize of zero"""
+        cache = GenerationCache("test_cache", maxsize=0)
+        cache.set("a", 1, 0)
+        self.assertIsNone(cache.get("a"))
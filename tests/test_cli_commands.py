@@ -20,13 +20,25 @@ CLI Command Extensions for Flask
 
 # pylint: disable=duplicate-code
 import os
+import shutil
+import tempfile
 from unittest import TestCase
 from unittest.mock import patch, MagicMock
 from click.testing import CliRunner
 
 # pylint: disable=unused-import
 from wsgi import app  # noqa: F401
-from service.common.cli_commands import db_create  # noqa: E402
+from service.models import db, Product, ProductDeletion, OutboxEvent
+from service.common.cli_commands import (  # noqa: E402
+    db_create,
+    db_upgrade,
+    outbox_relay,
+    products_prune_deletions,
+    products_seed,
+    products_snapshot,
+)
+from service.common.snapshot import Snapshot
+from tests.factories import ProductFactory
 
 
 class TestFlaskCLI(TestCase):
@@ -42,3 +54,103 @@ class TestFlaskCLI(TestCase):
         with patch.dict(os.environ, {"FLASK_APP": "wsgi:app"}, clear=True):
             result = self.runner.invoke(db_create)
             self.assertEqual(result.exit_code, 0)
+
+    @patch("service.common.cli_commands.upgrade_db")
+    def test_db_upgrade(self, upgrade_mock):
+        """It should upgrade the tables with db-upgrade"""
+        upgrade_mock.return_value = ["add product.version"]
+        with patch.dict(os.environ, {"FLASK_APP": "wsgi:app"}, clear=True):
+            result = self.runner.invoke(db_upgrade)
+        self.assertEqual(result.exit_code, 0, result.output)
+        self.assertIn("Applied: add product.version", result.output)
+        self.assertIn("The database is up to date", result.output)
+
+    def test_products_seed(self):
+        """It should bulk load generated products with products-seed"""
+        with app.app_context():
+            db.session.query(Product).delete()
+            db.session.commit()
+            started = db.session.execute(db.text("SELECT localtimestamp")).scalar()
+            db.session.commit()
+            with patch.dict(os.environ, {"FLASK_APP": "wsgi:app"}, clear=True):
+                result = self.runner.invoke(
+                    products_seed,
+                    ["--count", "25", "--batch-size", "10", "--seed", "7"],
+                )
+            self.assertEqual(result.exit_code, 0, result.output)
+            self.assertIn("Seeded 25/25 products", result.output)
+            products = Product.all()
+            self.assertEqual(len(products), 25)
+            self.assertEqual(len({product.sku for product in products}), 25)
+            for product in products:
+                self.assertGreater(product.price, 0)
+                self.assertGreaterEqual(product.likes, 0)
+                self.assertLessEqual(product.created_time, product.updated_time)
+                # updated by the seed, so the change feed delivers them
+                self.assertGreaterEqual(product.updated_time, started)
+            db.session.query(Product).delete()
+            db.session.commit()
+
+    def test_products_prune_deletions(self):
+        """It should drop expired tombstones with products-prune-deletions"""
+        with app.app_context():
+            db.session.query(ProductDeletion).delete()
+            db.session.add(ProductDeletion(product_id=1))
+            db.session.commit()
+            with patch.dict(app.config, {"DELETION_LOG_RETENTION": 0}):
+                result = self.runner.invoke(products_prune_deletions)
+            self.assertEqual(result.exit_code, 0, result.output)
+            self.assertIn("Pruned 1 product deletions", result.output)
+            self.assertEqual(ProductDeletion.query.count(), 0)
+
+    def test_outbox_relay(self):
+        """It should publish the outbox events with outbox-relay"""
+        with app.app_context():
+            db.session.query(OutboxEvent).delete()
+            db.session.add_all(
+                OutboxEvent(action="create", product_id=n, payload={"id": n})
+                for n in range(3)
+            )
+            db.session.commit()
+            with patch.dict(app.config, {"OUTBOX_BATCH_SIZE": 2}):
+                result = self.runner.invoke(outbox_relay, ["--sink", "queue", "--once"])
+            self.assertEqual(result.exit_code, 0, result.output)
+            self.assertIn("Relayed 3 outbox events", result.output)
+            self.assertEqual(OutboxEvent.query.count(), 0)
+
+    @patch("service.common.cli_commands.OutboxRelay.run")
+    def test_outbox_relay_forever(self, run_mock):
+        """It should keep relaying with outbox-relay unless told to stop"""
+        with patch.dict(app.config, {"OUTBOX_SINK": "queue"}):
+            result = self.runner.invoke(outbox_relay)
+        self.assertEqual(result.exit_code, 0, result.output)
+        run_mock.assert_called_once()
+        result = self.runner.invoke(outbox_relay)
+        self.assertNotEqual(result.exit_code, 0)
+        self.assertIn("Set OUTBOX_SINK or pass --sink", result.output)
+
+    def test_products_seed_bad_count(self):
+        """It should not seed a count below one"""
+        with patch.dict(os.environ, {"FLASK_APP": "wsgi:app"}, clear=True):
+            result = self.runner.invoke(products_seed, ["--count", "0"])
+        self.assertNotEqual(result.exit_code, 0)
+
+    def test_products_snapshot(self):
+        """It should write a snapshot of the products with products-snapshot"""
+        directory = tempfile.mkdtemp()
+        path = os.path.join(directory, "products")
+        with app.app_context():
+            db.session.query(Product).delete()
+            db.session.commit()
+            ProductFactory().create()
+            result = self.runner.invoke(
+                products_snapshot, ["--path", path, "--chunk-size", "10", "--archive"]
+            )
+            self.assertEqual(result.exit_code, 0, result.output)
+            self.assertIn(f"Wrote 1 products to {path}", result.output)
+            self.assertIn(f"Archived the snapshot to {path}.zip", result.output)
+            with Snapshot(path) as snapshot:
+                self.assertEqual(len(snapshot), 1)
+            db.session.query(Product).delete()
+            db.session.commit()
+        shutil.rmtree(directory)
@@ -0,0 +1,165 @@
+######################################################################
+# Copyright 2016, 2024 John J. Rofrano. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+######################################################################
+
+"""
+Test cases for Read Replica Routing
+
+Two SQLite files stand in for the primary and the replica. Nothing is
+replicated between them, so which file answers shows where a read went.
+"""
+
+import shutil
+import tempfile
+from unittest import TestCase
+from unittest.mock import patch
+from flask import Flask, g
+from sqlalchemy import update
+from service.common import db_routing, status
+from service.common.db_routing import TOKEN_HEADER, read_your_writes
+from service.models import db, Product
+
+
+def create_test_app(directory: str) -> Flask:
+    """Creates a small app that reads and writes Products"""
+    app = Flask(__name__)
+    app.config["SQLALCHEMY_DATABASE_URI"] = f"sqlite:///{directory}/primary.db"
+    app.config["SQLALCHEMY_BINDS"] = {"replica_0": f"sqlite:///{directory}/replica.db"}
+    app.config["REPLICA_LAG_WINDOW"] = 2.0
+    db.init_app(app)
+    db_routing.init_app(app)
+
+    @app.get("/products/<int:product_id>")
+    def read_product(product_id):
+        product = Product.find(product_id)
+        if not product:
+            return {}, status.HTTP_404_NOT_FOUND
+        return product.serialize(), status.HTTP_200_OK
+
+    @app.post("/products")
+    def create_product():
+        product = Product(sku="SKU1", name="primary", price=1)
+        product.create()
+        return product.serialize(), status.HTTP_201_CREATED
+
+    @app.post("/products/fail")
+    def fail():
+        return {}, status.HTTP_400_BAD_REQUEST
+
+    with app.app_context():
+        for engine in db.engines.values():
+            db.metadata.create_all(engine)
+    return app
+
+
+######################################################################
+#  R E A D   R E P L I C A   T E S T   C A S E S
+######################################################################
+class TestReadReplicaRouting(TestCase):
+    """Read Replica Routing Tests"""
+
+    @classmethod
+    def setUpClass(cls):
+        cls.directory = tempfile.mkdtemp()
+        cls.app = create_test_app(cls.directory)
+
+    @classmethod
+    def tearDownClass(cls):
+        shutil.rmtree(cls.directory)
+
+    def setUp(self):
+        self.client = self.app.test_client()
+        with self.app.app_context():
+            for engine in db.engines.values():
+                with engine.begin() as connection:
+                    connection.execute(Product.__table__.delete())
+            # a row that only exists on the replica
+            with db.engines["replica_0"].begin() as connection:
+                connection.execute(
+                    Product.__table__.insert(),
+                    {
+                        "id": 100,
+                        "sku": "R",
+                        "name": "replica",
+                        "price_cents": 100,
+                        "likes": 0,
+                    },
+                )
+
+    def test_reads_go_to_replica(self):
+        """It should serve GET requests from the replica"""
+        response = self.client.get("/products/100")
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.get_json()["name"], "replica")
+        self.assertNotIn(TOKEN_HEADER, response.headers)
+
+    def test_writes_go_to_primary(self):
+        """It should send writes to the primary and return a token"""
+        response = self.client.post("/products")
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertIn(TOKEN_HEADER, response.headers)
+        product_id = response.get_json()["id"]
+        # the replica has not caught up, so a plain read misses the write
+        response = self.client.get(f"/products/{product_id}")
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_read_your_writes(self):
+        """It should read from the primary while the token is fresh"""
+        response = self.client.post("/products")
+        token = response.headers[TOKEN_HEADER]
+        product_id = response.get_json()["id"]
+        response = self.client.get(
+            f"/products/{product_id}", headers={TOKEN_HEADER: token}
+        )
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.get_json()["name"], "primary")
+        # once the lag window has passed the replica is trusted again
+        later = float(token) + 5
+        with patch("service.common.db_routing.time.time", return_value=later):
+            response = self.client.get(
+                f"/products/{product_id}", headers={TOKEN_HEADER: token}
+            )
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_no_token_on_failed_write(self):
+        """It should not return a token when the write failed"""
+        response = self.client.post("/products/fail")
+        self.assertNotIn(TOKEN_HEADER, response.headers)
+
+    def test_dml_goes_to_primary(self):
+        """It should send DML statements to the primary even during reads"""
+        with self.app.test_request_context("/products/100"):
+            self.app.preprocess_request()
+            self.assertTrue(g.use_replica)
+            replica = db.session.get_bind(mapper=Product)
+            primary = db.session.get_bind(mapper=Product, clause=update(Product))
+            self.assertIs(replica, db.engines["replica_0"])
+            self.assertIs(primary, db.engines[None])
+
+    def test_write_requests_read_primary(self):
+        """It should send the reads of write requests to the primary"""
+        with self.app.test_request_context("/products", method="POST"):
+            self.app.preprocess_request()
+            self.assertFalse(g.use_replica)
+            self.assertIs(db.session.get_bind(mapper=Product), db.engines[None])
+
+    def test_read_your_writes_tokens(self):
+        """It should only honour recent, well formed tokens"""
+        with patch("service.common.db_routing.time.time", return_value=100.0):
+            self.assertTrue(read_your_writes("99.5", 2))
+            self.assertFalse(read_your_writes("90", 2))
+            self.assertFalse(read_your_writes("101", 2))
+            self.assertFalse(read_your_writes("bad", 2))
+            self.assertFalse(read_your_writes(None, 2))
@@ -0,0 +1,100 @@
+######################################################################
+# Copyright 2016, 2024 John J. Rofrano. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+######################################################################
+
+"""
+Test cases for the Request Deadlines
+"""
+
+from unittest import TestCase
+from unittest.mock import patch
+from sqlalchemy import event, text
+from wsgi import app
+from service.models import db
+from service.common import deadline, metrics
+from service.common.deadline import DeadlineExceededError
+
+
+######################################################################
+#  D E A D L I N E   T E S T   C A S E S
+######################################################################
+class TestDeadline(TestCase):
+    """Request Deadline Tests"""
+
+    def setUp(self):
+        self.context = app.app_context()
+        self.context.push()
+        self.statements = []
+        event.listen(db.engine, "before_cursor_execute", self._record)
+        metrics.reset()
+
+    def tearDown(self):
+        event.remove(db.engine, "before_cursor_execute", self._record)
+        deadline.stop()
+        db.session.remove()
+        self.context.pop()
+
+    def _record(self, _conn, _cursor, statement, *_args):
+        """Records the statements sent to the database"""
+        self.statements.append(statement)
+
+    def test_budget(self):
+        """It should track the time left to the request"""
+        self.assertIsNone(deadline.remaining())
+        deadline.check("querying")
+        deadline.start(0)
+        self.assertIsNone(deadline.remaining())
+        deadline.start(10)
+        self.assertAlmostEqual(deadline.remaining(), 10, delta=1)
+        deadline.check("querying")
+        with patch("service.common.deadline.time.monotonic", return_value=1e12):
+            self.assertRaises(DeadlineExceededError, deadline.check, "serializing")
+        self.assertEqual(metrics.value("deadline_exceeded"), 1)
+        deadline.stop()
+        self.assertIsNone(deadline.remaining())
+
+    def test_statement_timeout(self):
+        """It should limit each transaction to the time left"""
+        deadline.start(10)
+        timeout = db.session.execute(text("SHOW statement_timeout")).scalar()
+        # the connection default is shorter than the time left
+        self.assertEqual(timeout, "1s")
+        self.assertEqual(self.statements, ["SHOW statement_timeout"])
+        db.session.rollback()
+        deadline.start(0.5)
+        db.session.execute(text("SELECT 1"))
+        self.assertRegex(self.statements[1], r"SET LOCAL statement_timeout = \d+")
+        db.session.rollback()
+        deadline.start(0.05)
+        with self.assertRaises(DeadlineExceededError):
+            db.session.execute(text("SELECT pg_sleep(2)"))
+        self.assertEqual(metrics.value("deadline_exceeded"), 1)
+
+    def test_no_deadline(self):
+        """It should not limit the statements outside of requests"""
+        timeout = db.session.execute(text("SHOW statement_timeout")).scalar()
+        self.assertEqual(timeout, "0")
+        self.assertEqual(
+            self.statements,
+            ["SET LOCAL statement_timeout = 0", "SHOW statement_timeout"],
+        )
+
+    def test_out_of_time(self):
+        """It should not begin a transaction once the budget is spent"""
+        deadline.start(10)
+        with patch("service.common.deadline.time.monotonic", return_value=1e12):
+            with self.assertRaises(DeadlineExceededError):
+                db.session.execute(text("SELECT 1"))
+        self.assertEqual(self.statements, [])
@@ -0,0 +1,71 @@
+######################################################################
+# Copyright 2016, 2024 John J. Rofrano. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+######################################################################
+
+
+"""
+Test cases for the Event Hub
+"""
+
+from unittest import TestCase
+from service.common.event_hub import DROPPED, EventHub, HubFullError
+
+
+######################################################################
+#  E V E N T   H U B   T E S T   C A S E S
+######################################################################
+class TestEventHub(TestCase):
+    """Event Hub Tests"""
+
+    def test_publish(self):
+        """It should deliver each event to every subscriber in order"""
+        hub = EventHub()
+        first, second = hub.subscribe(), hub.subscribe()
+        self.assertEqual(hub.publish("a"), 0)
+        hub.publish("b")
+        for subscription in (first, second):
+            self.assertEqual(subscription.get(timeout=0), "a")
+            self.assertEqual(subscription.get(timeout=0), "b")
+            self.assertIsNone(subscription.get(timeout=0))
+
+    def test_unsubscribe(self):
+        """It should stop delivering events after unsubscribing"""
+        hub = EventHub()
+        subscription = hub.subscribe()
+        hub.unsubscribe(subscription)
+        hub.publish("a")
+        self.assertEqual(len(hub), 0)
+        self.assertIsNone(subscription.get(timeout=0))
+
+    def test_drop_slow_subscriber(self):
+        """It should drop a subscriber whose queue is full"""
+        hub = EventHub(queue_size=2)
+        slow, fast = hub.subscribe(), hub.subscribe()
+        hub.publish("a")
+        self.assertEqual(fast.get(timeout=0), "a")
+        hub.publish("b")
+        self.assertEqual(hub.publish("c"), 1)
+        self.assertEqual(slow.get(timeout=0), DROPPED)
+        self.assertEqual(len(hub), 1)
+        self.assertEqual(fast.get(timeout=0), "b")
+        self.assertEqual(fast.get(timeout=0), "c")
+
+    def test_max_subscribers(self):
+        """It should not serve more than max_subscribers"""
+        hub = EventHub(max_subscribers=1)
+        subscription = hub.subscribe()
+        self.assertRaises(HubFullError, hub.subscribe)
+        hub.unsubscribe(subscription)
+        hub.subscribe()
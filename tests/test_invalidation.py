@@ -0,0 +1,178 @@
+######################################################################
+# Copyright 2016, 2024 John J. Rofrano. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+######################################################################
+
+"""
+Test cases for the Cache Invalidation
+"""
+
+# pylint: disable=duplicate-code
+import time
+import logging
+from unittest import TestCase
+from unittest.mock import patch
+import psycopg
+from wsgi import app
+from service.models import db, Product
+from service.routes import list_cache, stats_cache
+from service.common import invalidation, metrics
+from service.common.invalidation import (
+    ALL,
+    MemoryBus,
+    PostgresBus,
+    decode,
+    encode,
+    invalidate,
+    products_invalidated,
+)
+from tests.factories import ProductFactory
+
+
+######################################################################
+#  C A C H E   I N V A L I D A T I O N   T E S T   C A S E S
+######################################################################
+class TestInvalidation(TestCase):
+    """Cache Invalidation Tests"""
+
+    @classmethod
+    def setUpClass(cls):
+        """This runs once before the entire test suite"""
+        app.config["TESTING"] = True
+        app.config["DEBUG"] = False
+        app.logger.setLevel(logging.CRITICAL)
+        app.app_context().push()
+
+    @classmethod
+    def tearDownClass(cls):
+        """This runs once after the entire test suite"""
+        db.session.close()
+
+    def setUp(self):
+        """This runs before each test"""
+        db.session.query(Product).delete()
+        db.session.commit()
+        metrics.reset()
+        self.peers = []
+        self.bus = MemoryBus(self.peers)
+        self.received = []
+        products_invalidated.connect(self._receive)
+
+    def tearDown(self):
+        """This runs after each test"""
+        products_invalidated.disconnect(self._receive)
+        db.session.remove()
+
+    def _receive(self, bus, ids):
+        """Records the invalidations received by the other buses"""
+        if bus is not self.bus:
+            self.received.append(ids)
+
+    def test_payload(self):
+        """It should encode the ids, or ALL when they do not fit"""
+        self.assertEqual(decode(encode("a", {3, 1})), ("a", {1, 3}))
+        self.assertEqual(decode(encode("a", {1, ALL})), ("a", {ALL}))
+        self.assertEqual(decode(encode("a", set(range(10000)))), ("a", {ALL}))
+
+    def test_memory_bus(self):
+        """It should deliver committed changes to the other buses only"""
+        other = MemoryBus(self.peers)
+        with patch.dict(app.extensions, {"invalidation_bus": self.bus}):
+            product = ProductFactory()
+            product.create()
+            product.description = "changed"
+            product.update()
+            Product.update_by_id(
+                product.id, {"likes": Product.likes + 1}, action="like"
+            )
+            product = Product.find(product.id)
+            product.delete()
+            Product.reprice(Product.query, {"operation": "add", "value": 1})
+            Product.remove_all()
+        self.assertEqual(self.received, [{product.id}] * 4 + [{ALL}])
+        self.assertEqual(metrics.value("invalidations_sent"), 5)
+        self.assertEqual(metrics.value("invalidations_received"), 5)
+        other.close()
+        self.assertEqual(self.peers, [self.bus])
+
+    def test_rollback(self):
+        """It should not deliver the changes of a rolled back transaction"""
+        MemoryBus(self.peers)
+        with patch.dict(app.extensions, {"invalidation_bus": self.bus}):
+            product = ProductFactory()
+            db.session.add(product)
+            db.session.flush()
+            invalidate(db.session, [product.id])
+            db.session.rollback()
+            db.session.commit()
+            Product.delete_by_ids([1, 2])
+        self.assertEqual(self.received, [])
+
+    def test_postgres_bus(self):
+        """It should NOTIFY the other workers of committed changes"""
+        url = app.config["SQLALCHEMY_DATABASE_URI"]
+        sender = PostgresBus(app, url)
+        listener = PostgresBus(app, url, poll_interval=0.01)
+        listener.start()
+        self.assertTrue(listener.listening.wait(5))
+        with patch.dict(app.extensions, {"invalidation_bus": sender}):
+            product = ProductFactory()
+            product.create()
+            ProductFactory().create()
+            Product.delete_by_ids([product.id])
+        deadline = time.monotonic() + 5
+        while len(self.received) < 4 and time.monotonic() < deadline:
+            time.sleep(0.01)
+        listener.close()
+        sender.close()
+        # everything on connect, then one notification per transaction
+        self.assertEqual(self.received[0], {ALL})
+        self.assertEqual(self.received[1], {product.id})
+        self.assertEqual(self.received[3], {product.id})
+        self.assertFalse(listener.listening.is_set())
+
+    def test_postgres_bus_reconnect(self):
+        """It should keep listening after the connection fails"""
+        bus = PostgresBus(
+            app, app.config["SQLALCHEMY_DATABASE_URI"], reconnect_delay=0.01
+        )
+        with patch.object(
+            bus, "listen", side_effect=[psycopg.OperationalError("gone"), None, None]
+        ) as listen_mock:
+            bus.start()
+            while listen_mock.call_count < 3:
+                time.sleep(0.01)
+            bus.close()
+        self.assertGreaterEqual(listen_mock.call_count, 3)
+
+    def test_routes_receiver(self):
+        """It should drop the caches of the worker"""
+        stats_cache.set("stats", {})
+        generation = list_cache.generation
+        products_invalidated.send(self.bus, ids={1})
+        self.assertEqual(list_cache.generation, generation + 1)
+        self.assertEqual(len(stats_cache), 0)
+
+    def test_init_app(self):
+        """It should only set up a known bus"""
+        with patch.dict(app.extensions), patch.object(PostgresBus, "start") as start:
+            with patch.dict(app.config, {"INVALIDATION_BUS": "memory"}):
+                self.assertIsInstance(invalidation.init_app(app), MemoryBus)
+            with patch.dict(app.config, {"INVALIDATION_BUS": "postgres"}):
+                bus = invalidation.init_app(app)
+            self.assertIsInstance(bus, PostgresBus)
+            self.assertIs(app.extensions["invalidation_bus"], bus)
+            start.assert_called_once()
+            with patch.dict(app.config, {"INVALIDATION_BUS": "redis"}):
+                self.assertRaises(ValueError, invalidation.init_app, app)
@@ -0,0 +1,154 @@
+######################################################################
+# Copyright 2016, 2024 John J. Rofrano. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+######################################################################
+
+"""
+Test cases for the Leaderboard
+"""
+
+from unittest import TestCase
+from unittest.mock import patch
+from service.common.leaderboard import Leaderboard
+
+
+class FakeCatalog:
+    """A stand-in for the database that records how often it is queried"""
+
+    def __init__(self, likes: dict):
+        self.likes = likes
+        self.loads = 0
+
+    def load(self, limit: int) -> list:
+        """Returns the most liked products like Product.find_most_liked()"""
+        self.loads += 1
+        ranked = sorted(self.likes.items(), key=lambda item: (-item[1], item[0]))
+        return [self.product(product_id) for product_id, _ in ranked[:limit]]
+
+    def product(self, product_id: int) -> dict:
+        """Returns a serialized product"""
+        return {"id": product_id, "likes": self.likes[product_id]}
+
+    def like(self, product_id: int, board: Leaderboard):
+        """Likes a product and records it on the board"""
+        self.likes[product_id] += 1
+        board.record(self.product(product_id))
+
+
+######################################################################
+#  L E A D E R B O A R D   T E S T   C A S E S
+######################################################################
+class TestLeaderboard(TestCase):
+    """Leaderboard Tests"""
+
+    def test_top(self):
+        """It should return the most liked products in order"""
+        catalog = FakeCatalog({1: 5, 2: 9, 3: 1, 4: 9})
+        board = Leaderboard(catalog.load, capacity=3)
+        self.assertEqual([p["id"] for p in board.top(10)], [2, 4, 1])
+        self.assertEqual([p["id"] for p in board.top(1)], [2])
+        self.assertEqual(catalog.loads, 1)
+
+    def test_record_like(self):
+        """It should re-rank a product when it is liked"""
+        catalog = FakeCatalog({1: 5, 2: 6, 3: 1, 4: 0})
+        board = Leaderboard(catalog.load, capacity=3)
+        board.top(3)
+        catalog.like(1, board)
+        catalog.like(1, board)
+        self.assertEqual(board.top(1), [{"id": 1, "likes": 7}])
+        # an outsider climbs onto the board and pushes the last one off
+        for _ in range(3):
+            catalog.like(4, board)
+        self.assertEqual([p["id"] for p in board.top(3)], [1, 2, 4])
+        self.assertEqual(catalog.loads, 1)
+
+    def test_record_outsider_below_cut(self):
+        """It should ignore a product that does not make the board"""
+        catalog = FakeCatalog({1: 5, 2: 6, 3: 1})
+        board = Leaderboard(catalog.load, capacity=2)
+        board.top(2)
+        catalog.like(3, board)
+        self.assertEqual([p["id"] for p in board.top(2)], [2, 1])
+        self.assertEqual(catalog.loads, 1)
+
+    def test_record_member_drops(self):
+        """It should reload when a member drops below the cut"""
+        catalog = FakeCatalog({1: 5, 2: 6, 3: 4})
+        board = Leaderboard(catalog.load, capacity=2)
+        board.top(2)
+        catalog.likes[1] = 0
+        board.record(catalog.product(1))
+        self.assertEqual([p["id"] for p in board.top(2)], [2, 3])
+        self.assertEqual(catalog.loads, 2)
+
+    def test_record_new_product(self):
+        """It should add new products while every product fits"""
+        catalog = FakeCatalog({1: 5})
+        board = Leaderboard(catalog.load, capacity=2)
+        board.top(2)
+        catalog.likes.update({2: 0, 3: 7})
+        board.record(catalog.product(2))
+        board.record(catalog.product(3))
+        self.assertEqual([p["id"] for p in board.top(2)], [3, 1])
+        self.assertEqual(catalog.loads, 1)
+
+    def test_record_before_load(self):
+        """It should not track anything before the first read"""
+        catalog = FakeCatalog({1: 5})
+        board = Leaderboard(catalog.load, capacity=2)
+        board.record({"id": 2, "likes": 100})
+        self.assertEqual(board.top(2), [{"id": 1, "likes": 5}])
+
+    def test_discard(self):
+        """It should reload after a member is deleted"""
+        catalog = FakeCatalog({1: 5, 2: 6, 3: 4})
+        board = Leaderboard(catalog.load, capacity=2)
+        board.top(2)
+        del catalog.likes[2]
+        board.discard(2)
+        board.discard(99)
+        self.assertEqual([p["id"] for p in board.top(2)], [1, 3])
+        self.assertEqual(catalog.loads, 2)
+
+    def test_discard_complete(self):
+        """It should not reload after a delete when every product fits"""
+        catalog = FakeCatalog({1: 5, 2: 6})
+        board = Leaderboard(catalog.load, capacity=5)
+        board.top(5)
+        board.discard(2)
+        self.assertEqual([p["id"] for p in board.top(5)], [1])
+        self.assertEqual(catalog.loads, 1)
+
+    def test_max_age(self):
+        """It should reload once the board is older than max_age"""
+        catalog = FakeCatalog({1: 5})
+        board = Leaderboard(catalog.load, capacity=2, max_age=10)
+        with patch("service.common.leaderboard.time.monotonic", return_value=100.0):
+            board.top(1)
+        with patch("service.common.leaderboard.time.monotonic", return_value=105.0):
+            board.top(1)
+        self.assertEqual(catalog.loads, 1)
+        with patch("service.common.leaderboard.time.monotonic", return_value=111.0):
+            board.top(1)
+        self.assertEqual(catalog.loads, 2)
+
+    def test_invalidate(self):
+        """It should reload after being invalidated"""
+        catalog = FakeCatalog({1: 5})
+        board = Leaderboard(catalog.load)
+        board.top(1)
+        board.invalidate()
+        board.top(1)
+        self.assertEqual(catalog.loads, 2)
@@ -0,0 +1,152 @@
+######################################################################
+# Copyright 2016, 2024 John J. Rofrano. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+######################################################################
+
+"""
+Test cases for the Local Catalog
+"""
+
+# pylint: disable=duplicate-code
+import os
+import fcntl
+import time
+import shutil
+import logging
+import tempfile
+from unittest import TestCase
+from unittest.mock import patch
+from wsgi import app
+from service.models import db, Product
+from service.common import local_catalog
+from service.common.local_catalog import LocalCatalog
+from service.common.snapshot import snapshot_lock
+from tests.factories import ProductFactory
+
+
+######################################################################
+#  L O C A L   C A T A L O G   T E S T   C A S E S
+######################################################################
+class TestLocalCatalog(TestCase):
+    """Local Catalog Tests"""
+
+    @classmethod
+    def setUpClass(cls):
+        """This runs once before the entire test suite"""
+        app.config["TESTING"] = True
+        app.config["DEBUG"] = False
+        app.logger.setLevel(logging.CRITICAL)
+        app.app_context().push()
+
+    @classmethod
+    def tearDownClass(cls):
+        """This runs once after the entire test suite"""
+        db.session.close()
+
+    def setUp(self):
+        """This runs before each test"""
+        db.session.query(Product).delete()
+        db.session.commit()
+        self.directory = tempfile.mkdtemp()
+        self.catalog = LocalCatalog(
+            app, os.path.join(self.directory, "products"), refresh_interval=60
+        )
+
+    def tearDown(self):
+        """This runs after each test"""
+        db.session.remove()
+        shutil.rmtree(self.directory)
+
+    def test_no_snapshot(self):
+        """It should have no snapshot before one was written"""
+        self.assertIsNone(self.catalog.current())
+        self.assertIsNone(self.catalog.age())
+
+    def test_refresh(self):
+        """It should write a snapshot only when it is due"""
+        ProductFactory().create()
+        self.assertTrue(self.catalog.refresh())
+        snapshot = self.catalog.current()
+        self.assertEqual(len(snapshot), 1)
+        self.assertLess(self.catalog.age(), 60)
+        self.assertFalse(self.catalog.refresh())
+        self.assertIs(self.catalog.current(), snapshot)
+
+    def test_reopen(self):
+        """It should map a snapshot written by another worker"""
+        ProductFactory().create()
+        self.catalog.refresh()
+        first = self.catalog.current()
+        ProductFactory().create()
+        Product.snapshot(self.catalog.path)
+        second = self.catalog.current()
+        self.assertIsNot(second, first)
+        self.assertEqual(len(second), 2)
+        # the replaced snapshot can still be read
+        self.assertEqual(len(first.array("id")), 1)
+
+    def test_refresh_locked(self):
+        """It should not wait for another worker writing a snapshot"""
+        with open(f"{self.catalog.path}.lock", "a", encoding="utf-8") as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            self.assertFalse(self.catalog.refresh())
+        self.assertIsNone(self.catalog.current())
+
+    def test_refresh_while_archiving(self):
+        """It should not replace a snapshot that is being archived"""
+        ProductFactory().create()
+        self.catalog.refresh()
+        target = os.path.realpath(self.catalog.path)
+        self.catalog.refresh_interval = 0
+        with snapshot_lock(self.catalog.path):
+            self.assertFalse(self.catalog.refresh())
+            self.assertTrue(os.path.isdir(target))
+        self.assertTrue(self.catalog.refresh())
+        self.assertFalse(os.path.exists(target))
+
+    def test_bad_snapshot(self):
+        """It should keep no snapshot when it cannot be opened"""
+        ProductFactory().create()
+        self.catalog.refresh()
+        self.catalog.current().close()
+        catalog = LocalCatalog(app, self.catalog.path)
+        with open(os.path.join(self.catalog.path, "id.npy"), "r+b") as file:
+            file.write(b"garbage")
+        self.assertIsNone(catalog.current())
+
+    def test_run(self):
+        """It should keep refreshing in the background despite failures"""
+        self.catalog.refresh_interval = 0.01
+        with patch.object(
+            self.catalog, "refresh", side_effect=[OSError("disk full"), True, True]
+        ) as refresh_mock:
+            self.catalog.start()
+            while refresh_mock.call_count < 3:
+                time.sleep(0.01)
+            self.catalog.stop()
+        self.assertGreaterEqual(refresh_mock.call_count, 3)
+
+    def test_init_app(self):
+        """It should only refresh in the background when configured"""
+        with patch.object(LocalCatalog, "start") as start_mock, patch.dict(
+            app.extensions
+        ):
+            with patch.dict(app.config, {"SNAPSHOT_REFRESH_INTERVAL": 0}):
+                catalog = local_catalog.init_app(app)
+            start_mock.assert_not_called()
+            self.assertIs(app.extensions["local_catalog"], catalog)
+            with patch.dict(app.config, {"SNAPSHOT_REFRESH_INTERVAL": 60}):
+                catalog = local_catalog.init_app(app)
+            start_mock.assert_called_once()
+            self.assertEqual(catalog.refresh_interval, 60)
@@ -0,0 +1,50 @@
+######################################################################
+# Copyright 2016, 2024 John J. Rofrano. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+######################################################################
+
+
+"""
+Test cases for the Metrics counters
+"""
+
+from unittest import TestCase
+from service.common import metrics
+
+
+######################################################################
+#  M E T R I C S   T E S T   C A S E S
+######################################################################
+class TestMetrics(TestCase):
+    """Metrics Tests"""
+
+    def setUp(self):
+        metrics.reset()
+
+    def test_increment(self):
+        """It should add to a named counter"""
+        self.assertEqual(metrics.value("hits"), 0)
+        metrics.increment("hits")
+        metrics.increment("hits", 4)
+        self.assertEqual(metrics.value("hits"), 5)
+
+    def test_snapshot(self):
+        """It should return a copy of every counter"""
+        metrics.increment("hits")
+        counters = metrics.snapshot()
+        self.assertEqual(counters, {"hits": 1})
+        counters["hits"] = 10
+        self.assertEqual(metrics.value("hits"), 1)
+        metrics.reset()
+        self.assertEqual(metrics.snapshot(), {})
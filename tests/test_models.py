@@ -21,10 +21,24 @@ Test cases for Pet Model
 # pylint: disable=duplicate-code
 import os
 import logging
+from decimal import Decimal
 from unittest import TestCase
 from unittest.mock import patch
+from sqlalchemy.exc import OperationalError
 from wsgi import app
-from service.models import Product, DataValidationError, db
+from service.models import (
+    Product,
+    ProductDeletion,
+    OutboxEvent,
+    ChangeTokenExpiredError,
+    DataValidationError,
+    VersionConflictError,
+    db,
+    product_changed,
+    products_changed,
+    upgrade_db,
+)
+from service.common import metrics
 from .factories import ProductFactory
 
 DATABASE_URI = os.getenv(
@@ -55,6 +69,7 @@ class TestCaseBase(TestCase):
     def setUp(self):
         """This runs before each test"""
         db.session.query(Product).delete()  # clean up the last tests
+        db.session.query(ProductDeletion).delete()
         db.session.commit()
 
     def tearDown(self):
@@ -65,6 +80,7 @@ class TestCaseBase(TestCase):
 ######################################################################
 #  P R O D U C T   M O D E L   T E S T   C A S E S
 ######################################################################
+# pylint: disable=too-many-public-methods
 class TestProductModel(TestCaseBase):
     """Product Model CRUD Tests"""
 
@@ -162,6 +178,329 @@ class TestProductModel(TestCaseBase):
         self.assertEqual(products[0].id, original_id)
         self.assertEqual(products[0].likes, 1)
 
+    def test_product_changed_signal(self):
+        """It should send product_changed after each committed change"""
+        changes = []
+
+        def receiver(product, action):
+            changes.append((product.id, action))
+
+        with product_changed.connected_to(receiver):
+            product = ProductFactory()
+            product.create()
+            product.likes += 1
+            product.update()
+            product.delete()
+        self.assertEqual(
+            changes,
+            [(product.id, "create"), (product.id, "update"), (product.id, "delete")],
+        )
+
+    def test_update_bumps_version(self):
+        """It should bump the version of a Product on every update"""
+        product = ProductFactory()
+        product.create()
+        self.assertEqual(product.version, 1)
+        product.description = "testing"
+        product.update()
+        self.assertEqual(product.version, 2)
+        self.assertEqual(Product.find(product.id).version, 2)
+
+    def test_update_unchanged(self):
+        """It should not write a Product that was not changed"""
+        product = ProductFactory()
+        product.create()
+        metrics.reset()
+        updated_time = product.updated_time
+        # a PUT of the same body assigns the same values again
+        data = product.serialize()
+        data["price"] = float(data["price"])
+        product.deserialize(data)
+        self.assertFalse(product.update())
+        self.assertEqual(product.version, 1)
+        self.assertEqual(product.updated_time, updated_time)
+        self.assertEqual(metrics.value("product_updates_skipped"), 1)
+        product.name = "Changed"
+        self.assertTrue(product.update())
+        self.assertEqual(product.version, 2)
+        self.assertEqual(metrics.value("product_updates"), 1)
+
+    def test_update_stale_version(self):
+        """It should not Update a Product changed by someone else"""
+        product = ProductFactory()
+        product.create()
+        # another request updates the row behind this session's back
+        with db.engine.begin() as connection:
+            connection.execute(
+                db.update(Product.__table__)
+                .where(Product.__table__.c.id == product.id)
+                .values(version=2)
+            )
+        product.description = "testing"
+        self.assertRaises(VersionConflictError, product.update)
+
+    def test_update_by_id(self):
+        """It should Update a Product in a single statement"""
+        product = ProductFactory()
+        product.create()
+        updated, written = Product.update_by_id(product.id, {"name": "Renamed"})
+        self.assertTrue(written)
+        self.assertEqual(updated.name, "Renamed")
+        self.assertEqual(updated.version, 2)
+        updated, written = Product.update_by_id(
+            product.id, {"likes": Product.likes + 1}, {2}
+        )
+        self.assertTrue(written)
+        self.assertEqual(updated.likes, 1)
+        self.assertEqual(updated.version, 3)
+        self.assertEqual(Product.update_by_id(0, {"name": "Missing"}), (None, False))
+        self.assertEqual(
+            Product.update_by_id(0, {"name": "Missing"}, {1}), (None, False)
+        )
+
+    def test_update_by_id_unchanged(self):
+        """It should not write a Product whose values are unchanged"""
+        product = ProductFactory(description=None)
+        product.create()
+        metrics.reset()
+        values = {
+            "name": product.name,
+            "description": None,
+            "price_cents": product.price_cents,
+        }
+        for versions in (None, {1}):
+            found, written = Product.update_by_id(product.id, values, versions)
+            self.assertFalse(written)
+            self.assertEqual(found.id, product.id)
+            self.assertEqual(found.version, 1)
+        self.assertEqual(metrics.value("product_updates_skipped"), 2)
+        self.assertEqual(metrics.value("product_updates"), 0)
+        self.assertRaises(
+            VersionConflictError, Product.update_by_id, product.id, values, {7}
+        )
+
+    def test_update_by_id_version_mismatch(self):
+        """It should not Update a Product at another version"""
+        product = ProductFactory()
+        product.create()
+        self.assertRaises(
+            VersionConflictError,
+            Product.update_by_id,
+            product.id,
+            {"name": "Renamed"},
+            {5, 6},
+        )
+        self.assertEqual(Product.find(product.id).name, product.name)
+
+    def test_delete_by_ids(self):
+        """It should Delete Products in a single statement"""
+        products = ProductFactory.create_batch(3)
+        for product in products:
+            product.create()
+        deleted = []
+
+        def receiver(product, action):
+            deleted.append((product.id, action))
+
+        with product_changed.connected_to(receiver):
+            removed = Product.delete_by_ids([products[0].id, products[2].id, 0])
+        self.assertEqual(
+            sorted(product.id for product in removed),
+            [products[0].id, products[2].id],
+        )
+        self.assertEqual(sorted(deleted), sorted((p.id, "delete") for p in removed))
+        self.assertEqual([product.id for product in Product.all()], [products[1].id])
+        self.assertEqual(Product.delete_by_ids([products[0].id]), [])
+
+    def test_reprice(self):
+        """It should Reprice matching Products in a single statement"""
+        cheap = ProductFactory(price=Decimal("10.00"))
+        mid = ProductFactory(price=Decimal("40.05"))
+        dear = ProductFactory(price=Decimal("100.00"))
+        for product in (cheap, mid, dear):
+            product.create()
+        updated_time = mid.updated_time
+        under_50 = Product.find_by_filters(max_price=50)
+        data = {"operation": "multiply", "value": "0.9"}
+        self.assertEqual(Product.reprice(under_50, data, dry_run=True), 2)
+        self.assertEqual(Product.find(cheap.id).price, Decimal("10.00"))
+        self.assertEqual(Product.reprice(under_50, data), 2)
+        db.session.expire_all()
+        self.assertEqual(Product.find(cheap.id).price, Decimal("9.00"))
+        self.assertEqual(Product.find(mid.id).price, Decimal("36.05"))
+        self.assertEqual(Product.find(mid.id).version, 2)
+        self.assertEqual(Product.find(dear.id).version, 1)
+        self.assertGreater(Product.find(mid.id).updated_time, updated_time)
+        everything = Product.find_by_filters()
+        self.assertEqual(
+            Product.reprice(everything, {"operation": "add", "value": 1}), 3
+        )
+        db.session.expire_all()
+        self.assertEqual(Product.find(dear.id).price, Decimal("101.00"))
+        # only the Products whose price changes are written
+        data = {"operation": "set", "value": 101.0}
+        self.assertEqual(Product.reprice(everything, data), 2)
+        db.session.expire_all()
+        self.assertEqual(Product.find(dear.id).version, 2)
+        self.assertEqual(Product.find(cheap.id).version, 4)
+
+    def test_reprice_signal(self):
+        """It should send products_changed after a Reprice"""
+        ProductFactory(price=Decimal("10.00")).create()
+        changes = []
+
+        def receiver(sender, **kwargs):
+            changes.append((sender, kwargs))
+
+        with products_changed.connected_to(receiver):
+            Product.reprice(
+                Product.find_by_filters(), {"operation": "add", "value": "1"}
+            )
+        self.assertEqual(changes, [(Product, {"action": "reprice", "count": 1})])
+
+    def test_reprice_bad_data(self):
+        """It should not Reprice with bad data"""
+        query = Product.find_by_filters()
+        for data in (
+            "not a dictionary",
+            {"operation": "multiply"},
+            {"operation": "divide", "value": "2"},
+            {"operation": "multiply", "value": "half"},
+            {"operation": "set", "value": "NaN"},
+        ):
+            self.assertRaises(DataValidationError, Product.reprice, query, data)
+
+    def test_changes(self):
+        """It should page through the Products changed since a token"""
+        products = ProductFactory.create_batch(3)
+        for product in products:
+            product.create()
+        page = Product.changes(limit=2, settle=0)
+        self.assertEqual(
+            [product["id"] for product in page["changed"]],
+            [product.id for product in products[:2]],
+        )
+        self.assertTrue(page["more"])
+        page = Product.changes(page["next"], limit=2, settle=0)
+        self.assertEqual(
+            [product["id"] for product in page["changed"]], [products[2].id]
+        )
+        self.assertFalse(page["more"])
+        token = page["next"]
+        self.assertEqual(Product.changes(token, settle=0)["changed"], [])
+
+        Product.update_by_id(products[0].id, {"name": "Renamed"})
+        Product.delete_by_ids([products[1].id])
+        products[2].delete()
+        page = Product.changes(token, settle=0)
+        self.assertEqual([product["name"] for product in page["changed"]], ["Renamed"])
+        self.assertEqual(page["deleted"], [products[1].id, products[2].id])
+        page = Product.changes(page["next"], settle=0)
+        self.assertEqual((page["changed"], page["deleted"]), ([], []))
+
+    def test_changes_settle(self):
+        """It should hold back changes that have not settled yet"""
+        ProductFactory().create()
+        self.assertEqual(Product.changes(settle=3600)["changed"], [])
+
+    def test_changes_bad_token(self):
+        """It should not read changes with a bad or expired token"""
+        for token in ("not a token", "WzFd", "WyJ4IiwgbnVsbCwgMCwgbnVsbCwgMF0="):
+            self.assertRaises(DataValidationError, Product.changes, token)
+        token = Product.changes(settle=0)["next"]
+        self.assertRaises(ChangeTokenExpiredError, Product.changes, token, retention=-1)
+
+    def test_changes_long_transaction(self):
+        """It should not skip the changes of a transaction that commits late"""
+        updated, deleted = ProductFactory.create_batch(2)
+        updated.create()
+        deleted.create()
+        ids = (updated.id, deleted.id)
+        token = Product.changes(settle=0)["next"]
+        db.session.commit()
+        table = Product.__table__
+        # a long transaction stamps its changes with its start time
+        with db.engine.connect() as connection:
+            transaction = connection.begin()
+            connection.execute(
+                db.update(table)
+                .where(table.c.id == ids[0])
+                .values(name="Repriced", updated_time=db.func.now())
+            )
+            connection.execute(
+                db.insert(ProductDeletion.__table__).values(product_id=ids[1])
+            )
+            # while later transactions commit and are read
+            later, gone = ProductFactory.create_batch(2)
+            later.create()
+            gone.create()
+            Product.delete_by_ids([gone.id])
+            page = Product.changes(token, settle=0)
+            self.assertEqual((page["changed"], page["deleted"]), ([], []))
+            db.session.commit()
+            transaction.commit()
+        page = Product.changes(page["next"], settle=0)
+        self.assertEqual(
+            [product["id"] for product in page["changed"]], [ids[0], later.id]
+        )
+        self.assertEqual(page["deleted"], [ids[1], gone.id])
+
+    def test_prune_deletions(self):
+        """It should prune tombstones older than the retention"""
+        product = ProductFactory()
+        product.create()
+        Product.delete_by_ids([product.id])
+        self.assertEqual(ProductDeletion.prune(3600), 0)
+        self.assertEqual(ProductDeletion.prune(0), 1)
+        self.assertEqual(ProductDeletion.query.count(), 0)
+
+    def test_outbox_events(self):
+        """It should write an outbox event in the transaction of each change"""
+        db.session.query(OutboxEvent).delete()
+        products = ProductFactory.create_batch(2, price=Decimal("10.00"))
+        with patch.dict(app.config, {"OUTBOX_ENABLED": True}):
+            for product in products:
+                product.create()
+            Product.update_by_id(
+                products[0].id, {"likes": Product.likes + 1}, action="like"
+            )
+            Product.reprice(
+                Product.find_by_filters(), {"operation": "multiply", "value": "1.5"}
+            )
+            Product.delete_by_ids([products[1].id])
+        events = OutboxEvent.query.order_by(OutboxEvent.id).all()
+        # the repriced rows come in no particular order
+        events[3:5] = sorted(events[3:5], key=lambda event: event.product_id)
+        self.assertEqual(
+            [(event.action, event.product_id) for event in events],
+            [
+                ("create", products[0].id),
+                ("create", products[1].id),
+                ("like", products[0].id),
+                ("reprice", products[0].id),
+                ("reprice", products[1].id),
+                ("delete", products[1].id),
+            ],
+        )
+        self.assertEqual(events[2].payload["likes"], 1)
+        self.assertEqual(events[3].payload["price"], "15.00")
+        self.assertEqual(events[3].payload["version"], 3)
+        self.assertEqual(events[5].serialize()["payload"]["price"], "15.00")
+
+    def test_outbox_disabled(self):
+        """It should not write outbox events that no relay would remove"""
+        db.session.query(OutboxEvent).delete()
+        db.session.commit()
+        with patch.dict(app.config, {"OUTBOX_ENABLED": False}):
+            product = ProductFactory()
+            product.create()
+            product.name = "Renamed"
+            product.update()
+            Product.update_by_id(product.id, {"likes": Product.likes + 1})
+            Product.reprice(Product.query, {"operation": "add", "value": 1})
+            Product.delete_by_ids([product.id])
+        self.assertEqual(OutboxEvent.query.count(), 0)
+
     def test_update_no_id(self):
         """It should not Update a Product with no id"""
         product = ProductFactory()
@@ -233,6 +572,31 @@ class TestProductModel(TestCaseBase):
         product = Product()
         self.assertRaises(DataValidationError, product.deserialize, data)
 
+    def test_deserialize_price(self):
+        """It should de-serialize prices to the stored two decimal places"""
+        data = ProductFactory().serialize()
+        for price, expected in ((49.99, "49.99"), ("12.345", "12.35"), (3, "3.00")):
+            data["price"] = price
+            self.assertEqual(str(Product().deserialize(data).price), expected)
+        for price in ("NaN", "Infinity"):
+            data["price"] = price
+            self.assertRaises(DataValidationError, Product().deserialize, data)
+
+    def test_deserialize_changes(self):
+        """It should de-serialize only the fields of a partial update"""
+        values = Product.deserialize_changes(
+            {"price": "12.50", "description": None, "likes": 5}
+        )
+        self.assertEqual(values, {"price_cents": 1250, "description": None})
+
+    def test_deserialize_changes_bad_data(self):
+        """It should not de-serialize a bad partial update"""
+        for data in ("not a dictionary", {}, {"likes": 5}, {"sku": None}):
+            self.assertRaises(DataValidationError, Product.deserialize_changes, data)
+        self.assertRaises(
+            DataValidationError, Product.deserialize_changes, {"price": "bad"}
+        )
+
     def test_deserialize_bad_price(self):
         """It should not deserialize a bad price attribute"""
         test_product = ProductFactory()
@@ -262,6 +626,27 @@ class TestExceptionHandlers(TestCaseBase):
         product = ProductFactory()
         self.assertRaises(DataValidationError, product.update)
 
+    @patch("service.models.db.session.commit")
+    def test_update_by_id_exception(self, exception_mock):
+        """It should catch an update by id exception"""
+        exception_mock.side_effect = Exception()
+        self.assertRaises(DataValidationError, Product.update_by_id, 1, {"name": "x"})
+
+    @patch("service.models.db.session.commit")
+    def test_delete_by_ids_exception(self, exception_mock):
+        """It should catch a delete by ids exception"""
+        exception_mock.side_effect = Exception()
+        self.assertRaises(DataValidationError, Product.delete_by_ids, [1])
+
+    @patch("service.models.db.session.commit")
+    def test_reprice_exception(self, exception_mock):
+        """It should catch a reprice exception"""
+        exception_mock.side_effect = Exception()
+        data = {"operation": "set", "value": "1.00"}
+        self.assertRaises(
+            DataValidationError, Product.reprice, Product.find_by_filters(), data
+        )
+
     @patch("service.models.db.session.commit")
     def test_delete_exception(self, exception_mock):
         """It should catch a delete exception"""
@@ -269,6 +654,24 @@ class TestExceptionHandlers(TestCaseBase):
         product = ProductFactory()
         self.assertRaises(DataValidationError, product.delete)
 
+    def test_database_unavailable(self):
+        """It should not mistake an unavailable database for bad data"""
+        product = ProductFactory()
+        product.create()
+        product.name = "changed"
+        down = OperationalError("COMMIT", {}, ConnectionResetError())
+        data = {"operation": "set", "value": "1.00"}
+        with patch("service.models.db.session.commit", side_effect=down):
+            self.assertRaises(OperationalError, product.update)
+            self.assertRaises(
+                OperationalError, Product.update_by_id, product.id, {"name": "x"}
+            )
+            self.assertRaises(OperationalError, Product.delete_by_ids, [product.id])
+            self.assertRaises(
+                OperationalError, Product.reprice, Product.find_by_filters(), data
+            )
+            self.assertRaises(OperationalError, Product.find(product.id).delete)
+
 
 ######################################################################
 #  Q U E R Y   T E S T   C A S E S
@@ -304,6 +707,78 @@ class TestModelQueries(TestCaseBase):
         self.assertEqual(found.count(), 1)
         self.assertEqual(found.first().sku, sku)
 
+    def test_upgrade_db(self):
+        """It should upgrade the tables of an earlier release in place"""
+        product = ProductFactory(price=Decimal("12.34"))
+        product.create()
+        db.session.remove()
+        self.addCleanup(upgrade_db)
+        # the tables as an earlier release created them
+        with db.engine.begin() as connection:
+            for statement in (
+                "ALTER TABLE product DROP CONSTRAINT ck_product_price_cents",
+                "ALTER TABLE product ADD COLUMN price NUMERIC(10, 2)",
+                "UPDATE product SET price = price_cents / 100.0",
+                "ALTER TABLE product DROP COLUMN price_cents",
+                "ALTER TABLE product DROP COLUMN version",
+                "CREATE INDEX ix_product_price ON product (price)",
+                "DROP INDEX ix_product_created_time, ix_product_likes",
+                "DROP INDEX ix_product_updated_time_id",
+                "DROP INDEX ix_product_deletion_deleted_time_id",
+            ):
+                connection.execute(db.text(statement))
+        self.assertEqual(
+            upgrade_db(),
+            [
+                "add product.version",
+                "add product.price_cents",
+                "drop product.price",
+                "add ck_product_price_cents",
+                "create ix_product_created_time",
+                "create ix_product_likes",
+                "create ix_product_price_cents",
+                "create ix_product_updated_time_id",
+                "create ix_product_deletion_deleted_time_id",
+            ],
+        )
+        found = Product.find(product.id)
+        self.assertEqual((found.price, found.version), (Decimal("12.34"), 1))
+        # an up to date database is left alone
+        self.assertEqual(upgrade_db(), [])
+
+    def test_price_cents(self):
+        """It should store prices as exact cents and filter on them"""
+        self.assertIsNone(Product().price)
+        product = ProductFactory(price=0.29)
+        self.assertEqual(product.price_cents, 29)
+        product.price = "-1.005"
+        self.assertEqual(product.price, Decimal("-1.01"))
+        self.assertEqual(product.serialize()["price"], "-1.01")
+        product.price = Decimal("0.29")
+        product.create()
+        self.assertEqual(Product.find(product.id).serialize()["price"], "0.29")
+        self.assertEqual(Product.find_by_price_range(0.29, 0.29).count(), 1)
+        self.assertEqual(Product.find_by_price_range("0.285", "0.295").count(), 1)
+        self.assertEqual(Product.find_by_min_price(0.291).count(), 0)
+        self.assertEqual(Product.find_by_max_price(Decimal("0.289")).count(), 0)
+        # bounds beyond every storable price still select the right Products
+        self.assertEqual(Product.find_by_min_price("1e17").count(), 0)
+        self.assertEqual(Product.find_by_max_price("1e17").count(), 1)
+        self.assertEqual(Product.find_by_price_range("-1e17", "1e17").count(), 1)
+        product = ProductFactory(price=Decimal("100000000.00"))
+        self.assertRaises(DataValidationError, product.create)
+
+    def test_find_by_ids_and_skus(self):
+        """It should Find many Products by ids or SKUs in one query"""
+        products = ProductFactory.create_batch(4)
+        for product in products:
+            product.create()
+        ids = [products[3].id, 0, products[1].id]
+        self.assertEqual(Product.find_by_ids(ids), [products[3], products[1]])
+        self.assertEqual(Product.find_by_ids([]), [])
+        skus = [products[2].sku, "missing", products[0].sku]
+        self.assertEqual(Product.find_by_skus(skus), [products[2], products[0]])
+
     def test_find_by_name(self):
         """It should Find Products by Name"""
         products = ProductFactory.create_batch(10)
@@ -355,3 +830,119 @@ class TestModelQueries(TestCaseBase):
         self.assertEqual(found.count(), count)
         for product in found:
             self.assertLessEqual(product.price, max_price)
+
+    def test_find_by_filters(self):
+        """It should Find Products using the collection filters"""
+        products = ProductFactory.create_batch(10)
+        for product in products:
+            product.create()
+        self.assertEqual(Product.find_by_filters().count(), 10)
+        found = Product.find_by_filters(sku=products[0].sku, name="ignored")
+        self.assertEqual(found.count(), 1)
+        name = products[0].name
+        count = len([product for product in products if product.name == name])
+        self.assertEqual(Product.find_by_filters(name=name).count(), count)
+        count = len([product for product in products if 50 <= product.price <= 150])
+        found = Product.find_by_filters(min_price=50.0, max_price=150.0)
+        self.assertEqual(found.count(), count)
+        count = len([product for product in products if product.price >= 75])
+        self.assertEqual(Product.find_by_filters(min_price=75.0).count(), count)
+        count = len([product for product in products if product.price <= 125])
+        self.assertEqual(Product.find_by_filters(max_price=125.0).count(), count)
+
+    def test_statistics(self):
+        """It should compute statistics for a query of Products"""
+        for price, likes in (("10.00", 1), ("20.00", 2), ("30.00", 3), ("40.00", 4)):
+            ProductFactory(price=Decimal(price), likes=likes).create()
+        stats = Product.statistics(Product.query)
+        self.assertEqual(stats["count"], 4)
+        self.assertEqual(stats["min_price"], "10.00")
+        self.assertEqual(stats["max_price"], "40.00")
+        self.assertEqual(stats["avg_price"], "25.00")
+        self.assertEqual(stats["percentiles"]["p50"], "25.00")
+        self.assertEqual(stats["percentiles"]["p90"], "37.00")
+        self.assertEqual(stats["total_likes"], 10)
+        stats = Product.statistics(Product.find_by_max_price(15.0))
+        self.assertEqual(stats["count"], 1)
+        self.assertEqual(stats["total_likes"], 1)
+
+    def test_facets_fixed(self):
+        """It should compute equal width price buckets and name counts"""
+        for price, name in (
+            ("10.00", "A"),
+            ("20.00", "A"),
+            ("30.00", "B"),
+            ("50.00", "A"),
+        ):
+            ProductFactory(price=Decimal(price), name=name).create()
+        facets = Product.facets(Product.query, buckets=4)
+        self.assertEqual(facets["mode"], "fixed")
+        self.assertEqual(facets["count"], 4)
+        self.assertEqual(
+            facets["buckets"],
+            [
+                {"lower": "10.00", "upper": "20.00", "count": 1},
+                {"lower": "20.00", "upper": "30.00", "count": 1},
+                {"lower": "30.00", "upper": "40.00", "count": 1},
+                {"lower": "40.00", "upper": "50.00", "count": 1},
+            ],
+        )
+        self.assertEqual(
+            facets["names"], [{"name": "A", "count": 3}, {"name": "B", "count": 1}]
+        )
+
+    def test_facets_quantile(self):
+        """It should compute equal count price buckets"""
+        for price in ("1.00", "2.00", "3.00", "100.00"):
+            ProductFactory(price=Decimal(price)).create()
+        facets = Product.facets(Product.query, buckets=2, mode="quantile")
+        self.assertEqual(
+            facets["buckets"],
+            [
+                {"lower": "1.00", "upper": "2.00", "count": 2},
+                {"lower": "3.00", "upper": "100.00", "count": 2},
+            ],
+        )
+
+    def test_facets_single_price(self):
+        """It should put every Product in the first bucket when prices are equal"""
+        for _ in range(3):
+            ProductFactory(price=Decimal("5.00")).create()
+        facets = Product.facets(Product.query, buckets=3)
+        self.assertEqual([bucket["count"] for bucket in facets["buckets"]], [3, 0, 0])
+
+    def test_facets_empty(self):
+        """It should return no buckets when nothing matches"""
+        facets = Product.facets(Product.query, buckets=3)
+        self.assertEqual(facets["count"], 0)
+        self.assertEqual(facets["buckets"], [])
+        self.assertEqual(facets["names"], [])
+
+    def test_facets_bad_mode(self):
+        """It should not compute facets with an unknown mode"""
+        self.assertRaises(DataValidationError, Product.facets, Product.query, 3, "bad")
+
+    def test_sort(self):
+        """It should sort Products by price, likes and created_time"""
+        for price, likes in (("30.00", 1), ("10.00", 3), ("20.00", 2)):
+            ProductFactory(price=Decimal(price), likes=likes).create()
+        prices = [str(p.price) for p in Product.sort(Product.query, "price")]
+        self.assertEqual(prices, ["10.00", "20.00", "30.00"])
+        prices = [str(p.price) for p in Product.sort(Product.query, "-price")]
+        self.assertEqual(prices, ["30.00", "20.00", "10.00"])
+        likes = [p.likes for p in Product.sort(Product.query, "-likes")]
+        self.assertEqual(likes, [3, 2, 1])
+        found = Product.sort(Product.find_by_max_price(20.0), "likes")
+        self.assertEqual([p.likes for p in found], [2, 3])
+        self.assertEqual(Product.sort(Product.query, "created_time").count(), 3)
+
+    def test_sort_bad_key(self):
+        """It should not sort by an unknown key"""
+        self.assertRaises(DataValidationError, Product.sort, Product.query, "sku")
+
+    def test_find_most_liked(self):
+        """It should Find the most liked Products"""
+        for likes in (4, 9, 0, 7):
+            ProductFactory(likes=likes).create()
+        found = Product.find_most_liked(3)
+        self.assertEqual([product.likes for product in found], [9, 7, 4])
@@ -0,0 +1,188 @@
+######################################################################
+# Copyright 2016, 2024 John J. Rofrano. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+######################################################################
+
+
+"""
+Test cases for the Outbox Relay
+"""
+
+# pylint: disable=duplicate-code
+import os
+import json
+import queue
+import logging
+import tempfile
+import threading
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from unittest import TestCase
+from unittest.mock import patch
+from wsgi import app
+from service.models import db, Product, OutboxEvent
+from service.common import outbox
+from service.common.outbox import (
+    FileSink,
+    HttpSink,
+    OutboxRelay,
+    QueueSink,
+    make_sink,
+)
+from tests.factories import ProductFactory
+
+
+class FailingSink:  # pylint: disable=too-few-public-methods
+    """A sink that rejects every batch"""
+
+    def send(self, events: list):
+        """Fails to send"""
+        raise ConnectionError("sink is down")
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    """Records the JSON posted to a local HTTP stub"""
+
+    received = []
+
+    def do_POST(self):  # pylint: disable=invalid-name
+        """Accepts a batch of events"""
+        length = int(self.headers["Content-Length"])
+        StubHandler.received.extend(json.loads(self.rfile.read(length)))
+        self.send_response(204)
+        self.end_headers()
+
+    def log_message(self, *args):  # pylint: disable=arguments-differ
+        """Keeps the test output quiet"""
+
+
+######################################################################
+#  O U T B O X   R E L A Y   T E S T   C A S E S
+######################################################################
+class TestOutboxRelay(TestCase):
+    """Outbox Relay Tests"""
+
+    @classmethod
+    def setUpClass(cls):
+        """This runs once before the entire test suite"""
+        app.config["TESTING"] = True
+        app.config["DEBUG"] = False
+        app.logger.setLevel(logging.CRITICAL)
+        app.app_context().push()
+
+    @classmethod
+    def tearDownClass(cls):
+        """This runs once after the entire test suite"""
+        db.session.close()
+
+    def setUp(self):
+        """This runs before each test"""
+        db.session.query(Product).delete()
+        db.session.query(OutboxEvent).delete()
+        db.session.commit()
+        self.enabled = patch.dict(app.config, {"OUTBOX_ENABLED": True})
+        self.enabled.start()
+
+    def tearDown(self):
+        """This runs after each test"""
+        self.enabled.stop()
+        db.session.remove()
+
+    def _change_products(self) -> Product:
+        """Creates, updates and deletes a Product"""
+        product = ProductFactory()
+        product.create()
+        product.name = "Renamed"
+        product.update()
+        product.delete()
+        return product
+
+    def test_relay_batches(self):
+        """It should relay the events in order and remove them"""
+        product = self._change_products()
+        sink = QueueSink()
+        relay = OutboxRelay(app, sink, batch_size=2)
+        self.assertEqual(relay.relay_batch(), 2)
+        self.assertEqual(relay.drain(), 1)
+        events = [sink.events.get_nowait() for _ in range(3)]
+        self.assertEqual(
+            [(event["action"], event["product_id"]) for event in events],
+            [("create", product.id), ("update", product.id), ("delete", product.id)],
+        )
+        self.assertEqual(events[1]["payload"]["name"], "Renamed")
+        self.assertEqual(OutboxEvent.query.count(), 0)
+        self.assertEqual(relay.drain(), 0)
+
+    def test_relay_failure(self):
+        """It should keep the events when the sink fails"""
+        self._change_products()
+        relay = OutboxRelay(app, FailingSink())
+        self.assertRaises(ConnectionError, relay.relay_batch)
+        self.assertEqual(OutboxEvent.query.count(), 3)
+
+    def test_file_sink(self):
+        """It should append events to a file as JSON lines"""
+        with tempfile.TemporaryDirectory() as folder:
+            path = os.path.join(folder, "events.jsonl")
+            sink = make_sink(f"file:{path}")
+            self.assertIsInstance(sink, FileSink)
+            sink.send([{"id": 1}])
+            sink.send([{"id": 2}, {"id": 3}])
+            with open(path, encoding="utf-8") as file:
+                lines = [json.loads(line) for line in file]
+        self.assertEqual(lines, [{"id": 1}, {"id": 2}, {"id": 3}])
+
+    def test_http_sink(self):
+        """It should post batches of events to an HTTP endpoint"""
+        server = HTTPServer(("127.0.0.1", 0), StubHandler)
+        thread = threading.Thread(target=server.serve_forever, daemon=True)
+        thread.start()
+        try:
+            sink = make_sink(f"http://127.0.0.1:{server.server_port}/events")
+            self.assertIsInstance(sink, HttpSink)
+            sink.send([{"id": 1}, {"id": 2}])
+        finally:
+            server.shutdown()
+            server.server_close()
+        self.assertEqual(StubHandler.received, [{"id": 1}, {"id": 2}])
+
+    def test_make_sink(self):
+        """It should only make the known sinks"""
+        self.assertIsInstance(make_sink("queue"), QueueSink)
+        self.assertRaises(ValueError, make_sink, "ftp://example.com")
+
+    def test_background_relay(self):
+        """It should relay events on a background thread"""
+        sink = QueueSink()
+        relay = OutboxRelay(app, sink, poll_interval=0.01)
+        with patch.object(relay, "relay_batch", side_effect=OSError()):
+            relay.start()
+            self._change_products()
+            relay.stop()
+        self.assertEqual(OutboxEvent.query.count(), 3)
+        db.session.query(OutboxEvent).delete()
+        db.session.commit()
+        ProductFactory().create()
+        relay.start()
+        event = sink.events.get(timeout=5)
+        relay.stop()
+        self.assertEqual(event["action"], "create")
+
+    def test_init_app(self):
+        """It should start a relay only when a sink is configured"""
+        self.assertIsNone(outbox.init_app(app))
+        with patch.dict(app.config, {"OUTBOX_SINK": "queue"}):
+            relay = outbox.init_app(app)
+        relay.stop()
+        self.assertIs(app.extensions.pop("outbox_relay"), relay)
+        self.assertIsInstance(relay.sink.events, queue.Queue)
@@ -0,0 +1,150 @@
+######################################################################
+# Copyright 2016, 2024 John J. Rofrano. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+######################################################################
+
+"""
+Test cases for the Rate Limiting
+"""
+
+import os
+import shutil
+import tempfile
+import multiprocessing
+from unittest import TestCase
+from unittest.mock import patch
+from wsgi import app
+from service.common import rate_limit
+from service.common.rate_limit import (
+    MemoryBackend,
+    RateLimiter,
+    RateLimitExceededError,
+    SharedMemoryBackend,
+    take,
+)
+
+COSTS = {"read": 1, "list": 10, "write": 5, "like": 1}
+
+
+def acquire_many(path: str, count: int) -> int:
+    """Acquires reads from a shared limiter, returns how many were allowed"""
+    limiter = RateLimiter(SharedMemoryBackend(path), COSTS, rate=1e-9, burst=100)
+    allowed = 0
+    for _ in range(count):
+        try:
+            limiter.acquire("key:shared", "read")
+            allowed += 1
+        except RateLimitExceededError:
+            pass
+    return allowed
+
+
+######################################################################
+#  R A T E   L I M I T   T E S T   C A S E S
+######################################################################
+class TestRateLimit(TestCase):
+    """Rate Limiting Tests"""
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, "buckets")
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_take(self):
+        """It should take tokens and refill them over time"""
+        state, wait = take(None, cost=4, rate=2, burst=10, now=100.0)
+        self.assertEqual((state, wait), ((6, 100.0), 0.0))
+        state, wait = take(state, cost=8, rate=2, burst=10, now=100.0)
+        self.assertEqual((state, wait), ((6, 100.0), 1.0))
+        state, wait = take(state, cost=8, rate=2, burst=10, now=101.0)
+        self.assertEqual((state, wait), ((0, 101.0), 0.0))
+        # a bucket never holds more than the burst
+        state, wait = take(state, cost=1, rate=2, burst=10, now=1000.0)
+        self.assertEqual((state, wait), ((9, 1000.0), 0.0))
+
+    def test_limiter(self):
+        """It should limit each client and operation on its own"""
+        limiter = RateLimiter(MemoryBackend(), COSTS, rate=1, burst=20)
+        limiter.acquire("key:a", "list")
+        limiter.acquire("key:a", "list")
+        with self.assertRaises(RateLimitExceededError) as context:
+            limiter.acquire("key:a", "list")
+        self.assertAlmostEqual(context.exception.retry_after, 10, delta=0.1)
+        self.assertIn("list", str(context.exception))
+        limiter.acquire("key:a", "write")
+        limiter.acquire("key:b", "list")
+
+    def test_cost_above_burst(self):
+        """It should not accept a cost that no bucket can hold"""
+        self.assertRaises(ValueError, RateLimiter, MemoryBackend(), COSTS, 1, 5)
+
+    def test_memory_backend_eviction(self):
+        """It should forget the least recently used buckets"""
+        backend = MemoryBackend(max_keys=2)
+        for key in ("a", "b", "a", "c"):
+            backend.update(key, lambda state: ((1, 0), 0.0))
+        self.assertEqual(backend.update("b", lambda state: (state, 0.0)), 0.0)
+        states = []
+        backend.update("a", lambda state: (states.append(state) or (1, 0), 0.0))
+        self.assertEqual(states, [None])
+
+    def test_shared_backend(self):
+        """It should share the buckets with every process mapping the file"""
+        first = SharedMemoryBackend(self.path, slots=64)
+        second = SharedMemoryBackend(self.path, slots=64)
+        first.update("key:a", lambda state: ((3.0, 42.0), 0.0))
+        states = []
+        second.update("key:a", lambda state: (states.append(state) or state, 0.0))
+        second.update("key:b", lambda state: (states.append(state) or (1, 1), 0.0))
+        self.assertEqual(states, [(3.0, 42.0), None])
+        first.close()
+        second.close()
+
+    def test_shared_backend_full_group(self):
+        """It should replace the stalest bucket of a full group"""
+        backend = SharedMemoryBackend(self.path, slots=8)
+        for number in range(9):
+            backend.update(f"key:{number}", lambda state, n=number: ((1, n + 1), 0))
+        states = []
+        backend.update("key:0", lambda state: (states.append(state) or (1, 1), 0))
+        backend.update("key:8", lambda state: (states.append(state) or (1, 1), 0))
+        self.assertEqual(states, [None, (1, 9)])
+        backend.close()
+
+    def test_shared_across_processes(self):
+        """It should not let workers together take more than the burst"""
+        SharedMemoryBackend(self.path).close()
+        context = multiprocessing.get_context("fork")
+        with context.Pool(4) as pool:
+            allowed = pool.starmap(acquire_many, [(self.path, 50)] * 4)
+        self.assertEqual(sum(allowed), 100)
+
+    def test_init_app(self):
+        """It should only set up a limiter for a known backend"""
+        with patch.dict(app.extensions):
+            with patch.dict(app.config, {"RATE_LIMIT_BACKEND": ""}):
+                self.assertIsNone(rate_limit.init_app(app))
+            with patch.dict(app.config, {"RATE_LIMIT_BACKEND": "memory"}):
+                limiter = rate_limit.init_app(app)
+            self.assertIsInstance(limiter.backend, MemoryBackend)
+            self.assertIs(app.extensions["rate_limiter"], limiter)
+            config = {"RATE_LIMIT_BACKEND": "shared", "RATE_LIMIT_PATH": self.path}
+            with patch.dict(app.config, config):
+                limiter = rate_limit.init_app(app)
+            self.assertIsInstance(limiter.backend, SharedMemoryBackend)
+            limiter.backend.close()
+            with patch.dict(app.config, {"RATE_LIMIT_BACKEND": "redis"}):
+                self.assertRaises(ValueError, rate_limit.init_app, app)
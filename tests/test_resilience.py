@@ -0,0 +1,145 @@
+######################################################################
+# Copyright 2016, 2024 John J. Rofrano. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+######################################################################
+
+"""
+Test cases for the Resilience
+"""
+
+from unittest import TestCase
+from unittest.mock import MagicMock, patch
+from sqlalchemy.exc import OperationalError
+from wsgi import app
+from service.models import db, Product
+from service.common import metrics, resilience
+from service.common.resilience import (
+    CLOSED,
+    HALF_OPEN,
+    OPEN,
+    CircuitBreaker,
+    CircuitOpenError,
+    call,
+)
+
+DOWN = OperationalError("SELECT", {}, ConnectionResetError())
+
+
+######################################################################
+#  R E S I L I E N C E   T E S T   C A S E S
+######################################################################
+class TestResilience(TestCase):
+    """Resilience Tests"""
+
+    def setUp(self):
+        self.context = app.app_context()
+        self.context.push()
+        self.breaker = CircuitBreaker(min_calls=4, window=10, reset_timeout=30)
+        metrics.reset()
+
+    def tearDown(self):
+        db.session.remove()
+        self.context.pop()
+
+    def _fail(self, count: int):
+        """Records count failed calls"""
+        for _ in range(count):
+            self.breaker.allow()
+            self.breaker.record(True)
+
+    def test_opens_on_error_rate(self):
+        """It should open once the share of failures crosses the threshold"""
+        self.breaker.record(False)
+        self._fail(2)
+        self.assertEqual(self.breaker.state, CLOSED)
+        # calls that did not use the database do not count
+        self.breaker.record(None)
+        self.assertEqual(self.breaker.state, CLOSED)
+        self._fail(1)
+        self.assertEqual(self.breaker.state, OPEN)
+        with self.assertRaises(CircuitOpenError) as context:
+            self.breaker.allow()
+        self.assertAlmostEqual(context.exception.retry_after, 30, delta=1)
+        self.assertEqual(metrics.value("circuit_opened"), 1)
+        self.assertEqual(metrics.value("circuit_rejected"), 1)
+
+    def test_window(self):
+        """It should forget the outcomes older than the window"""
+        with patch("service.common.resilience.time.monotonic", return_value=100.0):
+            self._fail(3)
+        with patch("service.common.resilience.time.monotonic", return_value=111.0):
+            self._fail(1)
+        self.assertEqual(self.breaker.state, CLOSED)
+
+    def test_half_open(self):
+        """It should let one trial call through after the reset timeout"""
+        self._fail(4)
+        with patch("service.common.resilience.time.monotonic", return_value=1e12):
+            self.breaker.allow()
+            self.assertEqual(self.breaker.state, HALF_OPEN)
+            self.assertRaises(CircuitOpenError, self.breaker.allow)
+            # a trial that did not reach the database proves nothing
+            self.breaker.record(None)
+            self.breaker.allow()
+            self.breaker.record(True)
+        self.assertEqual(self.breaker.state, OPEN)
+        with patch("service.common.resilience.time.monotonic", return_value=2e12):
+            self.breaker.allow()
+            self.breaker.record(False)
+        self.assertEqual(self.breaker.state, CLOSED)
+
+    def test_retry_reads(self):
+        """It should retry transient errors of idempotent calls"""
+        function = MagicMock(side_effect=[DOWN, DOWN, "result"])
+        cleanup = MagicMock()
+        with patch("service.common.resilience.time.sleep") as sleep_mock:
+            result = call(function, self.breaker, tries=3, delay=0.1, cleanup=cleanup)
+        self.assertEqual(result, "result")
+        self.assertEqual(cleanup.call_count, 2)
+        delays = [args[0] for args, _ in sleep_mock.call_args_list]
+        self.assertLessEqual(delays[0], 0.2)
+        self.assertLessEqual(delays[1], 0.4)
+        self.assertEqual(metrics.value("database_retries"), 2)
+
+    def test_no_retry_of_writes(self):
+        """It should try calls that are not idempotent once"""
+        function = MagicMock(side_effect=DOWN)
+        self.assertRaises(OperationalError, call, function, self.breaker)
+        function.assert_called_once()
+
+    def test_outcomes(self):
+        """It should only count the calls that used the database"""
+        breaker = MagicMock()
+        self.assertEqual(call(lambda: 1, breaker), 1)
+        breaker.record.assert_called_with(None)
+        self.assertEqual(call(lambda: Product.find(0), breaker), None)
+        breaker.record.assert_called_with(False)
+        self.assertRaises(KeyError, call, lambda: {}["missing"], breaker)
+        breaker.record.assert_called_with(None)
+
+    def test_fail_fast(self):
+        """It should not call the function while the circuit is open"""
+        self._fail(4)
+        function = MagicMock()
+        self.assertRaises(CircuitOpenError, call, function, self.breaker, 3)
+        function.assert_not_called()
+
+    def test_init_app(self):
+        """It should set up the breaker from the configuration"""
+        with patch.dict(app.extensions), patch.dict(
+            app.config, {"CIRCUIT_BREAKER_MIN_CALLS": 7}
+        ):
+            breaker = resilience.init_app(app)
+            self.assertIs(app.extensions["circuit_breaker"], breaker)
+        self.assertEqual(breaker.min_calls, 7)
@@ -0,0 +1,110 @@
+######################################################################
+# Copyright 2016, 2024 John J. Rofrano. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+######################################################################
+
+"""
+Test cases for the Seed Data Generator
+"""
+
+from collections import Counter
+from datetime import datetime, timezone
+from unittest import TestCase
+from sqlalchemy import create_engine, func, select
+from sqlalchemy.orm import Session
+from service.models import Product
+from service.common.invalidation import ALL, PENDING
+from service.common.seed_data import (
+    COLUMNS,
+    SeedGenerator,
+    product_names,
+    write_batch,
+    zipf_cum_weights,
+)
+
+
+######################################################################
+#  S E E D   D A T A   T E S T   C A S E S
+######################################################################
+class TestSeedGenerator(TestCase):
+    """Seed Data Generator Tests"""
+
+    def test_batches_cover_count(self):
+        """It should generate exactly the requested number of rows"""
+        generator = SeedGenerator(seed=1)
+        sizes = [len(rows) for rows in generator.batches(25, 10)]
+        self.assertEqual(sizes, [10, 10, 5])
+        self.assertEqual(generator.generated, 25)
+
+    def test_row_shape(self):
+        """It should generate rows ordered like COLUMNS"""
+        row = SeedGenerator(seed=1).batch(1)[0]
+        self.assertEqual(len(row), len(COLUMNS))
+        data = dict(zip(COLUMNS, row))
+        self.assertTrue(data["sku"].startswith("SEED-"))
+        self.assertLessEqual(len(data["sku"]), 63)
+        self.assertIn(data["name"], product_names())
+        self.assertGreaterEqual(data["price_cents"], 1)
+        now = datetime.now(timezone.utc).replace(tzinfo=None)
+        self.assertLessEqual(data["created_time"], now)
+
+    def test_unique_skus_across_runs(self):
+        """It should never repeat a SKU between two generators"""
+        first = {row[0] for row in SeedGenerator(seed=1).batch(100)}
+        second = {row[0] for row in SeedGenerator(seed=1).batch(100)}
+        self.assertEqual(len(first), 100)
+        self.assertFalse(first & second)
+
+    def test_repeatable_with_seed(self):
+        """It should generate the same names and prices for the same seed"""
+        first = [row[1:4] for row in SeedGenerator(seed=3).batch(50)]
+        second = [row[1:4] for row in SeedGenerator(seed=3).batch(50)]
+        self.assertEqual(first, second)
+
+    def test_zipf_names(self):
+        """It should make the top ranked name the most popular"""
+        generator = SeedGenerator(name_skew=1.5, seed=5)
+        names = Counter(row[1] for row in generator.batch(5000))
+        self.assertEqual(names.most_common(1)[0][0], generator.names[0])
+
+    def test_zipf_weights(self):
+        """It should build cumulative Zipf weights"""
+        self.assertEqual(zipf_cum_weights(3, 0), [1, 2, 3])
+        weights = zipf_cum_weights(3, 1)
+        self.assertAlmostEqual(weights[-1], 1 + 1 / 2 + 1 / 3)
+
+    def test_no_likes(self):
+        """It should generate zero likes when the mean is zero"""
+        rows = SeedGenerator(mean_likes=0, seed=1).batch(10)
+        self.assertEqual({row[COLUMNS.index("likes")] for row in rows}, {0})
+
+    def test_bad_price_median(self):
+        """It should not accept a non-positive price median"""
+        self.assertRaises(ValueError, SeedGenerator, price_median=0)
+
+    def test_write_batch_insert(self):
+        """It should fall back to a bulk INSERT on other databases"""
+        engine = create_engine("sqlite://")
+        Product.__table__.create(engine)
+        with Session(engine) as session:
+            rows = SeedGenerator(seed=1).batch(20)
+            self.assertEqual(write_batch(session, Product.__table__, rows), 20)
+            self.assertEqual(session.info[PENDING], {ALL})
+            session.commit()
+            count = session.scalar(select(func.count()).select_from(Product))
+            self.assertEqual(count, 20)
+            stale = select(func.count()).where(
+                Product.updated_time < Product.created_time
+            )
+            self.assertEqual(session.scalar(stale), 0)
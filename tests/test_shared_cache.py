@@ -0,0 +1,146 @@
+######################################################################
+# Copyright 2016, 2024 John J. Rofrano. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+######################################################################
+
+"""
+Test cases for the Shared Cache
+"""
+
+import os
+import time
+import shutil
+import tempfile
+import multiprocessing
+from unittest import TestCase
+from unittest.mock import patch
+from wsgi import app
+from service.common import metrics, shared_cache
+from service.common.shared_cache import SEQUENCE, SharedCache
+
+
+def fill(path: str, keys: list) -> int:
+    """Stores a value for each key in a shared cache, returns how many were stored"""
+    cache = SharedCache("test", path, slots=64, slot_size=256)
+    stored = sum(cache.set(key, {"id": key}, cache.stamp(key)) for key in keys)
+    cache.close()
+    return stored
+
+
+######################################################################
+#  S H A R E D   C A C H E   T E S T   C A S E S
+######################################################################
+class TestSharedCache(TestCase):
+    """Shared Cache Tests"""
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, "cache")
+        self.cache = SharedCache("test", self.path, slots=64, slot_size=256)
+        metrics.reset()
+
+    def tearDown(self):
+        self.cache.close()
+        shutil.rmtree(self.directory)
+
+    def test_set_and_get(self):
+        """It should return the stored values and count hits and misses"""
+        self.assertIsNone(self.cache.get(1))
+        self.assertTrue(
+            self.cache.set(1, {"id": 1, "name": "hat"}, self.cache.stamp(1))
+        )
+        self.assertEqual(self.cache.get(1), {"id": 1, "name": "hat"})
+        # 65 lives in the same slot as 1 and replaces it
+        self.assertTrue(self.cache.set(65, {"id": 65}, self.cache.stamp(65)))
+        self.assertEqual(self.cache.get(1, "missing"), "missing")
+        self.assertEqual(self.cache.get(65), {"id": 65})
+        self.assertEqual(metrics.value("test_hits"), 2)
+        self.assertEqual(metrics.value("test_misses"), 2)
+
+    def test_stale_stamp(self):
+        """It should not store a value that was invalidated while computed"""
+        stamp = self.cache.stamp(1)
+        self.cache.delete(1)
+        self.assertFalse(self.cache.set(1, {"id": 1}, stamp))
+        stamp = self.cache.stamp(1)
+        self.cache.clear()
+        self.assertFalse(self.cache.set(1, {"id": 1}, stamp))
+        self.assertIsNone(self.cache.get(1))
+
+    def test_invalidation(self):
+        """It should drop deleted and cleared values"""
+        for key in (1, 2):
+            self.cache.set(key, {"id": key}, self.cache.stamp(key))
+        self.cache.delete(1)
+        self.assertIsNone(self.cache.get(1))
+        self.assertEqual(self.cache.get(2), {"id": 2})
+        self.cache.clear()
+        self.assertIsNone(self.cache.get(2))
+
+    def test_expiry(self):
+        """It should expire values after the ttl"""
+        self.cache.ttl = 60
+        self.cache.set(1, {"id": 1}, self.cache.stamp(1))
+        self.assertEqual(self.cache.get(1), {"id": 1})
+        with patch(
+            "service.common.shared_cache.time.time", return_value=time.time() + 61
+        ):
+            self.assertIsNone(self.cache.get(1))
+
+    def test_too_large(self):
+        """It should not store a value that does not fit in a slot"""
+        self.assertFalse(self.cache.set(1, {"name": "x" * 256}, self.cache.stamp(1)))
+        self.assertIsNone(self.cache.get(1))
+
+    def test_write_in_progress(self):
+        """It should report a miss rather than wait for a writer"""
+        self.cache.set(1, {"id": 1}, self.cache.stamp(1))
+        # pylint: disable=protected-access
+        offset = self.cache._offset(1)
+        sequence = self.cache._sequence(offset)
+        SEQUENCE.pack_into(self.cache._map, offset, sequence + 1)
+        self.assertIsNone(self.cache.get(1))
+
+    def test_layout_change(self):
+        """It should start over when the file was laid out for other settings"""
+        self.cache.set(1, {"id": 1}, self.cache.stamp(1))
+        same = SharedCache("test", self.path, slots=64, slot_size=256)
+        self.assertEqual(same.get(1), {"id": 1})
+        same.close()
+        other = SharedCache("test", self.path, slots=32, slot_size=256)
+        self.assertIsNone(other.get(1))
+        other.close()
+
+    def test_shared_across_processes(self):
+        """It should share the values with every process mapping the file"""
+        context = multiprocessing.get_context("fork")
+        with context.Pool(2) as pool:
+            stored = pool.starmap(fill, [(self.path, [1, 2]), (self.path, [3])])
+        self.assertEqual(stored, [2, 1])
+        for key in (1, 2, 3):
+            self.assertEqual(self.cache.get(key), {"id": key})
+
+    def test_init_app(self):
+        """It should only set up the cache when slots are configured"""
+        with patch.dict(app.extensions):
+            with patch.dict(app.config, {"PRODUCT_CACHE_SLOTS": 0}):
+                self.assertIsNone(shared_cache.init_app(app))
+            config = {"PRODUCT_CACHE_SLOTS": 64, "PRODUCT_CACHE_PATH": self.path}
+            self.cache.set(1, {"id": 1}, self.cache.stamp(1))
+            with patch.dict(app.config, config):
+                cache = shared_cache.init_app(app)
+            self.assertIs(app.extensions["product_cache"], cache)
+            # a new worker may have missed invalidations
+            self.assertIsNone(self.cache.get(1))
+            cache.close()
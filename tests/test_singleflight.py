@@ -0,0 +1,97 @@
+######################################################################
+# Copyright 2016, 2024 John J. Rofrano. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+######################################################################
+
+"""
+Test cases for the Single Flight
+"""
+
+import time
+import threading
+from unittest import TestCase
+from service.common import metrics
+from service.common.singleflight import SingleFlight
+
+
+######################################################################
+#  S I N G L E   F L I G H T   T E S T   C A S E S
+######################################################################
+class TestSingleFlight(TestCase):
+    """Single Flight Tests"""
+
+    def setUp(self):
+        self.flights = SingleFlight()
+        self.release = threading.Event()
+        self.calls = 0
+        metrics.reset()
+
+    def _slow_call(self, result):
+        """Counts the call and blocks until released"""
+        self.calls += 1
+        self.release.wait(5)
+        if isinstance(result, Exception):
+            raise result
+        return result
+
+    def _concurrent(self, key, result, count: int) -> list:
+        """Makes count concurrent calls for key, returns their outcomes"""
+        outcomes = []
+
+        def call():
+            try:
+                outcomes.append(self.flights.do(key, lambda: self._slow_call(result)))
+            except Exception as error:  # pylint: disable=broad-except
+                outcomes.append(error)
+
+        threads = [threading.Thread(target=call) for _ in range(count)]
+        for thread in threads:
+            thread.start()
+        while metrics.value("singleflight_shared") < count - 1:
+            time.sleep(0.001)
+        self.release.set()
+        for thread in threads:
+            thread.join()
+        return outcomes
+
+    def test_shared_result(self):
+        """It should make one call for identical concurrent callers"""
+        result = [{"id": 1}]
+        outcomes = self._concurrent("key", result, 10)
+        self.assertEqual(self.calls, 1)
+        self.assertEqual(len(outcomes), 10)
+        for outcome in outcomes:
+            self.assertIs(outcome, result)
+        self.assertEqual(len(self.flights), 0)
+
+    def test_shared_error(self):
+        """It should raise the error of the call to every caller"""
+        error = ConnectionError("database is down")
+        outcomes = self._concurrent("key", error, 5)
+        self.assertEqual(self.calls, 1)
+        self.assertEqual(outcomes, [error] * 5)
+        self.assertEqual(len(self.flights), 0)
+
+    def test_no_caching(self):
+        """It should call again once the call in flight finished"""
+        self.assertEqual(self.flights.do("key", lambda: 1), 1)
+        self.assertEqual(self.flights.do("key", lambda: 2), 2)
+        self.assertEqual(metrics.value("singleflight_shared"), 0)
+
+    def test_different_keys(self):
+        """It should not share calls between keys"""
+        self.release.set()
+        self.assertEqual(self.flights.do("a", lambda: self._slow_call("a")), "a")
+        self.assertEqual(self.flights.do("b", lambda: self._slow_call("b")), "b")
+        self.assertEqual(self.calls, 2)
@@ -0,0 +1,236 @@
+######################################################################
+# Copyright 2016, 2024 John J. Rofrano. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+######################################################################
+
+"""
+Test cases for the Catalog Snapshots
+"""
+
+# pylint: disable=duplicate-code
+import os
+import ast
+import shutil
+import logging
+import tempfile
+import zipfile
+from decimal import Decimal
+from unittest import TestCase
+from unittest.mock import patch
+from wsgi import app
+from service.models import db, Product
+from service.common.snapshot import (
+    HEADER_SIZE,
+    MAGIC,
+    Snapshot,
+    archive_snapshot,
+    snapshot_lock,
+)
+from tests.factories import ProductFactory
+
+
+######################################################################
+#  S N A P S H O T   T E S T   C A S E S
+######################################################################
+class TestSnapshot(TestCase):
+    """Catalog Snapshot Tests"""
+
+    @classmethod
+    def setUpClass(cls):
+        """This runs once before the entire test suite"""
+        app.config["TESTING"] = True
+        app.config["DEBUG"] = False
+        app.logger.setLevel(logging.CRITICAL)
+        app.app_context().push()
+
+    @classmethod
+    def tearDownClass(cls):
+        """This runs once after the entire test suite"""
+        db.session.close()
+
+    def setUp(self):
+        """This runs before each test"""
+        db.session.query(Product).delete()
+        db.session.commit()
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, "products")
+
+    def tearDown(self):
+        """This runs after each test"""
+        db.session.remove()
+        shutil.rmtree(self.directory)
+
+    def test_round_trip(self):
+        """It should read back every Product as it was serialized"""
+        products = ProductFactory.create_batch(5, name="Jeans")
+        products[0].description = None
+        products[1].name = "Calculator"
+        products[2].price = Decimal("0.05")
+        for product in products:
+            product.create()
+        manifest = Product.snapshot(self.path, chunk_size=2)
+        self.assertEqual(manifest["rows"], 5)
+        self.assertEqual(manifest["files"]["price_cents.npy"], "<i8")
+        self.assertEqual(manifest["files"]["updated_time.npy"], "<M8[us]")
+        expected = sorted(
+            (product.serialize() for product in products), key=lambda p: p["id"]
+        )
+        with Snapshot(self.path) as snapshot:
+            self.assertEqual(len(snapshot), 5)
+            self.assertEqual([snapshot.product(n) for n in range(5)], expected)
+            # the names are dictionary encoded
+            self.assertEqual(len(snapshot.array("name.dictionary.offsets")), 3)
+            self.assertEqual(sorted(snapshot.array("name.codes")), [0, 0, 0, 0, 1])
+            self.assertIsNotNone(snapshot.created_time.tzinfo)
+
+    def test_npy_headers(self):
+        """It should write .npy files that numpy can memory-map"""
+        for product in ProductFactory.create_batch(3):
+            product.create()
+        Product.snapshot(self.path)
+        with open(os.path.join(self.path, "likes.npy"), "rb") as file:
+            content = file.read()
+        magic, content = content[:8], content[8:]
+        self.assertEqual(magic, MAGIC)
+        size, content = int.from_bytes(content[:2], "little"), content[2:]
+        self.assertEqual(10 + size, HEADER_SIZE)
+        self.assertEqual(HEADER_SIZE % 64, 0)
+        header, data = content[:size].decode(), content[size:]
+        self.assertTrue(header.endswith("\n"))
+        self.assertEqual(
+            ast.literal_eval(header),
+            {"descr": "<i4", "fortran_order": False, "shape": (3,)},
+        )
+        self.assertEqual(data, bytes(3 * 4))
+
+    def test_empty_catalog(self):
+        """It should snapshot an empty catalog"""
+        manifest = Product.snapshot(self.path)
+        self.assertEqual(manifest["rows"], 0)
+        with Snapshot(self.path) as snapshot:
+            self.assertEqual(len(snapshot), 0)
+            self.assertEqual(len(snapshot.array("id")), 0)
+            self.assertEqual(list(snapshot.array("sku.offsets")), [0])
+
+    def test_replace_snapshot(self):
+        """It should switch to a new snapshot and remove the previous one"""
+        ProductFactory().create()
+        Product.snapshot(self.path)
+        previous = os.path.realpath(self.path)
+        with Snapshot(self.path) as old:
+            ProductFactory().create()
+            Product.snapshot(self.path)
+            # an open snapshot keeps reading the maps of the old files
+            self.assertEqual(len(old.array("id")), 1)
+        self.assertTrue(os.path.islink(self.path))
+        self.assertFalse(os.path.exists(previous))
+        with Snapshot(self.path) as snapshot:
+            self.assertEqual(len(snapshot), 2)
+        self.assertEqual(os.listdir(self.directory).count("products"), 1)
+        self.assertEqual(len(os.listdir(self.directory)), 2)
+
+    def test_failed_snapshot(self):
+        """It should keep the previous snapshot when writing fails"""
+        ProductFactory().create()
+        Product.snapshot(self.path)
+        previous = os.path.realpath(self.path)
+        with patch(
+            "service.common.snapshot.SnapshotWriter.write",
+            side_effect=OSError("disk full"),
+        ):
+            self.assertRaises(OSError, Product.snapshot, self.path)
+        self.assertEqual(os.path.realpath(self.path), previous)
+        self.assertEqual(len(os.listdir(self.directory)), 2)
+
+    def test_archive(self):
+        """It should bundle a snapshot into an uncompressed zip"""
+        ProductFactory().create()
+        Product.snapshot(self.path)
+        archive = archive_snapshot(self.path, self.path + ".zip")
+        with zipfile.ZipFile(archive) as bundle:
+            names = bundle.namelist()
+            self.assertIn("manifest.json", names)
+            self.assertIn("name.codes.npy", names)
+            for info in bundle.infolist():
+                self.assertEqual(info.compress_type, zipfile.ZIP_STORED)
+
+    def test_archive_resolved(self):
+        """It should archive the directory the snapshot path points at"""
+        ProductFactory().create()
+        Product.snapshot(self.path)
+        target = os.path.realpath(self.path)
+        with patch("service.common.snapshot.os.listdir", wraps=os.listdir) as listdir:
+            archive_snapshot(self.path, self.path + ".zip")
+        listdir.assert_called_once_with(target)
+
+    def test_snapshot_lock(self):
+        """It should let one writer at a time hold the snapshot lock"""
+        with snapshot_lock(self.path) as locked:
+            self.assertTrue(locked)
+            with snapshot_lock(self.path, blocking=False) as other:
+                self.assertFalse(other)
+        with snapshot_lock(self.path, blocking=False) as locked:
+            self.assertTrue(locked)
+
+    def test_not_a_snapshot(self):
+        """It should not map a file that is not a snapshot array"""
+        ProductFactory().create()
+        Product.snapshot(self.path)
+        with open(os.path.join(self.path, "id.npy"), "r+b") as file:
+            file.write(b"garbage")
+        self.assertRaises(ValueError, Snapshot, self.path)
+
+    def test_find(self):
+        """It should find a Product in the snapshot by id"""
+        products = ProductFactory.create_batch(3)
+        for product in products:
+            product.create()
+        Product.snapshot(self.path)
+        with Snapshot(self.path) as snapshot:
+            for product in products:
+                self.assertEqual(snapshot.find(product.id), product.serialize())
+            self.assertIsNone(snapshot.find(0))
+            self.assertIsNone(snapshot.find(products[-1].id + 1))
+
+    def test_search(self):
+        """It should filter and sort the snapshot like the list endpoint"""
+        prices = ["20.00", "10.00", "30.00", "20.00"]
+        products = [
+            ProductFactory(name="Jeans" if n % 2 else "Mouse", price=Decimal(price))
+            for n, price in enumerate(prices)
+        ]
+        for product in products:
+            product.create()
+        Product.snapshot(self.path)
+
+        def ids(products):
+            return [product["id"] for product in products]
+
+        first, second, third, fourth = (product.id for product in products)
+        with Snapshot(self.path) as snapshot:
+            self.assertEqual(ids(snapshot.search()), [first, second, third, fourth])
+            self.assertEqual(ids(snapshot.search(sku=products[2].sku)), [third])
+            self.assertEqual(ids(snapshot.search(name="Jeans")), [second, fourth])
+            self.assertEqual(ids(snapshot.search(name="Mug")), [])
+            self.assertEqual(ids(snapshot.search(min_price=20)), [first, third, fourth])
+            self.assertEqual(ids(snapshot.search(max_price=19.999)), [second])
+            self.assertEqual(
+                ids(snapshot.search(min_price=15, max_price=25)), [first, fourth]
+            )
+            self.assertEqual(
+                ids(snapshot.search(sort="price")), [second, first, fourth, third]
+            )
+            self.assertEqual(
+                ids(snapshot.search(sort="-price")), [third, first, fourth, second]
+            )